@@ -1,7 +1,13 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+import inspect
+import tempfile
 from datetime import datetime, timedelta
+from inventory_core import (
+    XLSX_MIME, Database, FrameCache, IngestWorker, Profiler, active_jobs, cancel_job, count_matching, delete_batch, delete_data,
+    delete_matching, file_digest, find_upload, frame_chunks, get_date_range, init_db, inspect_workbook, iter_range, list_batches,
+    expiring_lots, list_jobs, load_range, read_balances, read_job_report, read_page, rebuild_item_balances, search_transactions, slow_log, spool_file, write_csv, write_xlsx
+)
 
 # ==========================================
 # 1. ส่วนจัดการฐานข้อมูล (Database Management)
@@ -10,365 +16,474 @@ import os
 
 # หาที่อยู่ปัจจุบันของไฟล์โปรแกรม
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# สั่งให้สร้าง DB ในโฟลเดอร์เดียวกันนี้แหละ
+# ตั้งชื่อไฟล์ฐานข้อมูล (ใช้ชื่อใหม่เพื่อความชัวร์)
 DB_NAME = os.path.join(BASE_DIR, 'inventory_final.db')
+# คอลัมน์ที่หน้าจัดการข้อมูลใช้ (โหลดเฉพาะเท่านี้ ไม่ใช่ทั้งตาราง)
+MANAGE_COLS = ['id', 'date', 'item_name', 'quantity', 'action_type', 'batch_id']
+# ชื่อผู้นำเข้าที่บันทึกในรอบอัปโหลด (หน้าจอนี้ไม่มีระบบ Login)
+UPLOAD_USER = 'app.py'
 
-def init_db():
-    """สร้างฐานข้อมูลและตารางเก็บข้อมูลถ้ายังไม่มี"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            item_code TEXT,
-            item_name TEXT,
-            action_type TEXT,
-            quantity REAL,
-            unit TEXT,
-            category TEXT,
-            expiry_date TEXT,
-            department TEXT,
-            requester TEXT,
-            remark TEXT,
-            upload_time TEXT 
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_to_db(df, action_type):
-    """บันทึกข้อมูลจาก DataFrame ลงฐานข้อมูล"""
-    conn = sqlite3.connect(DB_NAME)
+# จำนวนแถวต่อหน้าของการค้นหา
+PAGE_SIZE = 50
+# จำนวนแถวต่อหน้าของตารางจัดการข้อมูล (อ่านจากฐานข้อมูลทีละหน้า)
+GRID_PAGE_SIZE = 100
+# st.dataframe รุ่นที่เลือกแถวได้ (on_select) ใช้เลือกแถวที่จะลบ รุ่นเก่าใช้ multiselect ของ ID ในหน้าที่แสดงแทน
+GRID_SELECT = 'on_select' in inspect.signature(st.dataframe).parameters
+# ขนาดสูงสุดของ Cache ข้อมูลที่ใช้ร่วมกันทุก Session (MB)
+CACHE_MAX_MB = 256
+# จำนวนงานนำเข้าล่าสุดที่แสดง และความถี่ในการ Poll สถานะขณะที่ยังมีงานค้าง (วินาที)
+JOB_LIST = 5
+JOB_REFRESH_SECONDS = 2
+# Rerun/งานที่ช้ากว่าเกณฑ์ (ms) ถูกบันทึกลง logs/slow_ops.log (ไฟล์เดียวกับ main.py แยกด้วยชื่อ App) ปรับได้ด้วย env INVENTORY_SLOW_MS
+SLOW_MS = int(os.environ.get('INVENTORY_SLOW_MS', 500))
+SLOW_LOG = os.path.join(BASE_DIR, 'logs', 'slow_ops.log')
+
+# การเข้าถึงฐานข้อมูล การนำเข้า และการคำนวณยอดทั้งหมดอยู่ใน inventory_core
+# ไฟล์นี้เก็บเฉพาะ Object ที่ใช้ร่วมกันทั้ง Process และการแสดงผล/ข้อความบนหน้าจอ
+@st.cache_resource
+def get_db():
+    return Database(DB_NAME)
+
+@st.cache_resource
+def get_frame_cache():
+    return FrameCache(CACHE_MAX_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_slow_log():
+    return slow_log(SLOW_LOG)
+
+@st.cache_resource
+def get_worker():
+    """Worker นำเข้าเบื้องหลัง 1 ตัวต่อ Process (เรียกหลัง init_db) งานที่ค้างจากการปิด App รอบก่อนจะถูกลบรายการแล้วเข้าคิวใหม่เอง"""
+    return IngestWorker(get_db()).start()
+
+def cached(key, tables, loader):
+    """โหลดผ่าน Cache กลาง (ข้อมูลที่ได้ใช้ร่วมกันทุก Session ห้ามแก้ไขในที่)"""
+    return get_frame_cache().fetch(get_db(), key, tables, loader)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def inspect_upload(digest, _data):
+    """เปิดไฟล์ครั้งเดียวต่อไฟล์ (Key = hash ของเนื้อไฟล์) คืน (ชื่อ Sheet, ตัวอย่าง 3 แถว, จำนวนแถว) ของ Sheet แรก"""
+    sheet, (preview, rows) = next(iter(inspect_workbook(_data).items()))
+    return sheet, preview, rows
+
+def upload_guard(digest, sheet, action_type, key):
+    """ถ้าไฟล์เดิม (hash ตรงกัน) เคยนำเข้าแล้ว ให้เตือนและต้องติ๊กยืนยันก่อนจึงจะบันทึกซ้ำได้"""
+    prev = find_upload(get_db(), digest, sheet, action_type)
+    if prev is None:
+        return True
+    st.warning(f"⚠️ ไฟล์นี้เคยนำเข้าแล้วเมื่อ {prev[0]} ({prev[1]:,} แถว) ถ้าบันทึกซ้ำยอดจะถูกนับ 2 ครั้ง")
+    return st.checkbox("ยืนยันนำเข้าซ้ำ", key=f"dup_{key}")
+
+def queue_upload(action_type, data, digest, sheet, total=None):
+    """เก็บไฟล์ลง spool แล้วส่งเข้าคิวนำเข้า Worker บันทึกทีละ Chunk อยู่เบื้องหลัง หน้าเว็บจึงไม่ค้างระหว่างบันทึกไฟล์ใหญ่
+
+    ทุก Chunk อยู่ในรอบอัปโหลดที่จองไว้ตอนส่งงาน ถ้าล้มเหลวหรือถูกยกเลิก รายการที่บันทึกไปแล้วจะถูกลบออกทั้งรอบ
+    """
+    path = spool_file(get_db(), data, digest)
+    job_id = get_worker().submit('material', action_type, path, sheet, total, upload=(digest, sheet), user=UPLOAD_USER)
+    st.success(f"📨 ส่งไฟล์เข้าคิวแล้ว (งาน #{job_id}) ดูความคืบหน้าได้ด้านล่าง หรือไปหน้าอื่นก่อนก็ได้")
+
+def show_job(job):
+    """แสดงสถานะของงานนำเข้า 1 งาน: Progress + ปุ่มยกเลิกขณะที่ยังค้าง, ผลลัพธ์เมื่อจบแล้ว"""
+    label = f"งาน #{job.id} ({job.action_type})"
+    if job.status in ('queued', 'running'):
+        total = int(job.total_rows) if pd.notna(job.total_rows) else 0
+        text = f"{'⏳ รอคิว' if job.status == 'queued' else '🔄 กำลังบันทึก'} {label}: {job.done_rows:,}" + (f" / {total:,} แถว" if total else " แถว")
+        c1, c2 = st.columns([5, 1])
+        c1.progress(min(job.done_rows / total, 1.0) if total else 0.0, text=text)
+        if c2.button("ยกเลิก", key=f"cancel_job_{job.id}"):
+            cancel_job(get_db(), job.id)
+    elif job.status == 'done':
+        batch = f" (รอบอัปโหลด #{job.batch_id})" if job.inserted else ""
+        st.success(f"✅ {label}: บันทึกเรียบร้อย {job.inserted:,} รายการ{batch}")
+    elif job.status == 'failed':
+        st.error(f"❌ {label}: เกิดข้อผิดพลาดในการบันทึก {job.error} (ลบรายการที่บันทึกไปแล้วของงานนี้ออกทั้งหมด)")
+    else:
+        st.warning(f"🚫 {label}: ยกเลิกแล้ว (ลบรายการที่บันทึกไปแล้วของงานนี้ออกทั้งหมด)")
+    if job.status in ('queued', 'running'):
+        return
+
+    # แถวที่ไม่ผ่านการตรวจ (วันที่/จำนวนไม่ถูกต้อง หรือเบิกเกินยอดคงเหลือ) ถูกข้ามไป แถวอื่นบันทึกตามปกติ
+    report = read_job_report(job.report)
+    if report['invalid_rows']:
+        kept = f" (แสดง {len(report['invalid']):,} แถวแรก)" if len(report['invalid']) < report['invalid_rows'] else ""
+        st.warning(f"⚠️ {label}: ข้ามแถวที่ข้อมูลไม่ถูกต้อง {report['invalid_rows']:,} แถว{kept} (row = แถวในไฟล์ Excel)")
+        st.dataframe(report['invalid'], hide_index=True)
+        export_button("📥 ดาวน์โหลดแถวที่ไม่ผ่าน", f"rejected_job{job.id}", lambda: [report['invalid']], f"rejected_job_{job.id}")
+
+def job_panel():
+    """รายการงานนำเข้าล่าสุดจากตาราง ingest_jobs
+
+    ขณะที่ยังมีงานค้าง ส่วนนี้เป็น Fragment ที่ Poll สถานะเองทุก JOB_REFRESH_SECONDS วินาทีโดยไม่ Rerun ทั้งหน้า
+    เมื่องานเสร็จหมดจะ Rerun ทั้งหน้าครั้งเดียวเพื่อหยุด Poll (Streamlit รุ่นที่ไม่มี Fragment ใช้ปุ่มอัปเดตแทน)
+    """
+    polling = hasattr(st, 'fragment') and active_jobs(get_db()) > 0
+
+    def show():
+        jobs = list_jobs(get_db(), JOB_LIST)
+        if jobs.empty:
+            return
+        st.subheader("📨 งานนำเข้าล่าสุด")
+        for job in jobs.itertuples():
+            show_job(job)
+        if polling and not jobs['status'].isin(['queued', 'running']).any():
+            st.rerun()
+
+    if polling:
+        st.fragment(run_every=JOB_REFRESH_SECONDS)(show)()
+    else:
+        show()
+        if not hasattr(st, 'fragment'):
+            st.button("🔄 อัปเดตสถานะงาน")
+
+def load_report(start=None, end=None, action_type=None):
+    """ดึงเฉพาะรายการในช่วงวันที่ start..end (YYYY-MM-DD) ผ่าน Index แทนการโหลดทั้งตาราง"""
     try:
-        df['action_type'] = action_type
-        batch_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        df['upload_time'] = batch_timestamp
-        
-        # แปลงวันที่ให้เป็นมาตรฐาน YYYY-MM-DD
-        for col in ['date', 'expiry_date']:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-        
-        # จัดการค่าว่างของรหัสวัสดุ
-        if 'item_code' in df.columns:
-            df['item_code'] = df['item_code'].fillna('-')
-
-        df.to_sql('transactions', conn, if_exists='append', index=False)
-        st.success(f"✅ บันทึกข้อมูล '{action_type}' เรียบร้อย! (Batch ID: {batch_timestamp})")
-        st.cache_data.clear() # ล้าง Cache เพื่อให้ข้อมูลอัปเดตทันที
-    except Exception as e:
-        st.error(f"❌ เกิดข้อผิดพลาดในการบันทึก: {e}")
-    finally:
-        conn.close()
+        return load_range(get_db(), 'transactions', start, end, action_type)
+    except:
+        return pd.DataFrame()
 
-def load_data():
-    """ดึงข้อมูลทั้งหมดจากฐานข้อมูล"""
-    conn = sqlite3.connect(DB_NAME)
+def load_balances():
+    """ดึงยอดคงเหลือรายวัสดุจากตาราง item_balances (ผ่าน Cache กลาง)"""
     try:
-        df = pd.read_sql_query("SELECT * FROM transactions ORDER BY date DESC, id DESC", conn)
+        return cached('item_balances', ('transactions',), lambda: read_balances(get_db()))
     except:
-        df = pd.DataFrame()
-    conn.close()
-    return df
-
-def delete_batch(batch_time):
-    """ลบข้อมูลตามรอบเวลาอัปโหลด (Undo)"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+        return pd.DataFrame()
+
+def load_lots(start=None, end=None):
+    """ล็อตรับเข้าที่ยังเหลือของและหมดอายุในช่วง start..end (ตัดจ่ายแบบ FIFO จากตาราง item_lots ผ่าน Cache กลาง)
+
+    ค้นผ่าน Index ของล็อตที่ยังเหลือของเรียงตามวันหมดอายุ ไม่ต้องไล่ยอดคงเหลือทุกวัสดุ
+    """
     try:
-        c.execute("DELETE FROM transactions WHERE upload_time = ?", (batch_time,))
-        conn.commit()
-        st.success(f"🗑️ ยกเลิกการอัปโหลดรอบ {batch_time} เรียบร้อย")
+        return cached(f'lots@{start}..{end}', ('transactions',), lambda: expiring_lots(get_db(), start, end))
+    except:
+        return pd.DataFrame()
+
+def export_button(label, name, chunks, key, **kw):
+    """ปุ่มดาวน์โหลดที่สร้างไฟล์เมื่อกดเท่านั้น (ไม่สร้างใหม่ทุกครั้งที่หน้าเว็บ Rerun)
+
+    chunks() คืน DataFrame ทีละ Chunk ซึ่งถูกเขียนต่อกันลงไฟล์ชั่วคราวบนดิสก์ (CSV หรือ Excel แบบ write-only)
+    """
+    c1, c2 = st.columns([1, 3])
+    fmt = c1.radio("รูปแบบไฟล์", ["CSV", "Excel"], horizontal=True, key=f"{key}_fmt", label_visibility="collapsed")
+    if c2.button(label, key=key, **kw):
+        ext, mime, write = ('csv', 'text/csv', write_csv) if fmt == "CSV" else ('xlsx', XLSX_MIME, write_xlsx)
+        with tempfile.TemporaryFile() as f:
+            with st.spinner("กำลังสร้างไฟล์..."):
+                write(chunks(), f)
+            f.seek(0)
+            c2.download_button(f"💾 บันทึก {name}.{ext}", f, f"{name}.{ext}", mime, key=f"{key}_dl")
+
+def remove_batch(batch_id):
+    """ลบข้อมูลทั้งรอบอัปโหลด (Undo) ตามรหัสรอบใน upload_batches"""
+    try:
+        delete_batch(get_db(), batch_id)
+        st.success(f"🗑️ ยกเลิกการอัปโหลดรอบ #{batch_id} เรียบร้อย")
         st.cache_data.clear()
     except Exception as e:
         st.error(f"เกิดข้อผิดพลาด: {e}")
-    finally:
-        conn.close()
 
-def delete_data(ids_to_delete):
+def data_grid(key):
+    """ตารางประวัติแบบแบ่งหน้าฝั่ง Server สำหรับเลือกแถวที่จะลบ
+
+    ตัวกรอง (คำค้น / ประเภท / ช่วงวันที่) ถูกส่งเป็น SQL แล้วอ่านทีละ GRID_PAGE_SIZE แถวแบบ Keyset ต่อจาก (date, id)
+    ของแถวสุดท้ายของหน้าก่อน (cursor ของหน้าที่ผ่านมาเก็บใน session_state) Browser จึงได้รับเฉพาะแถวของหน้าที่แสดง
+    คืน (ID ที่เลือกในหน้านี้, ตัวกรอง, จำนวนแถวที่ตรงกับตัวกรองทั้งหมด)
+    """
+    c1, c2, c3 = st.columns([2, 1, 2])
+    txt = c1.text_input("🔍 ค้นหา:", key=f"{key}_txt").strip()
+    action = c2.selectbox("ประเภท:", ["ทั้งหมด", "In", "Out"], key=f"{key}_act")
+    dates = c3.date_input("ช่วงวันที่:", [], key=f"{key}_dates")
+    filters = {'txt': txt, 'action_type': None if action == "ทั้งหมด" else action}
+    if len(dates) == 2:
+        filters.update(start=dates[0].strftime('%Y-%m-%d'), end=dates[1].strftime('%Y-%m-%d'))
+
+    # ตัวกรองเปลี่ยน -> กลับไปหน้าแรก
+    state = st.session_state.setdefault(f"{key}_pages", {'filters': None, 'cursors': [None]})
+    if state['filters'] != filters:
+        state.update(filters=filters, cursors=[None])
+    page, next_cursor = read_page(get_db(), 'transactions', MANAGE_COLS, filters, state['cursors'][-1], GRID_PAGE_SIZE)
+    total = count_matching(get_db(), 'transactions', filters)
+
+    # ปุ่มเปลี่ยนหน้าแก้ cursor ใน Callback ซึ่งทำงานก่อน Rerun ถัดไปอ่านข้อมูล
+    n1, n2, n3 = st.columns([1, 1, 4])
+    n1.button("◀️ ก่อนหน้า", key=f"{key}_prev", disabled=len(state['cursors']) == 1, on_click=state['cursors'].pop)
+    n2.button("ถัดไป ▶️", key=f"{key}_next", disabled=next_cursor is None, on_click=state['cursors'].append, args=(next_cursor,))
+    n3.caption(f"หน้า {len(state['cursors']):,} / {max(-(-total // GRID_PAGE_SIZE), 1):,} | ตรงกับตัวกรอง {total:,} แถว")
+
+    if GRID_SELECT:
+        event = st.dataframe(page, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row", key=f"{key}_grid")
+        return page['id'].iloc[event.selection.rows].tolist(), filters, total
+    st.dataframe(page, use_container_width=True, hide_index=True)
+    return st.multiselect("เลือก ID ที่ต้องการลบ (เฉพาะหน้านี้):", page['id'].tolist(), key=f"{key}_ids"), filters, total
+
+def report_page(key, action_type, columns):
+    """รายการทั้งหมดของประเภท action_type แบบแบ่งหน้าฝั่ง Server (โหมด "ทั้งหมด" ของรายงานประจำวัน)
+
+    อ่านทีละ GRID_PAGE_SIZE แถวแบบ Keyset เหมือน data_grid แทนการโหลดทั้งตาราง (และไฟล์ Archive ทุกเดือน) ทุกครั้งที่ Rerun
+    """
+    filters = {'action_type': action_type}
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    page, next_cursor = read_page(get_db(), 'transactions', columns, filters, cursors[-1], GRID_PAGE_SIZE)
+    total = count_matching(get_db(), 'transactions', filters)
+    n1, n2, n3 = st.columns([1, 1, 4])
+    n1.button("◀️ ก่อนหน้า", key=f"{key}_prev", disabled=len(cursors) == 1, on_click=cursors.pop)
+    n2.button("ถัดไป ▶️", key=f"{key}_next", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
+    n3.caption(f"หน้า {len(cursors):,} / {max(-(-total // GRID_PAGE_SIZE), 1):,} | ทั้งหมด {total:,} แถว (ไม่รวมข้อมูลใน Archive)")
+    st.dataframe(page[columns], use_container_width=True, hide_index=True)
+
+def remove_rows(ids_to_delete):
     """ลบข้อมูลทีละรายการตาม ID"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        if len(ids_to_delete) == 1:
-            c.execute(f"DELETE FROM transactions WHERE id = {ids_to_delete[0]}")
-        else:
-            c.execute(f"DELETE FROM transactions WHERE id IN {tuple(ids_to_delete)}")
-        conn.commit()
+        delete_data(get_db(), ids_to_delete)
         st.success(f"🗑️ ลบข้อมูลเรียบร้อยแล้ว")
         st.cache_data.clear()
     except Exception as e:
         st.error(f"เกิดข้อผิดพลาด: {e}")
-    finally:
-        conn.close()
+
+def remove_matching(filters):
+    """ลบทุกรายการที่ตรงกับตัวกรองของตารางด้วยคำสั่งเดียวฝั่งฐานข้อมูล (ไม่ต้องส่ง ID ทีละแถว)"""
+    try:
+        n = delete_matching(get_db(), 'transactions', filters)
+        st.success(f"🗑️ ลบข้อมูลเรียบร้อยแล้ว {n:,} รายการ")
+        st.cache_data.clear()
+    except Exception as e:
+        st.error(f"เกิดข้อผิดพลาด: {e}")
 
 # ==========================================
-# 2. ฟังก์ชันคำนวณและประมวลผล (Core Logic)
+# 2. ส่วนหน้าจอเว็บไซต์ (User Interface)
 # ==========================================
-def calculate_inventory(df):
-    """คำนวณยอดคงเหลือ และดึงข้อมูล Category/Expiry ที่ถูกต้องที่สุด"""
-    if df.empty:
-        return pd.DataFrame()
-    
-    # แปลงเป็น String เพื่อการจับคู่ที่แม่นยำ
-    df['item_code'] = df['item_code'].astype(str)
-    df['item_name'] = df['item_name'].astype(str)
-    
-    # 1. Group รวมยอด (In - Out)
-    balance_df = df.pivot_table(
-        index=['item_code', 'item_name'], 
-        columns='action_type', 
-        values='quantity', 
-        aggfunc='sum', 
-        fill_value=0
-    ).reset_index()
-    
-    # 2. หา Unit ล่าสุด
-    latest_unit = df.sort_values('date', ascending=False).drop_duplicates(subset=['item_code', 'item_name'])
-    
-    # 3. หา Category ที่ถูกต้อง (ไม่เอาค่าว่าง/ค่าขีด จากรายการเบิกออก)
-    valid_cats = df[(df['category'].notna()) & (df['category'] != '') & (df['category'] != '-') & (df['category'] != 'None')]
-    if not valid_cats.empty:
-        best_category = valid_cats.sort_values('date', ascending=False).drop_duplicates(subset=['item_code', 'item_name'])[['item_code', 'item_name', 'category']]
-    else:
-        best_category = pd.DataFrame(columns=['item_code', 'item_name', 'category'])
+st.set_page_config(page_title="Stock Manager (Admin)", layout="wide")
+init_db(get_db(), chemicals=False)
+get_worker()
+# จับเวลาทุกขั้นตอนของ Rerun นี้ งานที่ช้าเกินเกณฑ์ลง Log
+prof = Profiler('app', SLOW_MS, get_slow_log()).activate()
+# st.rerun()/st.stop() ไม่ใช่ Exception ธรรมดา (ไม่เข้า except) แต่ยังผ่าน finally: จบการจับเวลาได้ทุกรอบ
+choice, error = None, None
+try:
+    st.title("📦 ระบบบริหารจัดการวัสดุ (Stock Manager)")
 
-    # 4. หาวันหมดอายุ (เร็วที่สุด) จากรายการรับเข้า (In)
-    valid_expiry = df[(df['action_type'] == 'In') & (df['expiry_date'].notna()) & (df['expiry_date'] != '')]
-    if not valid_expiry.empty:
-        earliest_expiry = valid_expiry.groupby(['item_code', 'item_name'])['expiry_date'].min().reset_index()
-    else:
-        earliest_expiry = pd.DataFrame(columns=['item_code', 'item_name', 'expiry_date'])
+    menu = [
+        "📊 Dashboard & แจ้งเตือน", 
+        "📋 วัสดุทั้งหมด (All Materials)",
+        "🔍 ค้นหาวัสดุ (Search)",   
+        "📅 รายงานประจำวัน (Daily)", 
+        "📥 รับเข้า (In)", 
+        "📤 เบิกออก (Out)", 
+        "🔧 จัดการข้อมูล"
+    ]
+    choice = st.sidebar.radio("เมนูใช้งาน", menu)
+    cache_stats = get_frame_cache().stats()
+    st.sidebar.caption(f"🗄️ Cache: hit {cache_stats['hits']:,} | miss {cache_stats['misses']:,} | {cache_stats['entries']} ชุด ({cache_stats['mb']:.1f} MB)")
 
-    # 5. รวมข้อมูลทั้งหมดเข้าด้วยกัน
-    balance_df = pd.merge(balance_df, latest_unit[['item_code', 'item_name', 'unit']], on=['item_code', 'item_name'], how='left')
-    balance_df = pd.merge(balance_df, best_category, on=['item_code', 'item_name'], how='left')
-    balance_df = pd.merge(balance_df, earliest_expiry, on=['item_code', 'item_name'], how='left')
+    # --- หน้า 1: Dashboard ---
+    if choice == "📊 Dashboard & แจ้งเตือน":
+        balance_df = load_balances()
+        if not balance_df.empty:
 
-    # เติมค่าว่าง
-    balance_df['category'] = balance_df['category'].fillna('-')
-    balance_df['unit'] = balance_df['unit'].fillna('')
+            # ส่วนแจ้งเตือนวันหมดอายุ
+            st.markdown("### ⚠️ แจ้งเตือนวันหมดอายุ (Expiry Alerts)")
+            # รายล็อตที่ยังเหลือของ (ล็อตที่ถูกเบิกหมดตามลำดับ FIFO แล้วไม่นับ) Balance = ของที่เหลือในล็อต
+            today = datetime.now().strftime('%Y-%m-%d')
+            yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            next_30_days = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
 
-    # คำนวณคงเหลือ
-    if 'In' not in balance_df.columns: balance_df['In'] = 0.0
-    if 'Out' not in balance_df.columns: balance_df['Out'] = 0.0
-    
-    balance_df['Balance'] = balance_df['In'] - balance_df['Out']
-    
-    return balance_df
+            # แยกกลุ่ม หมดอายุแล้ว VS ใกล้หมด
+            expired = load_lots(None, yesterday)
+            near_expiry = load_lots(today, next_30_days)
 
-# ==========================================
-# 3. ส่วนหน้าจอเว็บไซต์ (User Interface)
-# ==========================================
-st.set_page_config(page_title="Stock Manager (Admin)", layout="wide")
-init_db()
-
-st.title("📦 ระบบบริหารจัดการวัสดุ (Stock Manager)")
-
-menu = [
-    "📊 Dashboard & แจ้งเตือน", 
-    "📋 วัสดุทั้งหมด (All Materials)",
-    "🔍 ค้นหาวัสดุ (Search)",   
-    "📅 รายงานประจำวัน (Daily)", 
-    "📥 รับเข้า (In)", 
-    "📤 เบิกออก (Out)", 
-    "🔧 จัดการข้อมูล"
-]
-choice = st.sidebar.radio("เมนูใช้งาน", menu)
-
-# --- หน้า 1: Dashboard ---
-if choice == "📊 Dashboard & แจ้งเตือน":
-    df = load_data()
-    if not df.empty:
-        balance_df = calculate_inventory(df)
-        
-        # ส่วนแจ้งเตือนวันหมดอายุ
-        st.markdown("### ⚠️ แจ้งเตือนวันหมดอายุ (Expiry Alerts)")
-        # หาเฉพาะรายการที่มีวันหมดอายุ
-        df_expiry_check = balance_df[balance_df['expiry_date'].notna()].copy()
-        
-        # กรองเฉพาะที่มีของเหลือ (Balance > 0)
-        in_stock_expiry = df_expiry_check[df_expiry_check['Balance'] > 0]
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        next_30_days = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-        
-        # แยกกลุ่ม หมดอายุแล้ว VS ใกล้หมด
-        expired = in_stock_expiry[in_stock_expiry['expiry_date'] < today]
-        near_expiry = in_stock_expiry[(in_stock_expiry['expiry_date'] >= today) & (in_stock_expiry['expiry_date'] <= next_30_days)]
-        
-        c1, c2 = st.columns(2)
-        with c1:
-            if not expired.empty:
-                st.error(f"⛔ หมดอายุแล้ว! (ตกค้างในสต๊อก): {len(expired)} รายการ")
-                st.dataframe(expired[['expiry_date', 'item_code', 'item_name', 'Balance']], hide_index=True)
-            else:
-                st.success("✅ ไม่มีวัสดุหมดอายุตกค้าง")
-        with c2:
-            if not near_expiry.empty:
-                st.warning(f"⚠️ กำลังจะหมดอายุ (ใน 30 วัน): {len(near_expiry)} รายการ")
-                st.dataframe(near_expiry[['expiry_date', 'item_code', 'item_name', 'Balance']], hide_index=True)
-            else:
-                st.success("✅ ไม่มีวัสดุใกล้หมดอายุเร็วๆ นี้")
-        
-        st.markdown("---")
-        
-        # Card สรุปยอดรวม
-        total_items = len(balance_df)
-        low_stock = len(balance_df[balance_df['Balance'] <= 0])
-        
-        c_m1, c_m2, c_m3 = st.columns(3)
-        c_m1.metric("📦 รายการวัสดุทั้งหมด", f"{total_items} รายการ")
-        c_m2.metric("⚠️ สินค้าหมด/ติดลบ", f"{low_stock} รายการ", delta_color="inverse")
-        c_m3.metric("📅 อัปเดตล่าสุด", datetime.now().strftime("%H:%M:%S"))
+            c1, c2 = st.columns(2)
+            with c1:
+                if not expired.empty:
+                    st.error(f"⛔ หมดอายุแล้ว! (ตกค้างในสต๊อก): {len(expired)} ล็อต")
+                    st.dataframe(expired[['expiry_date', 'item_code', 'item_name', 'Balance']], hide_index=True)
+                else:
+                    st.success("✅ ไม่มีวัสดุหมดอายุตกค้าง")
+            with c2:
+                if not near_expiry.empty:
+                    st.warning(f"⚠️ กำลังจะหมดอายุ (ใน 30 วัน): {len(near_expiry)} ล็อต")
+                    st.dataframe(near_expiry[['expiry_date', 'item_code', 'item_name', 'Balance']], hide_index=True)
+                else:
+                    st.success("✅ ไม่มีวัสดุใกล้หมดอายุเร็วๆ นี้")
 
-    else:
-        st.info("ยังไม่มีข้อมูลในระบบ กรุณานำเข้าไฟล์ Excel")
-
-# --- หน้า 2: วัสดุทั้งหมด ---
-elif choice == "📋 วัสดุทั้งหมด (All Materials)":
-    st.header("📋 สรุปรายการวัสดุทั้งหมด")
-    df = load_data()
-    
-    if not df.empty:
-        balance_df = calculate_inventory(df)
-        
-        # ตัวกรอง
-        c_search, c_filter = st.columns([2, 1])
-        with c_search:
-            search_txt = st.text_input("🔍 ค้นหา:", placeholder="พิมพ์รหัส หรือ ชื่อวัสดุ...")
-        with c_filter:
-            cats = ["ทั้งหมด"] + sorted([c for c in balance_df['category'].unique() if c != '-'])
-            sel_cat = st.selectbox("หมวดหมู่สินค้า:", cats)
-        
-        # Logic การกรอง
-        df_show = balance_df.copy()
-        if sel_cat != "ทั้งหมด":
-            df_show = df_show[df_show['category'] == sel_cat]
-        if search_txt:
-            mask = df_show.astype(str).apply(lambda x: x.str.contains(search_txt, case=False, na=False)).any(axis=1)
-            df_show = df_show[mask]
-        
-        # ปุ่ม Export CSV
-        csv = df_show.to_csv(index=False).encode('utf-8-sig')
-        st.download_button(
-            label="📥 ดาวน์โหลดตารางนี้เป็น Excel (CSV)",
-            data=csv,
-            file_name='stock_all_materials.csv',
-            mime='text/csv',
-            type="primary"
-        )
-        
-        st.dataframe(
-            df_show[['item_code', 'item_name', 'category', 'In', 'Out', 'Balance', 'unit', 'expiry_date']],
-            use_container_width=True, hide_index=True,
-            column_config={
-                "item_code": "รหัส", "item_name": "ชื่อรายการ", "category": "หมวดหมู่",
-                "In": st.column_config.NumberColumn("รับเข้า", format="%.2f"),
-                "Out": st.column_config.NumberColumn("จ่ายออก", format="%.2f"),
-                "Balance": st.column_config.NumberColumn("คงเหลือ", format="%.2f"),
-                "expiry_date": st.column_config.DateColumn("วันหมดอายุ (เร็วสุด)", format="DD/MM/YYYY")
-            }
-        )
-    else:
-        st.info("ไม่มีข้อมูล")
-
-# --- หน้า 3: ค้นหาประวัติ ---
-elif choice == "🔍 ค้นหาวัสดุ (Search)":
-    st.header("🔍 ค้นหาประวัติรายตัว")
-    df = load_data()
-    if not df.empty:
-        search_term = st.text_input("พิมพ์รหัส หรือ ชื่อวัสดุ:", "")
+            st.markdown("---")
+
+            # Card สรุปยอดรวม
+            total_items = len(balance_df)
+            low_stock = len(balance_df[balance_df['Balance'] <= 0])
+
+            c_m1, c_m2, c_m3 = st.columns(3)
+            c_m1.metric("📦 รายการวัสดุทั้งหมด", f"{total_items} รายการ")
+            c_m2.metric("⚠️ สินค้าหมด/ติดลบ", f"{low_stock} รายการ", delta_color="inverse")
+            c_m3.metric("📅 อัปเดตล่าสุด", datetime.now().strftime("%H:%M:%S"))
+
+        else:
+            st.info("ยังไม่มีข้อมูลในระบบ กรุณานำเข้าไฟล์ Excel")
+
+    # --- หน้า 2: วัสดุทั้งหมด ---
+    elif choice == "📋 วัสดุทั้งหมด (All Materials)":
+        st.header("📋 สรุปรายการวัสดุทั้งหมด")
+        balance_df = load_balances()
+
+        if not balance_df.empty:
+
+            # ตัวกรอง
+            c_search, c_filter = st.columns([2, 1])
+            with c_search:
+                search_txt = st.text_input("🔍 ค้นหา:", placeholder="พิมพ์รหัส หรือ ชื่อวัสดุ...")
+            with c_filter:
+                cats = ["ทั้งหมด"] + sorted([c for c in balance_df['category'].unique() if c != '-'])
+                sel_cat = st.selectbox("หมวดหมู่สินค้า:", cats)
+
+            # Logic การกรอง
+            df_show = balance_df.copy()
+            if sel_cat != "ทั้งหมด":
+                df_show = df_show[df_show['category'] == sel_cat]
+            if search_txt:
+                mask = df_show.astype(str).apply(lambda x: x.str.contains(search_txt, case=False, na=False)).any(axis=1)
+                df_show = df_show[mask]
+
+            # ปุ่ม Export (สร้างไฟล์เมื่อกดเท่านั้น)
+            export_button("📥 ดาวน์โหลดตารางนี้", "stock_all_materials", lambda: frame_chunks(df_show), "dl_all", type="primary")
+
+            st.dataframe(
+                df_show[['item_code', 'item_name', 'category', 'In', 'Out', 'Balance', 'unit', 'expiry_date']],
+                use_container_width=True, hide_index=True,
+                column_config={
+                    "item_code": "รหัส", "item_name": "ชื่อรายการ", "category": "หมวดหมู่",
+                    "In": st.column_config.NumberColumn("รับเข้า", format="%.2f"),
+                    "Out": st.column_config.NumberColumn("จ่ายออก", format="%.2f"),
+                    "Balance": st.column_config.NumberColumn("คงเหลือ", format="%.2f"),
+                    "expiry_date": st.column_config.DateColumn("วันหมดอายุ (เร็วสุด)", format="DD/MM/YYYY")
+                }
+            )
+        else:
+            st.info("ไม่มีข้อมูล")
+
+    # --- หน้า 3: ค้นหาประวัติ ---
+    elif choice == "🔍 ค้นหาวัสดุ (Search)":
+        st.header("🔍 ค้นหาประวัติรายตัว")
+        c_search, c_page = st.columns([3, 1])
+        search_term = c_search.text_input("พิมพ์รหัส หรือ ชื่อวัสดุ:", "").strip()
+        page = c_page.number_input("หน้า:", min_value=1, value=1, step=1)
         if search_term:
-            mask = df.astype(str).apply(lambda x: x.str.contains(search_term, case=False, na=False)).any(axis=1)
-            res = df[mask]
-            if not res.empty:
-                in_sum = res[res['action_type']=='In']['quantity'].sum()
-                out_sum = res[res['action_type']=='Out']['quantity'].sum()
+            res, total, in_sum, out_sum = search_transactions(get_db(), search_term, page, PAGE_SIZE)
+            if total:
                 st.markdown(f"#### 🔢 สรุป: รับ {in_sum:,.2f} | จ่าย {out_sum:,.2f} | คงเหลือ {in_sum-out_sum:,.2f}")
+                st.caption(f"พบ {total:,} รายการ (หน้า {page}/{-(-total // PAGE_SIZE)})")
                 st.dataframe(res[['date', 'action_type', 'item_name', 'quantity', 'department', 'requester', 'remark']], use_container_width=True, hide_index=True)
             else:
                 st.warning("ไม่พบข้อมูล")
 
-# --- หน้า 4: รายงานประจำวัน ---
-elif choice == "📅 รายงานประจำวัน (Daily)":
-    st.header("🔎 รายงานประจำวัน")
-    df = load_data()
-    if not df.empty:
+    # --- หน้า 4: รายงานประจำวัน ---
+    elif choice == "📅 รายงานประจำวัน (Daily)":
+        st.header("🔎 รายงานประจำวัน")
         c_mode, c_date = st.columns([1, 2])
-        mode = c_mode.radio("โหมด:", ["รายวัน", "ทั้งหมด"])
-        
-        filter_df = df.copy()
-        if mode == "รายวัน":
-            s_date = c_date.date_input("เลือกวันที่:", datetime.now()).strftime('%Y-%m-%d')
-            filter_df = df[df['date'] == s_date]
-            st.caption(f"แสดงข้อมูลวันที่: {s_date}")
-            
-        if not filter_df.empty:
-            # ปุ่ม Export
-            csv_report = filter_df.to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 ดาวน์โหลดรายงานนี้ (CSV)", csv_report, "daily_report.csv", "text/csv")
-            
+        mode = c_mode.radio("โหมด:", ["รายวัน", "รายสัปดาห์", "รายเดือน", "กำหนดเอง", "ทั้งหมด"])
+
+        # ดึงเฉพาะช่วงวันที่ที่เลือกจากฐานข้อมูล (โหมด "ทั้งหมด" แสดงทีละหน้า ไม่โหลดทั้งตาราง)
+        start = end = None
+        if mode == "กำหนดเอง":
+            picked = c_date.date_input("เลือกช่วงวันที่:", (datetime.now() - timedelta(days=6), datetime.now()))
+            start, end = get_date_range(mode, picked)
+        elif mode != "ทั้งหมด":
+            picked = c_date.date_input("เลือกวันที่:", datetime.now())
+            start, end = get_date_range(mode, picked)
+        if start is not None:
+            st.caption(f"แสดงข้อมูลวันที่: {start}" if start == end else f"แสดงข้อมูลวันที่: {start} ถึง {end}")
+
+        in_cols = ['date','item_code','item_name','quantity','unit','expiry_date','remark']
+        out_cols = ['date','item_code','item_name','quantity','unit','department','requester']
+        if mode == "ทั้งหมด":
+            # ไฟล์ Export อ่านทุกรายการ (รวม Archive) ทีละ Chunk เมื่อกดปุ่มเท่านั้น
+            export_button("📥 ดาวน์โหลดรายการทั้งหมด", "all_transactions", lambda: iter_range(get_db(), 'transactions'), "dl_daily")
             t1, t2 = st.tabs(["📥 รายการรับเข้า", "📤 รายการเบิกออก"])
             with t1:
-                st.dataframe(filter_df[filter_df['action_type']=='In'][['date','item_code','item_name','quantity','unit','expiry_date','remark']], use_container_width=True, hide_index=True)
+                report_page("daily_in", 'In', in_cols)
             with t2:
-                st.dataframe(filter_df[filter_df['action_type']=='Out'][['date','item_code','item_name','quantity','unit','department','requester']], use_container_width=True, hide_index=True)
+                report_page("daily_out", 'Out', out_cols)
         else:
-            st.warning("ไม่มีรายการในช่วงเวลานี้")
-
-# --- หน้า 5: รับเข้า ---
-elif choice == "📥 รับเข้า (In)":
-    st.header("📥 นำเข้าข้อมูล: รับวัสดุ")
-    f = st.file_uploader("เลือกไฟล์ Excel (In)", type=['xlsx'], key='in')
-    if f:
-        d = pd.read_excel(f)
-        st.write("ตัวอย่างข้อมูล:", d.head(3))
-        if st.button("บันทึกรับเข้า"):
-            cmap = {'วันที่รับเข้า':'date', 'รหัสวัสดุ':'item_code', 'คำอธิบาย':'item_name', 
-                    'จำนวน':'quantity', 'หน่วย':'unit', 'วันที่หมดอายุ':'expiry_date', 
-                    'ประเภทวัสดุ':'category', 'หมายเหตุ':'remark'}
-            d = d.rename(columns=cmap)
-            req = ['date','item_code','item_name','quantity','unit','expiry_date','category','remark']
-            for c in req: 
-                if c not in d.columns: d[c] = None
-            save_to_db(d[req], 'In')
-
-# --- หน้า 6: เบิกออก ---
-elif choice == "📤 เบิกออก (Out)":
-    st.header("📤 นำเข้าข้อมูล: เบิกวัสดุ")
-    f = st.file_uploader("เลือกไฟล์ Excel (Out)", type=['xlsx'], key='out')
-    if f:
-        d = pd.read_excel(f)
-        st.write("ตัวอย่างข้อมูล:", d.head(3))
-        if st.button("บันทึกเบิกออก"):
-            cmap = {'วันที่เบิกจ่าย':'date', 'รหัสวัสดุ':'item_code', 'คำอธิบาย':'item_name', 
-                    'จำนวนที่เบิก':'quantity', 'หน่วย':'unit', 'หน่วยงานที่เบิก':'department', 
-                    'ผู้ที่ทำการเบิก':'requester', 'หมายเหตุ':'remark'}
-            d = d.rename(columns=cmap)
-            req = ['date','item_code','item_name','quantity','unit','department','requester','remark']
-            for c in req: 
-                if c not in d.columns: d[c] = None
-            save_to_db(d[req], 'Out')
-
-# --- หน้า 7: จัดการข้อมูล ---
-elif choice == "🔧 จัดการข้อมูล":
-    st.header("🔧 ลบหรือแก้ไขข้อมูล")
-    df = load_data()
-    if not df.empty:
-        t1, t2 = st.tabs(["ลบตามรอบอัปโหลด (Undo)", "ลบรายบรรทัด"])
+            in_df = load_report(start, end, 'In')
+            out_df = load_report(start, end, 'Out')
+
+            if not in_df.empty or not out_df.empty:
+                # ปุ่ม Export (อ่านจากฐานข้อมูลทีละ Chunk เมื่อกดเท่านั้น)
+                export_button("📥 ดาวน์โหลดรายงานนี้", "daily_report", lambda: iter_range(get_db(), 'transactions', start, end), "dl_daily")
+
+                t1, t2 = st.tabs(["📥 รายการรับเข้า", "📤 รายการเบิกออก"])
+                with t1:
+                    st.dataframe(in_df[in_cols], use_container_width=True, hide_index=True)
+                with t2:
+                    st.dataframe(out_df[out_cols], use_container_width=True, hide_index=True)
+            else:
+                st.warning("ไม่มีรายการในช่วงเวลานี้")
+
+    # --- หน้า 5: รับเข้า ---
+    elif choice == "📥 รับเข้า (In)":
+        st.header("📥 นำเข้าข้อมูล: รับวัสดุ")
+        f = st.file_uploader("เลือกไฟล์ Excel (In)", type=['xlsx'], key='in')
+        if f:
+            data = f.getvalue()
+            digest = file_digest(data)
+            sheet, preview, rows = inspect_upload(digest, data)
+            st.write("ตัวอย่างข้อมูล:", preview)
+            if upload_guard(digest, sheet, 'In', 'in') and st.button("บันทึกรับเข้า"):
+                queue_upload('In', data, digest, sheet, rows)
+        job_panel()
+
+    # --- หน้า 6: เบิกออก ---
+    elif choice == "📤 เบิกออก (Out)":
+        st.header("📤 นำเข้าข้อมูล: เบิกวัสดุ")
+        f = st.file_uploader("เลือกไฟล์ Excel (Out)", type=['xlsx'], key='out')
+        if f:
+            data = f.getvalue()
+            digest = file_digest(data)
+            sheet, preview, rows = inspect_upload(digest, data)
+            st.write("ตัวอย่างข้อมูล:", preview)
+            if upload_guard(digest, sheet, 'Out', 'out') and st.button("บันทึกเบิกออก"):
+                queue_upload('Out', data, digest, sheet, rows)
+        job_panel()
+
+    # --- หน้า 7: จัดการข้อมูล ---
+    elif choice == "🔧 จัดการข้อมูล":
+        st.header("🔧 ลบหรือแก้ไขข้อมูล")
+        t1, t2, t3 = st.tabs(["ลบตามรอบอัปโหลด (Undo)", "ลบรายบรรทัด", "ตรวจสอบยอดคงเหลือ"])
         with t1:
-            if 'upload_time' in df.columns:
-                times = df['upload_time'].unique()
-                sel = st.selectbox("เลือกเวลาที่อัปโหลดผิด:", times)
-                st.write(df[df['upload_time']==sel].head())
+            # รายการรอบอัปโหลดอ่านจากตาราง upload_batches (ไม่ต้องไล่หาค่าไม่ซ้ำจากประวัติทั้งตาราง)
+            batches = list_batches(get_db()).set_index('id')
+            if not batches.empty:
+                sel = st.selectbox("เลือกรอบที่อัปโหลดผิด:", batches.index.tolist(),
+                                   format_func=lambda b: f"#{b} | {batches.at[b, 'upload_time']} | {batches.at[b, 'action_type']} | {batches.at[b, 'rows']:,} แถว | {batches.at[b, 'sheet'] or '-'}")
+                # ตัวอย่าง 5 แถวแรกของรอบ อ่านผ่าน Index ของ batch_id
+                st.write(read_page(get_db(), 'transactions', MANAGE_COLS, {'batch_id': sel}, None, 5)[0])
                 if st.button("ลบข้อมูลรอบนี้ทั้งหมด", type="primary"):
-                    delete_batch(sel)
+                    remove_batch(sel)
                     st.rerun()
         with t2:
-            st.dataframe(df[['id','date','item_name','quantity','action_type']], use_container_width=True)
-            ids = st.multiselect("เลือก ID ที่ต้องการลบ:", df['id'])
-            if st.button("ยืนยันลบรายการที่เลือก"):
-                delete_data(ids)
-                st.rerun()
\ No newline at end of file
+            ids, filters, total = data_grid('grid')
+            if st.button(f"ยืนยันลบรายการที่เลือก ({len(ids)})", disabled=not ids):
+                remove_rows(ids)
+                st.rerun()
+            # ลบทั้งหมดที่ตรงกับตัวกรอง: ต้องมีตัวกรองอย่างน้อย 1 อย่างและติ๊กยืนยันก่อน
+            if total and any(filters.values()) and st.checkbox(f"ยืนยันลบทั้ง {total:,} แถวที่ตรงกับตัวกรอง"):
+                if st.button("ลบทั้งหมดที่ตรงกับตัวกรอง", type="primary"):
+                    remove_matching(filters)
+                    st.rerun()
+        with t3:
+            st.caption("สร้างตาราง item_balances ใหม่จากประวัติทั้งหมด และตรวจสอบว่ายอดที่เก็บไว้ตรงกับประวัติหรือไม่")
+            if st.button("🔁 Rebuild ยอดคงเหลือ"):
+                drift = rebuild_item_balances(get_db())
+                if drift.empty:
+                    st.success("✅ ยอดคงเหลือตรงกับประวัติทั้งหมด")
+                else:
+                    st.warning(f"⚠️ พบยอดไม่ตรง {len(drift)} แถว (แก้ไขแล้ว)")
+                    st.dataframe(drift, hide_index=True)
+except Exception as e:
+    error = e
+    raise
+finally:
+    # Rerun ที่ออกกลางทาง (rerun/stop/error) ยังลง Log ถ้าช้า, Rerun ที่ error ลง Log เสมอ แล้วคืน Connection อ่านเข้า Pool
+    prof.finish(choice, error)
+    get_db().release_reader()
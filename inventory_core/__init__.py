@@ -0,0 +1,32 @@
+"""แกนกลางของระบบคลังวัสดุ ใช้ร่วมกันโดย main.py, app.py, user_view.py และงาน Batch (python -m inventory_core)
+
+ไม่ขึ้นกับ Streamlit และ import ได้ทันที: pandas / openpyxl ถูก import เมื่อเรียกฟังก์ชันที่ต้องใช้เท่านั้น
+ฟังก์ชันทั้งหมดรับ Database เป็นอาร์กิวเมนต์แรก และแจ้งข้อผิดพลาดด้วย Exception (หน้าจอเป็นผู้แสดงข้อความเอง)
+"""
+from .archive import (ARCHIVE_BATCH, ARCHIVE_KEEP_MONTHS, archive_before, archive_cutoff, archive_preview,
+                      archive_root, archive_summary, cutoff_for, iter_archive, read_archive, search_archive)
+from .balances import (BALANCE_COLUMNS, INVENTORY_COLUMNS, ITEM_BALANCE_FROM, ITEM_BALANCE_SELECT, BalanceSnapshot, build_checkpoint,
+                       build_checkpoints, calculate_inventory, change_marker, invalidate_checkpoints, read_balances,
+                       rebuild_item_balances, refresh_item_balances)
+from .bench import BENCH_SCALES, find_regressions, run_benchmarks, synthetic_chemicals, synthetic_materials
+from .cache import FrameCache, data_stamp
+from .chemicals import (CHEM_MAPPING, CHEM_PATTERNS, CHEM_REGEX, CHEMICAL_CONFIG, calculate_chem_balance, chem_level_history,
+                        chem_levels_as_of, clean_text, convert_chem_chunk, ledger_starts, read_chem_levels, refresh_chem_ledger,
+                        resolve_chem_code, resolve_chem_codes)
+from .db import BUSY_TIMEOUT_MS, READER_POOL_SIZE, SQLITE_PRAGMAS, WRITE_RETRIES, Database, has_table
+from .export import XLSX_MIME, arrow_schema, frame_chunks, write_csv, write_parquet, write_xlsx
+from .frames import compact_frame, frame_bytes, memory_report
+from .ingest import (CHEM_COLUMNS, CHUNK_ROWS, DATE_PATTERNS, DAY_FIRST, MATERIAL_COLUMNS, IngestError, as_chunks, check_stock,
+                     count_rows, empty_chem_report, empty_material_report, file_digest, find_upload, insert_chemicals, insert_materials,
+                     inspect_workbook, normalize_materials, open_workbook, parse_dates, parse_quantity, path_digest, preview_sheet,
+                     read_file_chunks, read_sheet_chunks, record_batch, row_errors, sheet_rows, to_records, upload_stamp,
+                     validate_materials)
+from .items import item_keys, lookup_items, merge_items, read_items, resolve_items
+from .jobs import (JOB_TABLES, IngestWorker, active_jobs, cancel_job, list_jobs, read_report as read_job_report, recover_jobs,
+                   spool_file, submit_job)
+from .lots import FIFO_REMAINING, expiring_lots, refresh_item_lots
+from .profiling import SLOW_LOG_MS, Profiler, profile, read_frame, slow_log, timed, timed_iter
+from .queries import (PAGE_SIZE, balances_as_of, clear_batch, count_matching, delete_batch, delete_data, delete_matching,
+                      get_date_range, grid_filter, iter_range, list_batches, load_range, read_page, read_sql, read_table,
+                      search_balances, search_filter, search_transactions)
+from .schema import FTS_COLUMNS, init_db
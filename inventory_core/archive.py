@@ -0,0 +1,279 @@
+"""เก็บถาวร (Archive) รายการเก่าเป็นไฟล์ Parquet แยกตามปี/เดือน แทนที่ด้วยแถวยอดยกมา เพื่อให้ตารางใน SQLite เล็กและเร็ว
+
+ไฟล์อยู่ที่ archive/<ชื่อฐานข้อมูล>/<ตาราง>/year=YYYY/month=MM/part-*.parquet ข้างไฟล์ฐานข้อมูล
+ตาราง archive_periods คือรายการไฟล์ที่ใช้ได้ (ไฟล์ที่ไม่อยู่ในตารางนี้ถือว่าไม่มี) และ cutoff = วันแรกที่ยังอยู่ใน SQLite
+
+แถวยอดยกมา: ต่อวัสดุ/ถัง แถว In (ยอดรับรวม; วัสดุแยกตามล็อตที่ยังเหลือของ) + 1 แถว Out (ยอดจ่ายรวม) ลงวันที่วันก่อน cutoff
+เฉพาะแถวที่จำนวนไม่เป็น 0 (ไม่มีแถวยอดยกมาเปล่า ๆ รกประวัติ / ผลค้นหา / Ledger)
+upload_time ขึ้นต้นด้วย ARCHIVE_BATCH ยอดคงเหลือ / Ledger / calculate_inventory จึงคำนวณได้เหมือนเดิมโดยไม่ต้องแก้
+การอ่านช่วงวันที่ที่ย้อนไปก่อน cutoff จะอ่านจากไฟล์แทนแถวยอดยกมา
+"""
+import os
+from datetime import date, timedelta
+
+from .balances import ITEM_BALANCE_FROM, ITEM_BALANCE_SELECT, build_checkpoint, has_checkpoint, refresh_item_balances
+from .chemicals import CHEMICAL_CONFIG, refresh_chem_ledger
+from .db import has_table
+from .export import arrow_schema
+from .ingest import upload_stamp
+from .lots import FIFO_REMAINING
+from .schema import FTS_COLUMNS
+
+# upload_time ของแถวยอดยกมา (ห้ามลบแบบรอบอัปโหลด และไม่รวมในรายงานช่วงที่อ่านจาก Archive)
+ARCHIVE_BATCH = 'ARCHIVE'
+# เงื่อนไข SQL: เฉพาะรายการจริง (ไม่ใช่แถวยอดยกมา)
+REAL_ROWS = f"IFNULL(upload_time, '') NOT LIKE '{ARCHIVE_BATCH} %'"
+# ค่าเริ่มต้น: เก็บรายการย้อนหลังไว้ใน SQLite กี่เดือน (นับเดือนปัจจุบัน)
+ARCHIVE_KEEP_MONTHS = 12
+ARCHIVE_TABLES = ('transactions', 'chemical_transactions')
+
+
+def archive_root(db):
+    """โฟลเดอร์เก็บไฟล์ Archive ของฐานข้อมูลนี้ (ข้างไฟล์ .db)"""
+    base = os.path.dirname(os.path.abspath(db.path))
+    return os.path.join(base, 'archive', os.path.splitext(os.path.basename(db.path))[0])
+
+
+def cutoff_for(months, today=None):
+    """วันแรกของเดือนที่เก่าที่สุดที่ยังเก็บใน SQLite (months=12 ในเดือน 2026-10 -> '2025-11-01')"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+
+def day_before(day):
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def archive_cutoff(conn):
+    """วันที่แรกที่ยังอยู่ใน SQLite ทั้งหมด (None = ยังไม่เคย Archive)"""
+    if not has_table(conn, 'archive_periods'):
+        return None
+    return conn.execute("SELECT MAX(cutoff) FROM archive_periods").fetchone()[0]
+
+
+def reaches_archive(conn, start):
+    """ช่วงวันที่ที่เริ่มจาก start (None = ทุกวันที่) ย้อนไปถึงข้อมูลใน Archive หรือไม่ คืน cutoff หรือ None"""
+    cutoff = archive_cutoff(conn)
+    return cutoff if cutoff and (start is None or start < cutoff) else None
+
+
+def archive_files(conn, root, table, start=None, end=None):
+    """ไฟล์ของตาราง table ที่มีเดือนคาบเกี่ยวช่วง start..end เรียงตามเดือน"""
+    sql, params = "SELECT path FROM archive_periods WHERE tbl = ?", [table]
+    if start:
+        sql += " AND month >= ?"
+        params.append(start[:7])
+    if end:
+        sql += " AND month <= ?"
+        params.append(end[:7])
+    return [os.path.join(root, p) for (p,) in conn.execute(sql + " ORDER BY month, path", params)]
+
+
+def range_filters(start=None, end=None, action_type=None):
+    filters = []
+    if start:
+        filters.append(('date', '>=', start))
+    if end:
+        filters.append(('date', '<=', end))
+    if action_type:
+        filters.append(('action_type', '=', action_type))
+    return filters or None
+
+
+def conform(data, schema):
+    """ตาราง Arrow จากไฟล์ Archive -> คอลัมน์ตามตารางปัจจุบัน (ไฟล์ที่เขียนก่อนเพิ่มคอลัมน์ เช่น item_id ได้ค่า null)"""
+    import pyarrow as pa
+
+    return pa.Table.from_arrays([data[f.name].cast(f.type) if f.name in data.column_names else pa.nulls(len(data), f.type)
+                                 for f in schema], schema=schema)
+
+
+def iter_archive(db, table, start=None, end=None, action_type=None, size=5000):
+    """อ่านรายการจาก Archive ทีละ size แถว (เรียงตามเดือน) ผ่าน Filter ของ Parquet (อ่านเฉพาะ Row group ที่ตรง)
+
+    ทุก Chunk มีคอลัมน์ตามตารางใน SQLite ปัจจุบัน แม้ไฟล์จะเขียนไว้ก่อนที่ตารางจะเพิ่มคอลัมน์
+    """
+    import pyarrow.parquet as pq
+
+    conn = db.reader()
+    if archive_cutoff(conn) is None:
+        return
+    schema = arrow_schema(conn, table)
+    for path in archive_files(conn, archive_root(db), table, start, end):
+        data = conform(pq.read_table(path, filters=range_filters(start, end, action_type)), schema)
+        for batch in data.to_batches(max_chunksize=size):
+            yield batch.to_pandas()
+
+
+def read_archive(db, table, start=None, end=None, action_type=None):
+    """รายการจาก Archive ในช่วงวันที่ (DataFrame เดียว; ช่วงกว้างมากให้ใช้ iter_archive)"""
+    import pandas as pd
+
+    frames = [df for df in iter_archive(db, table, start, end, action_type, size=1 << 30) if not df.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def search_archive(db, txt, limit=200, columns=FTS_COLUMNS):
+    """ค้นหาคำใน Archive ของ transactions (ไม่สนตัวพิมพ์เล็ก/ใหญ่) คืนไม่เกิน limit แถว เรียงจากล่าสุด"""
+    import pandas as pd
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    conn = db.reader()
+    if archive_cutoff(conn) is None or not txt:
+        return pd.DataFrame()
+    frames = []
+    for path in archive_files(conn, archive_root(db), 'transactions'):
+        data = pq.read_table(path)
+        mask = None
+        for col in columns:
+            if col not in data.column_names:
+                continue
+            hit = pc.fill_null(pc.match_substring(data[col].cast('string'), txt, ignore_case=True), False)
+            mask = hit if mask is None else pc.or_(mask, hit)
+        if mask is not None:
+            frames.append(data.filter(mask).to_pandas())
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).sort_values(['date', 'id'], ascending=False).head(limit)
+
+
+def archive_summary(db):
+    """สรุปไฟล์ Archive ต่อตาราง (เดือนแรก/สุดท้าย, จำนวนแถว, cutoff ล่าสุด)"""
+    import pandas as pd
+
+    conn = db.reader()
+    if not has_table(conn, 'archive_periods'):
+        return pd.DataFrame(columns=['tbl', 'first_month', 'last_month', 'files', 'rows', 'cutoff'])
+    return pd.read_sql_query('''
+        SELECT tbl, MIN(month) AS first_month, MAX(month) AS last_month, COUNT(*) AS files, SUM(rows) AS rows, MAX(cutoff) AS cutoff
+        FROM archive_periods GROUP BY tbl ORDER BY tbl
+    ''', conn)
+
+
+def archive_preview(db, cutoff):
+    """จำนวนรายการ (ไม่รวมแถวยอดยกมา) ที่จะถูกย้ายถ้า Archive ที่ cutoff นี้ {ตาราง: จำนวนแถว}"""
+    conn = db.reader()
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t} WHERE date < ? AND {REAL_ROWS}", (cutoff,)).fetchone()[0]
+            for t in ARCHIVE_TABLES if has_table(conn, t)}
+
+
+def carry_forward_materials(conn, cutoff, batch):
+    """แถวยอดยกมาของวัสดุ: ยอดรับ/จ่ายรวมของรายการก่อน cutoff ต่อวัสดุ
+
+    ยอดรับแยกเป็น ส่วนที่ถูกเบิกไปแล้ว (ลำดับแรก) + รายการรับเข้าที่ยังเหลือของแบบ FIFO พร้อมวันหมดอายุเดิม
+    ล็อตวันหมดอายุ (item_lots) หลัง Archive จึงเหมือนเดิม
+    FIFO คิดจากรายการที่มีอยู่ก่อนเรียก (id <= last_id) เท่านั้น ไม่นับแถวยอดยกมาที่เพิ่งเพิ่มในรอบนี้ซ้ำ
+    """
+    last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions").fetchone()[0]
+    conn.execute("DROP TABLE IF EXISTS temp.carry")
+    conn.execute(f"CREATE TEMP TABLE carry AS {ITEM_BALANCE_SELECT} {ITEM_BALANCE_FROM} WHERE t.date < ? GROUP BY t.item_id", (cutoff,))
+    opening = day_before(cutoff)
+    conn.execute('''
+        INSERT INTO transactions (date, item_id, item_code, item_name, action_type, quantity, unit, category, remark, upload_time)
+        SELECT ?, item_id, item_code, item_name, 'In', MIN(qty_in, qty_out), unit, category, 'ยอดยกมา', ? FROM temp.carry
+        WHERE MIN(qty_in, qty_out) != 0
+    ''', (opening, batch))
+    conn.execute(f'''
+        INSERT INTO transactions (date, item_id, item_code, item_name, action_type, quantity, unit, category, expiry_date, remark, upload_time)
+        SELECT ?, o.item_id, o.item_code, o.item_name, 'In', r.remaining, o.unit, o.category, r.expiry_date, 'ยอดยกมา', ?
+        FROM (SELECT t.item_id, t.date, t.id, t.expiry_date, {FIFO_REMAINING} AS remaining
+              FROM transactions t JOIN temp.carry o ON o.item_id = t.item_id
+              WHERE t.date < ? AND t.action_type = 'In' AND t.id <= ?) r
+        JOIN temp.carry o ON o.item_id = r.item_id
+        WHERE r.remaining > 0 ORDER BY r.item_id, r.date, r.id
+    ''', (opening, batch, cutoff, last_id))
+    conn.execute('''
+        INSERT INTO transactions (date, item_id, item_code, item_name, action_type, quantity, unit, category, remark, upload_time)
+        SELECT ?, item_id, item_code, item_name, 'Out', qty_out, unit, category, 'ยอดยกมา', ? FROM temp.carry WHERE qty_out != 0
+    ''', (opening, batch))
+    ids = [i for (i,) in conn.execute("SELECT item_id FROM temp.carry")]
+    conn.execute("DROP TABLE temp.carry")
+    return ids
+
+
+def carry_forward_chemicals(conn, cutoff, batch):
+    """แถวยอดยกมาของสารเคมี: ยอดรับ/จ่ายรวม (KG และ L) ของรายการก่อน cutoff ต่อถัง"""
+    totals = conn.execute('''
+        SELECT chem_code,
+               TOTAL(CASE WHEN action_type = 'In' THEN qty_kg END), TOTAL(CASE WHEN action_type = 'In' THEN qty_l END),
+               TOTAL(CASE WHEN action_type = 'Out' THEN qty_kg END), TOTAL(CASE WHEN action_type = 'Out' THEN qty_l END),
+               (SELECT density FROM chemical_transactions d WHERE d.chem_code = c.chem_code ORDER BY date DESC, id DESC LIMIT 1)
+        FROM chemical_transactions c WHERE date < ? GROUP BY chem_code
+    ''', (cutoff,)).fetchall()
+    opening = day_before(cutoff)
+    rows = []
+    for code, in_kg, in_l, out_kg, out_l, density in totals:
+        name = CHEMICAL_CONFIG.get(code, {}).get('name', '')
+        if in_kg or in_l:
+            rows.append((opening, code, name, 'In', in_kg, in_l, density, '', 'ยอดยกมา', batch))
+        if out_kg or out_l:
+            rows.append((opening, code, name, 'Out', out_kg, out_l, density, '', 'ยอดยกมา', batch))
+    conn.executemany('''
+        INSERT INTO chemical_transactions (date, chem_code, chem_desc, action_type, qty_kg, qty_l, density, department, requester, upload_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return {code: '' for code, *_ in totals}
+
+
+def archive_before(db, cutoff, now=None):
+    """ย้ายรายการที่ date < cutoff (วันแรกของเดือน YYYY-MM-01) ของทุกตารางไปเป็นไฟล์ Parquet รายเดือน แล้วแทนด้วยแถวยอดยกมา
+
+    ทำใน Transaction เดียว (ระหว่างนี้หน้าจออ่านได้ตามปกติ แต่การบันทึกอื่นต้องรอ) ถ้าล้มเหลวจะลบไฟล์ที่เขียนไปแล้ว
+    คืน {ตาราง: จำนวนแถวที่ย้ายไป Archive}
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if date.fromisoformat(cutoff).day != 1:
+        raise ValueError(f"cutoff ต้องเป็นวันแรกของเดือน: {cutoff}")
+    root = archive_root(db)
+    stamp = upload_stamp(now)
+    batch = f"{ARCHIVE_BATCH} {cutoff}"
+    written, moved = [], {}
+    try:
+        with db.write() as conn:
+            floor = archive_cutoff(conn)
+            for table in ARCHIVE_TABLES:
+                if not has_table(conn, table):
+                    continue
+                schema = arrow_schema(conn, table)
+                months = [m for (m,) in conn.execute(f"SELECT DISTINCT substr(date, 1, 7) FROM {table} WHERE date < ? AND {REAL_ROWS} ORDER BY 1", (cutoff,))]
+                moved[table] = 0
+                for month in months:
+                    # อ่าน/เขียนทีละเดือน หน่วยความจำไม่โตตามขนาดตาราง
+                    df = pd.read_sql_query(f"SELECT * FROM {table} WHERE date >= ? AND date < ? AND {REAL_ROWS} ORDER BY date, id",
+                                           conn, params=[f"{month}-01", (date.fromisoformat(f"{month}-28") + timedelta(days=4)).strftime('%Y-%m-01')])
+                    rel = os.path.join(table, f"year={month[:4]}", f"month={month[5:]}", f"part-{stamp.replace(' ', 'T').replace(':', '')}.parquet")
+                    path = os.path.join(root, rel)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False), path + '.tmp', compression='zstd')
+                    os.replace(path + '.tmp', path)
+                    written.append(path)
+                    conn.execute("INSERT INTO archive_periods (tbl, month, path, rows, cutoff, archived_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (table, month, rel, len(df), cutoff, stamp))
+                    moved[table] += len(df)
+                if not months:
+                    continue
+                # แถวยอดยกมาชุดใหม่รวมแถวยอดยกมาชุดเดิม (ถ้ามี) แล้วลบรายการเดิมทั้งหมดก่อน cutoff
+                last_id = conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+                if table == 'transactions':
+                    # Checkpoint ต้นเดือนที่ย้าย (และเดือน cutoff) สร้างก่อนลบรายการ ยอด ณ วันที่ก่อน cutoff จึงยังต่อจาก Checkpoint ได้
+                    for start in [f"{m}-01" for m in months] + [cutoff]:
+                        if start >= (floor or '') and not has_checkpoint(conn, start):
+                            build_checkpoint(conn, start, floor)
+                    ids = carry_forward_materials(conn, cutoff, batch)
+                    conn.execute("DELETE FROM transactions WHERE date < ? AND id <= ?", (cutoff, last_id))
+                    refresh_item_balances(conn, ids)
+                else:
+                    starts = carry_forward_chemicals(conn, cutoff, batch)
+                    conn.execute("DELETE FROM chemical_transactions WHERE date < ? AND id <= ?", (cutoff, last_id))
+                    refresh_chem_ledger(conn, starts)
+    except BaseException:
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return moved
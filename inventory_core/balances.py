@@ -0,0 +1,256 @@
+"""ยอดคงเหลือรายวัสดุ (ตาราง item_balances) และ Snapshot สำหรับหน้าจอที่อ่านอย่างเดียว"""
+import threading
+from datetime import datetime
+
+from .db import has_table
+from .lots import refresh_item_lots
+from .profiling import read_frame, timed
+
+# ยอดคงเหลือต่อวัสดุ (item_id) ชื่อ/รหัสหลักจากทะเบียน items ใช้คู่กับ ITEM_BALANCE_FROM
+ITEM_BALANCE_SELECT = '''
+    SELECT t.item_id, i.item_code, i.item_name,
+           TOTAL(CASE WHEN t.action_type = 'In' THEN t.quantity END) AS qty_in,
+           TOTAL(CASE WHEN t.action_type = 'Out' THEN t.quantity END) AS qty_out,
+           TOTAL(CASE WHEN t.action_type = 'In' THEN t.quantity END) - TOTAL(CASE WHEN t.action_type = 'Out' THEN t.quantity END) AS balance,
+           IFNULL((SELECT u.unit FROM transactions u WHERE u.item_id = t.item_id ORDER BY u.date DESC, u.id DESC LIMIT 1), '') AS unit,
+           IFNULL((SELECT u.category FROM transactions u
+                   WHERE u.item_id = t.item_id AND u.category IS NOT NULL AND u.category NOT IN ('', '-', 'None')
+                   ORDER BY u.date DESC, u.id DESC LIMIT 1), '-') AS category,
+           MIN(CASE WHEN t.action_type = 'In' AND t.expiry_date != '' THEN t.expiry_date END) AS expiry_date
+'''
+ITEM_BALANCE_FROM = "FROM transactions t JOIN items i ON i.id = t.item_id"
+
+# ยอดรับ / ยอดจ่ายรวมของกลุ่มรายการ (ใช้สร้าง Checkpoint และยอด ณ วันที่)
+IN_OUT_TOTALS = "TOTAL(CASE WHEN action_type = 'In' THEN quantity END), TOTAL(CASE WHEN action_type = 'Out' THEN quantity END)"
+
+# คอลัมน์ยอดคงเหลือในรูปแบบที่หน้าจอใช้ (In / Out / Balance)
+BALANCE_COLUMNS = '''item_code, item_name, category, qty_in AS "In", qty_out AS "Out", balance AS "Balance", unit, expiry_date'''
+# คอลัมน์ของ transactions ที่ calculate_inventory ใช้ (โหลดเท่านี้พอ; เพิ่ม item_id ได้ถ้าฐานข้อมูลมีทะเบียนวัสดุแล้ว)
+INVENTORY_COLUMNS = ['date', 'item_code', 'item_name', 'action_type', 'quantity', 'unit', 'category', 'expiry_date']
+
+
+def refresh_item_balances(conn, ids=None):
+    """คำนวณยอดคงเหลือใหม่เฉพาะวัสดุ (item_id) ที่ระบุ (ids=None คือสร้างใหม่ทั้งตาราง) ภายใน Transaction ของผู้เรียก
+
+    หน่วย/ประเภทล่าสุดถูกเก็บกลับเข้าทะเบียน items และล็อตวันหมดอายุ (item_lots) ถูกตัดจ่ายใหม่ด้วย
+    """
+    if ids is None:
+        conn.execute("DELETE FROM item_balances")
+        conn.execute(f"INSERT INTO item_balances {ITEM_BALANCE_SELECT} {ITEM_BALANCE_FROM} GROUP BY t.item_id")
+        conn.execute("UPDATE items SET unit = b.unit, category = b.category FROM item_balances b WHERE b.item_id = items.id")
+        refresh_item_lots(conn)
+        return
+    ids = {int(i) for i in ids if i is not None}
+    if not ids:
+        return
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS dirty_items (item_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.dirty_items")
+    conn.executemany("INSERT INTO temp.dirty_items VALUES (?)", [(i,) for i in ids])
+    conn.execute("DELETE FROM item_balances WHERE item_id IN (SELECT item_id FROM temp.dirty_items)")
+    conn.execute(f'''
+        INSERT INTO item_balances {ITEM_BALANCE_SELECT}
+        FROM temp.dirty_items d CROSS JOIN transactions t ON t.item_id = d.item_id JOIN items i ON i.id = t.item_id
+        GROUP BY t.item_id
+    ''')
+    conn.execute('''
+        UPDATE items SET unit = b.unit, category = b.category FROM item_balances b
+        WHERE b.item_id = items.id AND items.id IN (SELECT item_id FROM temp.dirty_items)
+    ''')
+    refresh_item_lots(conn, ids)
+
+
+def invalidate_checkpoints(conn, since):
+    """ลบ Checkpoint ของเดือนที่เริ่มหลังวันที่ since (รายการวันที่ since ถูกเพิ่ม/ลบ) ภายใน Transaction ของผู้เรียก
+
+    เดือนก่อนหน้านั้นไม่กระทบ since=None (ไม่มีรายการที่มีวันที่) ไม่ต้องทำอะไร
+    """
+    if since is None:
+        return
+    conn.execute("DELETE FROM checkpoint_months WHERE month > ?", (since,))
+    conn.execute("DELETE FROM balance_checkpoints WHERE month > ?", (since,))
+
+
+def has_checkpoint(conn, month):
+    return conn.execute("SELECT 1 FROM checkpoint_months WHERE month = ?", (month,)).fetchone() is not None
+
+
+def build_checkpoint(conn, month, floor=None):
+    """สร้าง Checkpoint ของเดือน month (YYYY-MM-01) = ยอดรับ/จ่ายสะสมของรายการก่อนวันที่ month ภายใน Transaction ของผู้เรียก
+
+    ต่อจาก Checkpoint ก่อนหน้าที่ใกล้ที่สุด (รวมเฉพาะรายการระหว่างนั้น) ถ้าไม่มีจึงรวมจากทุกรายการ
+    floor = cutoff ของ Archive: รายการก่อน floor เหลือแค่แถวยอดยกมา จึงสร้าง/ต่อจาก Checkpoint ที่ก่อน floor ไม่ได้
+    """
+    if floor and month < floor:
+        raise ValueError(f"สร้าง Checkpoint ก่อน cutoff ของ Archive ไม่ได้: {month}")
+    prev = conn.execute("SELECT MAX(month) FROM checkpoint_months WHERE month < ? AND month >= ?", (month, floor or '')).fetchone()[0]
+    conn.execute("DELETE FROM balance_checkpoints WHERE month = ?", (month,))
+    if prev is None:
+        conn.execute(f"INSERT INTO balance_checkpoints SELECT ?, item_id, {IN_OUT_TOTALS} FROM transactions WHERE date < ? GROUP BY item_id",
+                     (month, month))
+    else:
+        conn.execute(f'''
+            INSERT INTO balance_checkpoints
+            SELECT ?, item_id, TOTAL(qty_in), TOTAL(qty_out) FROM (
+                SELECT item_id, qty_in, qty_out FROM balance_checkpoints WHERE month = ?
+                UNION ALL
+                SELECT item_id, {IN_OUT_TOTALS} FROM transactions WHERE date >= ? AND date < ? GROUP BY item_id
+            ) GROUP BY item_id
+        ''', (month, prev, prev, month))
+    items = conn.execute("SELECT COUNT(*) FROM balance_checkpoints WHERE month = ?", (month,)).fetchone()[0]
+    conn.execute("INSERT OR REPLACE INTO checkpoint_months (month, items, created_at) VALUES (?, ?, ?)",
+                 (month, items, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return items
+
+
+def month_starts(first, last):
+    """วันแรกของทุกเดือนตั้งแต่เดือนของ first ถึงเดือนของ last (YYYY-MM-DD)"""
+    year, month = int(first[:4]), int(first[5:7])
+    while f"{year:04d}-{month:02d}-01" <= last:
+        yield f"{year:04d}-{month:02d}-01"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def build_checkpoints(conn, today=None):
+    """สร้าง Checkpoint ที่ยังไม่มีของทุกต้นเดือน ตั้งแต่เดือนถัดจากรายการแรก (หรือ cutoff ของ Archive) ถึงเดือนปัจจุบัน
+    ภายใน Transaction ของผู้เรียก คืนจำนวนเดือนที่สร้าง
+
+    เรียกจากฝั่งบันทึก (หลังนำเข้า / ลบรายการ) ฝั่งอ่าน (balances_as_of) จึงไม่ต้องเขียนฐานข้อมูล
+    แต่ละเดือนต่อจากเดือนก่อนหน้า จึงรวมเฉพาะรายการของเดือนนั้น
+    """
+    floor = conn.execute("SELECT MAX(cutoff) FROM archive_periods").fetchone()[0] if has_table(conn, 'archive_periods') else None
+    first, last = conn.execute("SELECT MIN(date), MAX(date) FROM transactions WHERE date >= ?", (floor or '',)).fetchone()
+    if first is None:
+        return 0
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    existing = {m for (m,) in conn.execute("SELECT month FROM checkpoint_months WHERE month >= ?", (floor or '',))}
+    built = 0
+    for month in month_starts(floor or first, max(last, today)):
+        if month > first and month >= (floor or '') and month not in existing:
+            build_checkpoint(conn, month, floor)
+            built += 1
+    return built
+
+
+def rebuild_item_balances(db):
+    """สร้าง item_balances ใหม่จาก transactions ทั้งหมด พร้อมคืนรายการที่ยอดไม่ตรง (Drift)"""
+    import pandas as pd
+
+    with db.write() as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.fresh_balances")
+        conn.execute(f"CREATE TEMP TABLE fresh_balances AS {ITEM_BALANCE_SELECT} {ITEM_BALANCE_FROM} GROUP BY t.item_id")
+        cols = "item_id, item_code, item_name, ROUND(qty_in, 6) AS qty_in, ROUND(qty_out, 6) AS qty_out, ROUND(balance, 6) AS balance, unit, category, expiry_date"
+        drift = pd.read_sql_query(f'''
+            SELECT 'stale' AS drift, * FROM (SELECT {cols} FROM item_balances EXCEPT SELECT {cols} FROM temp.fresh_balances)
+            UNION ALL
+            SELECT 'expected' AS drift, * FROM (SELECT {cols} FROM temp.fresh_balances EXCEPT SELECT {cols} FROM item_balances)
+        ''', conn)
+        refresh_item_balances(conn)
+        conn.execute("DROP TABLE temp.fresh_balances")
+    return drift
+
+
+@timed('load')
+def read_balances(db):
+    """ยอดคงเหลือทุกวัสดุจากตาราง item_balances"""
+    return read_frame(db.reader(), f"SELECT {BALANCE_COLUMNS} FROM item_balances ORDER BY item_code, item_name")
+
+
+def change_marker(conn):
+    """ตัวบอกการเปลี่ยนแปลง (version, จำนวนครั้งที่ลบ) ของ transactions -- อ่านแถวเดียว"""
+    return conn.execute("SELECT version, deletes FROM table_versions WHERE name = 'transactions'").fetchone()
+
+
+class BalanceSnapshot:
+    """ยอดคงเหลือล่าสุดที่ใช้ร่วมกันทุกหน้าจอ อัปเดตเฉพาะรายการที่เพิ่มเข้ามาใหม่ (id > last_id)"""
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.balances = None
+        self.marker = None
+        self.last_id = 0
+        self.full_loads = self.delta_loads = 0
+
+    def refresh(self):
+        with self.lock:
+            conn = self.db.reader()
+            try:
+                # อ่าน marker และข้อมูลใน Read transaction เดียวกัน เพื่อให้ได้ภาพข้อมูลชุดเดียวกัน
+                conn.execute("BEGIN")
+                marker = change_marker(conn)
+                if self.balances is not None and marker == self.marker:
+                    return self.balances
+                if self.balances is None or marker is None or self.marker is None or marker[1] != self.marker[1]:
+                    self.load_full(conn)
+                else:
+                    new_rows, max_id = conn.execute("SELECT COUNT(*), MAX(id) FROM transactions WHERE id > ?", (self.last_id,)).fetchone()
+                    # version เพิ่มทีละ 1 ต่อแถวที่ insert ถ้าไม่ตรงแปลว่ามีการแก้ไขแถวเดิม -> โหลดใหม่ทั้งหมด
+                    if new_rows != marker[0] - self.marker[0]:
+                        self.load_full(conn)
+                    else:
+                        self.fold_delta(conn, max_id)
+                self.marker = marker
+                return self.balances
+            finally:
+                conn.rollback()  # ปิด Read transaction (Connection ยังเปิดไว้ใช้ต่อ)
+
+    def load_full(self, conn):
+        self.balances = read_frame(conn, f"SELECT item_id, {BALANCE_COLUMNS} FROM item_balances ORDER BY item_code, item_name")
+        self.last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions").fetchone()[0]
+        self.full_loads += 1
+
+    def fold_delta(self, conn, max_id):
+        import pandas as pd
+
+        # ดึงยอดคงเหลือ (ที่ Admin อัปเดตไว้แล้ว) เฉพาะวัสดุที่มีรายการใหม่ แล้วแทนที่ใน Snapshot
+        changed = read_frame(conn, f'''
+            SELECT item_id, {BALANCE_COLUMNS} FROM item_balances
+            WHERE item_id IN (SELECT DISTINCT item_id FROM transactions WHERE id > ?)
+        ''', [self.last_id])
+        keep = ~self.balances['item_id'].isin(changed['item_id'])
+        self.balances = pd.concat([self.balances[keep], changed], ignore_index=True)
+        self.last_id = max_id
+        self.delta_loads += 1
+
+
+@timed('calc')
+def calculate_inventory(df):
+    """คำนวณยอดคงเหลือจากประวัติใน DataFrame (ใช้เมื่อยังไม่มีตาราง item_balances) ไม่แก้ไข df ที่ส่งเข้ามา
+
+    รับได้ทั้งข้อมูลดิบและข้อมูลที่ผ่าน compact_frame (category / datetime64) โดย Group ตามชนิดเดิม ไม่แปลงเป็นข้อความก่อน
+    """
+    import pandas as pd
+
+    if df.empty:
+        return pd.DataFrame()
+    # ประวัติที่มี item_id รวมตามวัสดุในทะเบียน (ชื่อสะกดต่างกันเป็นวัสดุเดียวกัน) ข้อมูลเก่าที่ไม่มีรวมตามคู่ (รหัส, ชื่อ)
+    keys = ['item_id'] if 'item_id' in df.columns and df['item_id'].notna().all() else ['item_code', 'item_name']
+    # เลขกลุ่มต่อวัสดุ (รวมรหัสว่างเป็นกลุ่มเดียวกัน) ใช้ Join ทุกส่วนด้วยตัวเลขแทนค่า Key ที่อาจเป็น NaN
+    gid = df.groupby(keys, observed=True, dropna=False, sort=False).ngroup().rename('gid')
+    rows = df.assign(gid=gid)
+
+    # 1. ยอดรับ / จ่าย ต่อวัสดุ
+    qty = rows.groupby(['gid', 'action_type'], observed=True)['quantity'].sum().unstack('action_type')
+    qty = qty.reindex(columns=['In', 'Out']).fillna(0.0).astype('float64')
+    qty.columns = ['In', 'Out']
+
+    # 2. Unit ล่าสุด และ Category ล่าสุดที่ไม่ว่าง (เรียงวันที่จากเก่า -> ใหม่ แล้วเอาแถวสุดท้ายของแต่ละวัสดุ)
+    latest = rows.sort_values('date', kind='stable', na_position='first')
+    unit = latest.drop_duplicates('gid', keep='last').set_index('gid')['unit']
+    cat = latest['category']
+    category = latest[cat.notna() & ~cat.isin(['', '-', 'None'])].drop_duplicates('gid', keep='last').set_index('gid')['category']
+
+    # 3. วันหมดอายุที่เร็วที่สุดจากรายการรับเข้า
+    exp = rows['expiry_date']
+    has_exp = exp.notna() if pd.api.types.is_datetime64_any_dtype(exp) else exp.notna() & (exp != '')
+    expiry = rows[(rows['action_type'] == 'In') & has_exp].groupby('gid')['expiry_date'].min()
+    if pd.api.types.is_datetime64_any_dtype(expiry):
+        expiry = expiry.dt.strftime('%Y-%m-%d')
+
+    names = rows.drop_duplicates('gid').set_index('gid')[['item_code', 'item_name']].astype(object)
+    balance_df = names.join(qty).join(unit.astype(object)).join(category.astype(object)).join(expiry.astype(object)).reset_index(drop=True)
+    balance_df[['In', 'Out']] = balance_df[['In', 'Out']].fillna(0.0)
+    balance_df['category'] = balance_df['category'].fillna('-')
+    balance_df['unit'] = balance_df['unit'].fillna('')
+    balance_df['Balance'] = balance_df['In'] - balance_df['Out']
+    return balance_df
@@ -0,0 +1,189 @@
+"""Benchmark ด้วยข้อมูลสังเคราะห์ (สุ่มแบบกำหนด seed ได้ผลเหมือนเดิมทุกครั้ง) ที่หลายขนาดข้อมูล
+
+    python -m inventory_core bench --scales 10000,100000 -o bench.json
+    python -m inventory_core bench -o new.json --baseline bench.json   # ช้ากว่าเดิมเกินเกณฑ์ -> exit code 2
+
+แต่ละขนาดสร้างฐานข้อมูลใหม่ในโฟลเดอร์ชั่วคราว จับเวลาฟังก์ชันชุดเดียวกับที่หน้าเว็บเรียก
+(save_to_db / save_chem_batch = insert_materials / insert_chemicals, load_data = read_table, ...)
+"""
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from .balances import INVENTORY_COLUMNS, calculate_inventory
+from .chemicals import CHEM_MAPPING, CHEMICAL_CONFIG, calculate_chem_balance
+from .db import Database
+from .ingest import CHUNK_ROWS, insert_chemicals, insert_materials
+from .queries import load_range, read_table, search_transactions
+from .schema import init_db
+
+BENCH_SCALES = (10000, 100000)
+BENCH_REPEAT = 3
+# ช้ากว่า Baseline เกินกี่เท่าถือว่า Regression (ไม่นับผลต่างที่น้อยกว่า BENCH_NOISE_SECONDS ซึ่งเป็นแค่ noise)
+BENCH_MAX_SLOWDOWN = 1.5
+BENCH_NOISE_SECONDS = 0.01
+# วันสุดท้ายของข้อมูลสังเคราะห์ (คงที่ ผลลัพธ์ไม่ขึ้นกับวันที่รัน)
+BENCH_END = date(2026, 6, 30)
+BENCH_DAYS = 365
+
+# ชื่อวัสดุภาษาไทย = ชนิด + ขนาด/รุ่น, ประเภท -> (prefix รหัส, หน่วย, มีวันหมดอายุไหม)
+THAI_ITEMS = ['ถุงมือยาง', 'หน้ากากอนามัย', 'กระดาษ A4', 'ปากกาลูกลื่น', 'แบตเตอรี่', 'หลอดไฟ LED', 'สายไฟ', 'น็อตสแตนเลส',
+              'ตลับลูกปืน', 'สายพาน', 'น้ำมันหล่อลื่น', 'จาระบี', 'ผ้าเช็ดมือ', 'น้ำยาทำความสะอาด', 'เทปกาว', 'ฟิวส์',
+              'ไส้กรองน้ำ', 'ถุงขยะ', 'แว่นตานิรภัย', 'รองเท้าบูท']
+THAI_SIZES = ['ขนาด S', 'ขนาด M', 'ขนาด L', 'เบอร์ 6', 'เบอร์ 8', 'ยาว 1 ม.', 'ยาว 5 ม.', '12V', '220V', 'แพ็ค 10', 'กล่องใหญ่', 'ชนิดพิเศษ']
+CATEGORIES = {'วัสดุสิ้นเปลือง': ('CS', 'ชิ้น', True), 'อะไหล่': ('SP', 'ตัว', False), 'เครื่องเขียน': ('ST', 'กล่อง', False),
+              'อุปกรณ์ป้องกัน': ('PP', 'คู่', True), 'สารหล่อลื่น': ('LB', 'ลิตร', True)}
+DEPARTMENTS = ['ซ่อมบำรุง', 'ผลิต 1', 'ผลิต 2', 'QA', 'คลังสินค้า', 'สำนักงาน']
+REQUESTERS = ['สมชาย', 'สมหญิง', 'วิชัย', 'มานี', 'ปิติ', 'ชูใจ', 'อนันต์', 'กาญจนา']
+
+
+def bench_items(n_items, rng):
+    """รายการวัสดุ [(item_code, item_name, category, unit, มีวันหมดอายุ)]"""
+    items = []
+    for i in range(n_items):
+        category = rng.choice(list(CATEGORIES))
+        prefix, unit, expires = CATEGORIES[category]
+        items.append((f"{prefix}-{i:05d}", f"{rng.choice(THAI_ITEMS)} {rng.choice(THAI_SIZES)}", category, unit, expires))
+    return items
+
+
+def bench_dates(n, rng):
+    start = BENCH_END - timedelta(days=BENCH_DAYS - 1)
+    return sorted(start + timedelta(days=rng.randrange(BENCH_DAYS)) for _ in range(n))
+
+
+def synthetic_materials(n, seed=0):
+    """ข้อมูลวัสดุ n รายการ (รับเข้า ~30% / เบิกออก ~70%) คืน {'In': DataFrame, 'Out': DataFrame} คอลัมน์แบบหลัง Mapping"""
+    import pandas as pd
+
+    rng = random.Random(seed)
+    items = bench_items(min(5000, max(100, n // 20)), rng)
+    rows = {'In': [], 'Out': []}
+    for d in bench_dates(n, rng):
+        code, name, category, unit, expires = rng.choice(items)
+        if rng.random() < 0.3:
+            expiry = (d + timedelta(days=rng.randrange(30, 730))).isoformat() if expires else ''
+            rows['In'].append((d.isoformat(), code, name, float(rng.randrange(10, 500)), unit, expiry, category, ''))
+        else:
+            rows['Out'].append((d.isoformat(), code, name, float(rng.randrange(1, 20)), unit, rng.choice(DEPARTMENTS),
+                                rng.choice(REQUESTERS), category, ''))
+    return {
+        'In': pd.DataFrame(rows['In'], columns=['date', 'item_code', 'item_name', 'quantity', 'unit', 'expiry_date', 'category', 'remark']),
+        'Out': pd.DataFrame(rows['Out'], columns=['date', 'item_code', 'item_name', 'quantity', 'unit', 'department', 'requester', 'category', 'remark']),
+    }
+
+
+def synthetic_chemicals(n, seed=0):
+    """รายการถังสารเคมี n รายการ ใช้ชื่อเรียกทุกแบบใน CHEM_MAPPING (และรหัสถังจริง) วนกันไป คืน {'In', 'Out'}"""
+    import pandas as pd
+
+    rng = random.Random(seed + 1)
+    aliases = list(dict.fromkeys(list(CHEM_MAPPING) + list(CHEMICAL_CONFIG)))
+    rows = {'In': [], 'Out': []}
+    for i, d in enumerate(bench_dates(n, rng)):
+        r_code = aliases[i % len(aliases)]
+        # รับเข้าเป็นรถขนส่งครั้งละหลายตัน เบิกออกครั้งละไม่มาก ยอดในถังจึงขึ้นลงแบบของจริง
+        if i % 8 == 0:
+            rows['In'].append((d.isoformat(), r_code, '', float(rng.randrange(8000, 20000))))
+        else:
+            rows['Out'].append((d.isoformat(), r_code, '', round(rng.uniform(50, 1500), 2), rng.choice(DEPARTMENTS), rng.choice(REQUESTERS)))
+    return {
+        'In': pd.DataFrame(rows['In'], columns=['date', 'r_code', 'chem_desc', 'qty_kg']),
+        'Out': pd.DataFrame(rows['Out'], columns=['date', 'r_code', 'chem_desc', 'qty_kg', 'department', 'requester']),
+    }
+
+
+def chunked(df, size=CHUNK_ROWS):
+    return [df.iloc[i:i + size] for i in range(0, len(df), size)]
+
+
+def best_of(fn, repeat):
+    """เวลาที่เร็วที่สุดจาก repeat รอบ (วินาที) และผลลัพธ์ของรอบสุดท้าย"""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_scale(n, seed=0, repeat=BENCH_REPEAT, workdir=None, log=None):
+    """จับเวลาทุกขั้นตอนที่ขนาด n รายการ คืน {ชื่อขั้นตอน: วินาที}"""
+    materials = synthetic_materials(n, seed)
+    chemicals = synthetic_chemicals(max(len(CHEM_MAPPING) * 2, n // 100), seed)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        init_db(db)
+        timings = {}
+
+        def step(name, fn, times=repeat):
+            timings[name], result = best_of(fn, times)
+            if log:
+                log(f"   {n:>9,} {name:<24} {timings[name]:8.3f} s")
+            return result
+
+        # การบันทึกเปลี่ยนข้อมูล จับเวลารอบเดียว (เหมือนกดบันทึก 1 ครั้งต่อไฟล์)
+        step('save_to_db', lambda: [insert_materials(db, chunked(materials[a]), a, f'BENCH {a}') for a in ('In', 'Out')], 1)
+        step('save_chem_batch', lambda: [insert_chemicals(db, chunked(chemicals[a]), a, f'BENCH {a}') for a in ('In', 'Out')], 1)
+        df = step('load_data', lambda: read_table(db, 'transactions', ['item_id'] + INVENTORY_COLUMNS))
+        step('calculate_inventory', lambda: calculate_inventory(df))
+        chem_df = step('load_chem_data', lambda: read_table(db, 'chemical_transactions'))
+        step('calculate_chem_balance', lambda: calculate_chem_balance(chem_df))
+        # FTS (>= 3 ตัวอักษร) และ LIKE (คำสั้น) คือสองเส้นทางของช่องค้นหา
+        step('search_fts', lambda: search_transactions(db, 'ถุงมือ'))
+        step('search_like', lambda: search_transactions(db, 'QA'))
+        day = (BENCH_END - timedelta(days=BENCH_DAYS // 2)).isoformat()
+        step('daily_report', lambda: (load_range(db, 'transactions', day, day), load_range(db, 'chemical_transactions', day, day)))
+        # ปิดทุก Connection ก่อนลบโฟลเดอร์ชั่วคราว (Windows ลบไฟล์ที่เปิดอยู่ไม่ได้)
+        db.reader().close()
+        if db.writer is not None:
+            db.writer.close()
+    return timings
+
+
+def bench_meta(seed, repeat):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import pandas as pd
+
+    return {'commit': commit, 'created': datetime.now().isoformat(timespec='seconds'), 'seed': seed, 'repeat': repeat,
+            'python': platform.python_version(), 'pandas': pd.__version__, 'sqlite': sqlite3.sqlite_version,
+            'machine': platform.platform()}
+
+
+def run_benchmarks(scales=BENCH_SCALES, seed=0, repeat=BENCH_REPEAT, workdir=None, log=None):
+    """ผล Benchmark ทุกขนาด {'meta': {...}, 'results': {'<n>': {ชื่อขั้นตอน: วินาที}}} (บันทึกเป็น JSON ได้ทันที)"""
+    results = {str(n): bench_scale(n, seed, repeat, workdir, log) for n in scales}
+    return {'meta': bench_meta(seed, repeat), 'results': results}
+
+
+def find_regressions(report, baseline, max_slowdown=BENCH_MAX_SLOWDOWN, noise=BENCH_NOISE_SECONDS):
+    """ขั้นตอนที่ช้ากว่า Baseline เกิน max_slowdown เท่า (เทียบเฉพาะขนาด/ขั้นตอนที่มีทั้งสองฝั่ง) คืน [(n, ชื่อ, เดิม, ใหม่)]"""
+    slow = []
+    for n, timings in report['results'].items():
+        old = baseline.get('results', {}).get(n, {})
+        for name, seconds in timings.items():
+            before = old.get(name)
+            if before is not None and seconds > before * max_slowdown and seconds - before > noise:
+                slow.append((n, name, before, seconds))
+    return slow
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def read_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
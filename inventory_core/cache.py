@@ -0,0 +1,80 @@
+"""Cache ข้อมูลที่ใช้ร่วมกันทุก Session (Key = version ของตารางใน table_versions)"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def data_stamp(db, *tables):
+    """version ปัจจุบันของตาราง (เปลี่ยนทุกครั้งที่มีการเขียน) -- อ่านแถวเดียว ถูกมาก"""
+    marks = ', '.join('?' * len(tables))
+    return tuple(db.reader().execute(f"SELECT name, version FROM table_versions WHERE name IN ({marks}) ORDER BY name", tables).fetchall())
+
+
+class FrameCache:
+    """LRU Cache ของ DataFrame/ยอดคงเหลือ จำกัดขนาดรวม ใช้ซ้ำจนกว่า version ของตารางจะเปลี่ยน"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (stamp, value, size)
+        self.loading = {}  # (key, stamp) -> Future ของการโหลดที่กำลังทำอยู่
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.bytes = 0
+
+    def get(self, key, stamp, loader):
+        """ค่าใน Cache หรือโหลดใหม่ด้วย loader() นอก Lock (Key อื่นยังอ่านได้ระหว่างโหลด)
+
+        Session ที่ขอ Key + version เดียวกันระหว่างที่กำลังโหลดจะรอผลจากการโหลดครั้งเดียวกัน (Future) ไม่โหลดซ้ำ
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            pending = self.loading.get((key, stamp))
+            owner = pending is None
+            if owner:
+                pending = self.loading[key, stamp] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return pending.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key, stamp]
+            pending.set_exception(e)
+            raise
+        size = int(value.memory_usage(deep=True).sum()) if hasattr(value, 'memory_usage') else 1024
+        with self.lock:
+            del self.loading[key, stamp]
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (stamp, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, old_size) = self.entries.popitem(last=False)
+                self.bytes -= old_size
+        pending.set_result(value)
+        return value
+
+    def fetch(self, db, key, tables, loader):
+        """โหลดผ่าน Cache (ข้อมูลที่ได้ใช้ร่วมกันทุก Session ห้ามแก้ไขในที่ ให้ copy ก่อน)"""
+        try:
+            stamp = data_stamp(db, *tables)
+        except sqlite3.Error:
+            return loader()
+        return self.get(key, stamp, loader)
+
+    def frames(self):
+        """DataFrame ทั้งหมดที่ Cache ถืออยู่ (สำหรับรายงานหน่วยความจำ)"""
+        with self.lock:
+            return [value for _, value, _ in self.entries.values() if hasattr(value, 'memory_usage')]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'mb': self.bytes / 1024 / 1024}
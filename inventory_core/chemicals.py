@@ -0,0 +1,184 @@
+"""ถังบรรจุสารเคมี: รหัส/ความหนาแน่น, การแปลงข้อมูลนำเข้า และยอดสะสมของแต่ละถัง (Running-balance ledger)"""
+import re
+
+from .profiling import read_frame, timed
+
+# ค่าคงที่สำหรับสารเคมี (Config)
+CHEMICAL_CONFIG = {
+    "T11-2005B":    {"capacity": 60000, "limit": 48000, "density": 1.48, "name": "Sodium hydroxide 45% (NaOH)"},
+    "T11-1002A":    {"capacity": 60000, "limit": 48000, "density": 1.40, "name": "Sulphuric acid 50% (H2SO4)"},
+    "T11-1001":     {"capacity": 60000, "limit": 48000, "density": 1.16, "name": "Hydrochloric acid 31.2% (HCL)"},
+    "T11-9007B102": {"capacity": 30000, "limit": 24000, "density": 1.20, "name": "Hydrogen Peroxide (ไฮโดรเจนเปอร์ออกไซด์ 50%)"}
+}
+
+# ตารางเทียบชื่อสารเคมี (Mapping)
+CHEM_MAPPING = {
+    # NaOH (Map เข้า T11-2005B)
+    "T11-2005A": "T11-2005B", "T11-2005": "T11-2005B", "Sodium hydroxide": "T11-2005B", "โซดาไฟ": "T11-2005B", "NaOH": "T11-2005B",
+    # H2SO4
+    "T11-1002A": "T11-1002A", "T11-1002": "T11-1002A", "T11-1003": "T11-1002A", "Sulfuric acid": "T11-1002A", "กรดซัลฟิวริก": "T11-1002A", "H2SO4": "T11-1002A",
+    # HCl
+    "T11-1001": "T11-1001", "Hydrochloric acid": "T11-1001", "กรดเกลือ": "T11-1001", "HCl": "T11-1001",
+    # H2O2
+    "T11-9007B102": "T11-9007B102", "T11-1004": "T11-9007B102", "T11-1004A": "T11-9007B102", "Hydrogen peroxide": "T11-9007B102", "ไฮโดรเจน": "T11-9007B102", "H2O2": "T11-9007B102"
+}
+
+# ชื่อเรียกทั้งหมด (ตัวพิมพ์เล็ก) -> รหัสถัง: รหัสถังจริงใน Config และทุก Key ของ CHEM_MAPPING
+CHEM_PATTERNS = {k.lower(): v for k, v in {**{c: c for c in CHEMICAL_CONFIG}, **CHEM_MAPPING}.items()}
+# Regex เดียวของทุกชื่อเรียก คอมไพล์ครั้งเดียว เรียงจากยาวไปสั้น (ที่ตำแหน่งเดียวกันชื่อที่ยาวกว่าชนะ เช่น T11-2005A ก่อน T11-2005)
+CHEM_REGEX = re.compile('|'.join(re.escape(k) for k in sorted(CHEM_PATTERNS, key=len, reverse=True)), re.IGNORECASE)
+
+
+def resolve_chem_code(raw_code):
+    """แปลงรหัส/ชื่อในไฟล์ 1 ค่าเป็นรหัสถัง (ชื่อเรียกแรกที่พบในข้อความ) ไม่รู้จัก = None"""
+    found = CHEM_REGEX.search(raw_code)
+    return CHEM_PATTERNS[found.group(0).lower()] if found else None
+
+
+def resolve_chem_codes(raw):
+    """เหมือน resolve_chem_code แต่ทั้งคอลัมน์ด้วย str.extract ครั้งเดียว (ไม่รู้จัก = NaN)"""
+    found = raw.str.extract(f'({CHEM_REGEX.pattern})', flags=re.IGNORECASE, expand=False)
+    return found.str.lower().map(CHEM_PATTERNS)
+
+
+def clean_text(col):
+    """ค่าว่าง / 'nan' -> ''"""
+    col = col.fillna('').astype(str)
+    return col.mask(col.str.lower() == 'nan', '')
+
+
+def convert_chem_chunk(df, action_type, batch_timestamp):
+    """แปลงรหัส/หน่วยของ 1 Chunk แบบคอลัมน์ คืน (แถวที่พร้อมบันทึก, รหัสที่ไม่รู้จัก, แถวที่ข้อมูลไม่ถูกต้อง)
+
+    วันที่แปลงด้วย parse_dates แบบเดียวกับวัสดุ (ปี พ.ศ. และ DAY_FIRST)
+    """
+    import pandas as pd
+
+    from .ingest import parse_dates
+
+    empty = pd.Series('', index=df.index)
+
+    raw = df['r_code'].astype(str).str.strip()
+    code = resolve_chem_codes(raw)
+    kg = pd.to_numeric(df['qty_kg'], errors='coerce')
+    date = parse_dates(df['date'])
+
+    unknown = code.isna()
+    invalid = ~unknown & (kg.isna() | date.isna())
+    reasons = pd.Series('วันที่ไม่ถูกต้อง', index=df.index).mask(kg.isna(), 'จำนวนไม่ใช่ตัวเลข')
+    bad = pd.DataFrame({'row': df.index[invalid], 'reason': reasons[invalid].values})
+
+    ok = ~(unknown | invalid)
+    code = code[ok]
+    density = code.map({c: conf['density'] for c, conf in CHEMICAL_CONFIG.items()})
+    chem_desc = clean_text(df['chem_desc'] if 'chem_desc' in df else empty)[ok]
+    chem_desc = chem_desc.mask(chem_desc == '', code.map({c: conf['name'] for c, conf in CHEMICAL_CONFIG.items()}))
+    out = pd.DataFrame({
+        'date': date[ok], 'chem_code': code, 'chem_desc': chem_desc, 'action_type': action_type,
+        'qty_kg': kg[ok], 'qty_l': (kg[ok] / density).where(density > 0, 0.0), 'density': density,
+        'department': clean_text(df['department'] if 'department' in df else empty)[ok],
+        'requester': clean_text(df['requester'] if 'requester' in df else empty)[ok],
+        'upload_time': batch_timestamp
+    })
+    return out, raw[unknown], bad
+
+
+# แต่ละแถวเก็บยอดคงเหลือของถังนั้นหลังรายการนี้ (เรียงตาม date, id)
+def refresh_chem_ledger(conn, starts=None):
+    """คำนวณ bal_kg/bal_l ใหม่ตั้งแต่วันที่ที่เปลี่ยน {chem_code: date} เป็นต้นไป (starts=None คือทั้งหมด) ภายใน Transaction ของผู้เรียก"""
+    run_sql = '''
+        WITH run AS (
+            SELECT id,
+                   ? + SUM(CASE action_type WHEN 'In' THEN qty_kg WHEN 'Out' THEN -qty_kg ELSE 0 END) OVER w AS kg,
+                   ? + SUM(CASE action_type WHEN 'In' THEN qty_l WHEN 'Out' THEN -qty_l ELSE 0 END) OVER w AS l
+            FROM chemical_transactions WHERE {where}
+            WINDOW w AS (PARTITION BY chem_code ORDER BY date, id)
+        )
+        UPDATE chemical_transactions SET bal_kg = run.kg, bal_l = run.l FROM run WHERE chemical_transactions.id = run.id
+    '''
+    if starts is None:
+        conn.execute(run_sql.format(where="1"), (0.0, 0.0))
+        return
+    for code, start in starts.items():
+        # ยอดยกมา = ยอดสะสมของแถวสุดท้ายก่อนวันที่เปลี่ยน
+        base = conn.execute('''
+            SELECT bal_kg, bal_l FROM chemical_transactions WHERE chem_code = ? AND date < ?
+            ORDER BY date DESC, id DESC LIMIT 1
+        ''', (code, start)).fetchone() or (0.0, 0.0)
+        conn.execute(run_sql.format(where="chem_code = ? AND date >= ?"), (base[0] or 0.0, base[1] or 0.0, code, start))
+
+
+def ledger_starts(conn, where, params):
+    """วันที่แรกที่ได้รับผลกระทบของแต่ละถัง (ใช้ก่อนลบ/หลังเพิ่ม เพื่อคำนวณยอดสะสมใหม่เฉพาะช่วงหลังจากนั้น)"""
+    return dict(conn.execute(f"SELECT chem_code, MIN(date) FROM chemical_transactions WHERE {where} GROUP BY chem_code", params).fetchall())
+
+
+@timed('load')
+def read_chem_levels(db):
+    """ยอดปัจจุบัน (KG) ของทุกถังใน CHEMICAL_CONFIG = แถวล่าสุดของ Ledger (ค้นผ่าน Index ไม่ต้องรวมประวัติทั้งหมด)"""
+    conn, levels = db.reader(), {}
+    for code in CHEMICAL_CONFIG:
+        row = conn.execute("SELECT bal_kg FROM chemical_transactions WHERE chem_code = ? ORDER BY date DESC, id DESC LIMIT 1", (code,)).fetchone()
+        if row and row[0] is not None:
+            levels[code] = row[0]
+    return levels
+
+
+@timed('load')
+def chem_levels_as_of(db, day):
+    """ยอด (KG) ของทุกถัง ณ สิ้นวัน day = แถวล่าสุดของ Ledger ที่ date <= day (bal_kg ทุกแถวคือ Checkpoint อยู่แล้ว)
+
+    วันที่ก่อนแถวยอดยกมาของ Archive อ่านแถวล่าสุดจากไฟล์ Archive แทน
+    """
+    from .archive import archive_cutoff, day_before, read_archive
+
+    conn, levels = db.reader(), {}
+    cutoff = archive_cutoff(conn)
+    if cutoff is not None and day < day_before(cutoff):
+        old = read_archive(db, 'chemical_transactions', '', day)
+        if old.empty:
+            return levels
+        last = old.dropna(subset=['bal_kg']).sort_values(['date', 'id']).groupby('chem_code').tail(1)
+        return {code: bal for code, bal in zip(last['chem_code'], last['bal_kg']) if code in CHEMICAL_CONFIG}
+    for code in CHEMICAL_CONFIG:
+        row = conn.execute("SELECT bal_kg FROM chemical_transactions WHERE chem_code = ? AND date <= ? ORDER BY date DESC, id DESC LIMIT 1",
+                           (code, day)).fetchone()
+        if row and row[0] is not None:
+            levels[code] = row[0]
+    return levels
+
+
+@timed('load')
+def chem_level_history(db, start=None):
+    """ระดับถังสิ้นวันของแต่ละวัน (แถวสุดท้ายของวันจาก Ledger) ตั้งแต่วันที่ start (ช่วงที่ Archive ไปแล้วอ่านจากไฟล์)"""
+    import pandas as pd
+
+    from .archive import REAL_ROWS, day_before, read_archive, reaches_archive
+
+    cutoff = reaches_archive(db.reader(), start)
+    hist = read_frame(db.reader(), f'''
+        SELECT date, chem_code, bal_kg FROM (
+            SELECT date, chem_code, bal_kg, ROW_NUMBER() OVER (PARTITION BY chem_code, date ORDER BY id DESC) AS rn
+            FROM chemical_transactions WHERE date >= ? {"AND " + REAL_ROWS if cutoff else ""}
+        ) WHERE rn = 1 ORDER BY date
+    ''', [start or ''])
+    if cutoff is None:
+        return hist
+    old = read_archive(db, 'chemical_transactions', start, day_before(cutoff))
+    if old.empty:
+        return hist
+    # Ledger ในไฟล์คือยอดสะสม ณ ตอนที่ Archive (คำนวณต่อเนื่องจากรายการแรก) ใช้ได้ตรง ๆ
+    old = old.sort_values('id').groupby(['chem_code', 'date'], as_index=False).last()[['date', 'chem_code', 'bal_kg']]
+    return pd.concat([old, hist], ignore_index=True).sort_values('date', kind='stable', ignore_index=True)
+
+
+@timed('calc')
+def calculate_chem_balance(df):
+    """ยอดคงเหลือ (KG) ของแต่ละถังจากประวัติใน DataFrame (วิธีเดิมก่อนมี Ledger)"""
+    if df.empty:
+        return {}
+    bal = df.pivot_table(index='chem_code', columns='action_type', values='qty_kg', aggfunc='sum', fill_value=0)
+    if 'In' not in bal: bal['In'] = 0
+    if 'Out' not in bal: bal['Out'] = 0
+    bal['Balance_KG'] = bal['In'] - bal['Out']
+    return bal['Balance_KG'].to_dict()
@@ -0,0 +1,227 @@
+"""นำเข้า/ส่งออกข้อมูลจาก Command line สำหรับไฟล์ ERP รายคืน (ไม่เปิด Streamlit)
+
+    python -m inventory_core import material In erp_in.csv erp_in_2.xlsx
+    python -m inventory_core import material Out erp_out.csv --errors rejected.csv
+    python -m inventory_core import chemical Out chem_out.jsonl
+    python -m inventory_core export transactions -o jan.csv --start 2026-01-01 --end 2026-01-31
+    python -m inventory_core export chemical_transactions -o chem.parquet
+    python -m inventory_core archive --keep-months 12
+    python -m inventory_core bench --scales 10000,100000 -o bench.json --baseline bench_prev.json
+
+แต่ละไฟล์เป็น 1 รอบอัปโหลด (upload_batches) ยกเลิกทีละไฟล์ได้จากหน้า "จัดการข้อมูล" ทุกไฟล์ในการนำเข้า 1 ครั้งใช้ upload_time เดียวกัน
+"""
+import argparse
+import getpass
+import os
+import sys
+import time
+
+from .archive import ARCHIVE_KEEP_MONTHS, archive_before, archive_preview, archive_root, cutoff_for
+from .bench import BENCH_MAX_SLOWDOWN, BENCH_REPEAT, BENCH_SCALES, find_regressions, read_report, run_benchmarks, write_report
+from .db import Database, has_table
+from .export import arrow_schema, write_csv, write_parquet, write_xlsx
+from .ingest import (CHEM_COLUMNS, MATERIAL_COLUMNS, IngestError, find_upload, insert_chemicals, insert_materials,
+                     open_workbook, path_digest, read_file_chunks, upload_stamp)
+from .queries import iter_range
+from .schema import init_db
+
+# ฐานข้อมูลของ main.py (โฟลเดอร์เดียวกับโปรแกรม)
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'inventory_chem_v6.db')
+# Chunk ใหญ่กว่าหน้าเว็บ: 1 Chunk = 1 Transaction ยิ่งใหญ่ยิ่งเสีย overhead ต่อ commit น้อย
+IMPORT_CHUNK_ROWS = 50000
+EXPORT_CHUNK_ROWS = 50000
+# ผู้นำเข้าที่บันทึกในรอบอัปโหลด
+IMPORT_USER = f"cli:{getpass.getuser()}"
+# ชื่อ Sheet ที่หน้าเว็บใช้ (ใช้เลือก Sheet ในไฟล์ .xlsx และเป็น Key ตรวจไฟล์ซ้ำ)
+SHEETS = {'material': 'Material', 'chemical': 'Chemical Tank'}
+
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def pick_sheet(path, kind, sheet=None):
+    """Sheet ที่จะนำเข้า: ที่ระบุมา > Sheet ชื่อเดียวกับหน้าเว็บ > Sheet แรก (CSV/JSONL ไม่มี Sheet)"""
+    if not str(path).lower().endswith(('.xlsx', '.xlsm')):
+        return sheet
+    if sheet:
+        return sheet
+    wb = open_workbook(path)
+    try:
+        return SHEETS[kind] if SHEETS[kind] in wb.sheetnames else wb.sheetnames[0]
+    finally:
+        wb.close()
+
+
+def import_file(db, kind, action_type, path, upload_time, size=IMPORT_CHUNK_ROWS, sheet=None, force=False, rejected=None):
+    """นำเข้าไฟล์เดียว คืนจำนวนแถวที่บันทึก (ข้ามไฟล์ที่เคยนำเข้าแล้ว ยกเว้น force=True)
+
+    rejected = list ที่จะเพิ่ม DataFrame(file, row, reason) ของแถวที่ไม่ผ่านการตรวจ (สำหรับ --errors)
+    """
+    digest = path_digest(path)
+    sheet = pick_sheet(path, kind, sheet)
+    upload = (digest, sheet or SHEETS[kind])
+    prev = find_upload(db, digest, upload[1], action_type)
+    if prev is not None and not force:
+        log(f"⏭️  {path}: เคยนำเข้าแล้วเมื่อ {prev[0]} ({prev[1]:,} แถว) ข้าม (ใช้ --force เพื่อนำเข้าซ้ำ)")
+        return 0
+
+    started = time.perf_counter()
+    show = lambda done: log(f"   {path}: อ่านแล้ว {done:,} แถว ({done / max(time.perf_counter() - started, 1e-9):,.0f} แถว/วินาที)")
+    if kind == 'material':
+        cmap, columns = MATERIAL_COLUMNS[action_type]
+        report = insert_materials(db, read_file_chunks(path, cmap, columns, size, sheet), action_type, upload_time, upload, show, IMPORT_USER)
+    else:
+        report = insert_chemicals(db, read_file_chunks(path, CHEM_COLUMNS[action_type], None, size, sheet), action_type, upload_time, upload, show, IMPORT_USER)
+        if not report['unknown'].empty:
+            log(f"⚠️  {path}: รหัสสารเคมีที่ไม่รู้จัก {report['unknown'].set_index('r_code')['rows'].to_dict()}")
+    rows = report['inserted']
+    if not report['invalid'].empty:
+        log(f"⚠️  {path}: ข้ามแถวที่ข้อมูลไม่ถูกต้อง {len(report['invalid']):,} แถว (แถวแรก: {report['invalid'].head(5).to_dict('records')})")
+        if rejected is not None:
+            rejected.append(report['invalid'].assign(file=str(path))[['file', 'row', 'reason']])
+    elapsed = time.perf_counter() - started
+    log(f"✅ {path}: บันทึก {rows:,} แถว ใน {elapsed:.2f} วินาที ({rows / max(elapsed, 1e-9):,.0f} แถว/วินาที)")
+    return rows
+
+
+def run_import(args):
+    db = Database(args.db)
+    init_db(db, chemicals=args.kind == 'chemical')
+    upload_time = upload_stamp()
+    started, total, rejected = time.perf_counter(), 0, []
+    try:
+        for path in args.files:
+            try:
+                total += import_file(db, args.kind, args.action, path, upload_time, args.chunk_rows, args.sheet, args.force, rejected)
+            except IngestError as e:
+                if e.report is not None and not e.report['invalid'].empty:
+                    rejected.append(e.report['invalid'].assign(file=str(path))[['file', 'row', 'reason']])
+                log(f"❌ {path}: {e}")
+                return 1
+            except (OSError, ValueError, KeyError) as e:
+                log(f"❌ {path}: {e}")
+                return 1
+    finally:
+        if args.errors:
+            write_rejected(rejected, args.errors)
+    elapsed = time.perf_counter() - started
+    log(f"รวม {total:,} แถว จาก {len(args.files)} ไฟล์ ใน {elapsed:.2f} วินาที ({total / max(elapsed, 1e-9):,.0f} แถว/วินาที) รอบ {upload_time}")
+    return 0
+
+
+def write_rejected(rejected, out):
+    """เขียนแถวที่ไม่ผ่านการตรวจของทุกไฟล์ (file, row, reason) เป็น .csv หรือ .xlsx (ไม่มีแถวผิดก็เขียนแค่หัวตาราง)"""
+    import pandas as pd
+
+    chunks = rejected or [pd.DataFrame(columns=['file', 'row', 'reason'])]
+    rows = write_xlsx(chunks, out, 'errors') if out.lower().endswith('.xlsx') else write_csv(chunks, out)
+    log(f"📝 {out}: แถวที่ไม่ผ่านการตรวจ {rows:,} แถว")
+
+
+def run_export(args):
+    db = Database(args.db, read_only=True)
+    if not has_table(db.reader(), args.table):
+        log(f"❌ ไม่พบตาราง {args.table} ใน {args.db}")
+        return 1
+    start = end = None
+    if args.start or args.end:
+        start, end = args.start or '', args.end or '9999-12-31'
+    chunks = iter_range(db, args.table, start, end, args.action, args.chunk_rows)
+    started = time.perf_counter()
+    try:
+        if args.output.lower().endswith(('.parquet', '.pq')):
+            rows = write_parquet(chunks, args.output, arrow_schema(db.reader(), args.table))
+        elif args.output.lower().endswith('.xlsx'):
+            rows = write_xlsx(chunks, args.output, args.table)
+        else:
+            rows = write_csv(chunks, args.output)
+    except ImportError:
+        log("❌ การส่งออกเป็น Parquet ต้องติดตั้ง pyarrow (pip install pyarrow)")
+        return 1
+    elapsed = time.perf_counter() - started
+    log(f"✅ {args.output}: ส่งออก {rows:,} แถว ใน {elapsed:.2f} วินาที ({rows / max(elapsed, 1e-9):,.0f} แถว/วินาที)")
+    return 0
+
+
+def run_archive(args):
+    db = Database(args.db)
+    init_db(db, chemicals=has_table(db.reader(), 'chemical_transactions'))
+    cutoff = args.before or cutoff_for(args.keep_months)
+    preview = archive_preview(db, cutoff)
+    log(f"Archive รายการก่อน {cutoff}: {', '.join(f'{t} {n:,} แถว' for t, n in preview.items())}")
+    if args.dry_run or not any(preview.values()):
+        return 0
+    started = time.perf_counter()
+    try:
+        moved = archive_before(db, cutoff)
+    except (OSError, ValueError, ImportError) as e:
+        log(f"❌ {e}")
+        return 1
+    log(f"✅ ย้าย {sum(moved.values()):,} แถวไปที่ {archive_root(db)} ใน {time.perf_counter() - started:.2f} วินาที")
+    return 0
+
+
+def run_bench(args):
+    baseline = read_report(args.baseline) if args.baseline else None
+    report = run_benchmarks(args.scales, args.seed, args.repeat, args.workdir, log)
+    write_report(report, args.output)
+    log(f"✅ บันทึกผลที่ {args.output}")
+    if baseline is None:
+        return 0
+    slow = find_regressions(report, baseline, args.max_slowdown)
+    if not slow:
+        log(f"✅ ไม่มีขั้นตอนใดช้ากว่า {args.baseline} เกิน {args.max_slowdown:g} เท่า")
+        return 0
+    log(f"❌ REGRESSION: {len(slow)} ขั้นตอนช้ากว่า Baseline ({baseline.get('meta', {}).get('commit')}) เกิน {args.max_slowdown:g} เท่า")
+    for n, name, before, after in slow:
+        log(f"❌   {int(n):>9,} {name:<24} {before:8.3f} s -> {after:8.3f} s (x{after / before:.2f})")
+    return 2
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m inventory_core', description="นำเข้า/ส่งออกข้อมูลคลังวัสดุและสารเคมี")
+    parser.add_argument('--db', default=DEFAULT_DB, help="ไฟล์ฐานข้อมูล (ค่าเริ่มต้น: ฐานข้อมูลของ main.py)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imp = sub.add_parser('import', help="นำเข้าไฟล์ .xlsx / .csv / .jsonl (หัวคอลัมน์แบบเดียวกับไฟล์ที่อัปโหลดหน้าเว็บ)")
+    imp.add_argument('kind', choices=list(SHEETS), help="material = วัสดุทั่วไป, chemical = ถังบรรจุสารเคมี")
+    imp.add_argument('action', choices=['In', 'Out'], help="In = รับเข้า, Out = เบิกออก")
+    imp.add_argument('files', nargs='+')
+    imp.add_argument('--sheet', help="ชื่อ Sheet ในไฟล์ .xlsx (ค่าเริ่มต้น: Material / Chemical Tank หรือ Sheet แรก)")
+    imp.add_argument('--chunk-rows', type=int, default=IMPORT_CHUNK_ROWS, help="จำนวนแถวต่อ Transaction")
+    imp.add_argument('--force', action='store_true', help="นำเข้าซ้ำแม้เคยนำเข้าไฟล์นี้แล้ว")
+    imp.add_argument('--errors', help="เขียนแถวที่ไม่ผ่านการตรวจ (ไฟล์, แถว, เหตุผล) ลงไฟล์ .csv หรือ .xlsx")
+    imp.set_defaults(func=run_import)
+
+    exp = sub.add_parser('export', help="ส่งออกช่วงวันที่เป็น .csv, .xlsx หรือ .parquet")
+    exp.add_argument('table', choices=['transactions', 'chemical_transactions'])
+    exp.add_argument('-o', '--output', required=True, help="ไฟล์ปลายทาง (.csv, .xlsx หรือ .parquet)")
+    exp.add_argument('--start', help="วันที่เริ่ม YYYY-MM-DD")
+    exp.add_argument('--end', help="วันที่สิ้นสุด YYYY-MM-DD")
+    exp.add_argument('--action', choices=['In', 'Out'])
+    exp.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    exp.set_defaults(func=run_export)
+
+    arc = sub.add_parser('archive', help="ย้ายรายการเก่าไปเป็นไฟล์ Parquet รายเดือน แทนด้วยแถวยอดยกมา")
+    arc.add_argument('--keep-months', type=int, default=ARCHIVE_KEEP_MONTHS, help="จำนวนเดือนล่าสุดที่เก็บไว้ใน SQLite (นับเดือนปัจจุบัน)")
+    arc.add_argument('--before', help="หรือระบุวันแรกที่เก็บไว้เอง (YYYY-MM-01)")
+    arc.add_argument('--dry-run', action='store_true', help="แสดงจำนวนแถวที่จะย้ายเท่านั้น")
+    arc.set_defaults(func=run_archive)
+
+    ben = sub.add_parser('bench', help="Benchmark ด้วยข้อมูลสังเคราะห์ (ไม่แตะฐานข้อมูลจริง) บันทึกผลเป็น JSON")
+    ben.add_argument('--scales', type=lambda v: [int(x) for x in v.split(',')], default=list(BENCH_SCALES),
+                     help="จำนวนรายการที่ทดสอบ คั่นด้วย , (เช่น 10000,100000,1000000)")
+    ben.add_argument('-o', '--output', default='bench.json', help="ไฟล์ผลลัพธ์ JSON")
+    ben.add_argument('--baseline', help="ผล JSON ของ Commit ก่อนหน้า ถ้าช้ากว่าเกินเกณฑ์จะจบด้วย exit code 2")
+    ben.add_argument('--max-slowdown', type=float, default=BENCH_MAX_SLOWDOWN, help="ช้ากว่า Baseline ได้ไม่เกินกี่เท่า")
+    ben.add_argument('--repeat', type=int, default=BENCH_REPEAT, help="จำนวนรอบต่อขั้นตอนที่อ่านอย่างเดียว (ใช้เวลาที่เร็วที่สุด)")
+    ben.add_argument('--seed', type=int, default=0)
+    ben.add_argument('--workdir', help="โฟลเดอร์สำหรับฐานข้อมูลชั่วคราว (ค่าเริ่มต้น: temp ของระบบ)")
+    ben.set_defaults(func=run_bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
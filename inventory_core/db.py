@@ -0,0 +1,109 @@
+"""การเชื่อมต่อฐานข้อมูล SQLite ที่ใช้ร่วมกันทั้ง Process"""
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+# WAL ให้การอ่านไม่ถูกบล็อกระหว่างมีการเขียน และรอ Lock แทนการ error "database is locked"
+BUSY_TIMEOUT_MS = 5000
+WRITE_RETRIES = 5
+# Connection สำหรับอ่านที่ว่างอยู่ เก็บไว้ใช้ซ้ำได้สูงสุดกี่ตัวต่อฐานข้อมูล (เกินนี้ปิดทิ้งเมื่อคืน)
+READER_POOL_SIZE = 8
+SQLITE_PRAGMAS = {'synchronous': 'NORMAL', 'cache_size': -32000, 'mmap_size': 256 * 1024 * 1024, 'temp_store': 'MEMORY'}
+
+
+class ReaderLease:
+    """Connection อ่านที่ Thread หนึ่งยืมจาก Pool คืนด้วย release() (Database.release_reader)
+
+    weakref.finalize เป็นทางสำรอง: Thread ที่จบโดยไม่ได้คืน (threading.local ถูกล้าง) Connection ก็ยังกลับเข้า Pool
+    """
+
+    def __init__(self, db, conn):
+        self.conn = conn
+        self.release = weakref.finalize(self, db.checkin, conn)
+
+
+class Database:
+    """อ่านใช้ Connection จาก Pool เล็ก ๆ (ยืมได้ Thread ละ 1 ตัว), เขียนใช้ Connection เดียวทีละงาน (BEGIN IMMEDIATE + retry)
+
+    Streamlit รัน Script ของแต่ละ Session ใน Script thread ของ Session นั้น และใช้ Thread เดิมซ้ำข้าม Rerun ได้ จึงไม่รอให้ Thread จบ:
+    หน้าจอเรียก release_reader ใน finally ตอนจบทุก Rerun คืน Connection เข้า Pool ให้ Rerun/Session ถัดไปใช้ต่อ ไม่ต้องเปิดใหม่ทุกครั้ง
+    (ระหว่าง Rerun เดียวกันใช้ Connection เดิมตลอด)
+
+    read_only=True สำหรับหน้าจอที่อ่านอย่างเดียว: ไม่เปิด Connection สำหรับเขียน และตั้ง query_only กันการเขียนโดยไม่ตั้งใจ
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.local = threading.local()
+        self.idle = []  # Connection อ่านที่ว่าง (ไม่เกิน READER_POOL_SIZE)
+        self.pool_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.writer = None
+
+    def connect(self, writer=False):
+        """เปิด Connection ใหม่พร้อมตั้งค่า PRAGMA"""
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        if writer:
+            conn.execute("PRAGMA journal_mode = WAL")  # ค่าถูกเก็บในไฟล์ฐานข้อมูล ตั้งครั้งเดียวก็พอ
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        for key, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {key} = {value}")
+        return conn
+
+    def reader(self):
+        """Connection สำหรับอ่านของ Thread ปัจจุบัน (ยืมจาก Pool ครั้งแรกที่ขอ ใช้ซ้ำจนจบ Thread หรือ release_reader ไม่ต้องปิด)"""
+        lease = getattr(self.local, 'lease', None)
+        if lease is None:
+            with self.pool_lock:
+                conn = self.idle.pop() if self.idle else None
+            lease = self.local.lease = ReaderLease(self, conn or self.connect())
+        return lease.conn
+
+    def release_reader(self):
+        """คืน Connection อ่านของ Thread นี้เข้า Pool ทันที (หน้าจอเรียกตอนจบทุก Rerun) เรียกซ้ำ/ไม่เคยยืมก็ได้"""
+        lease = getattr(self.local, 'lease', None)
+        if lease is not None:
+            self.local.lease = None
+            lease.release()
+
+    def checkin(self, conn):
+        """รับ Connection อ่านคืนเข้า Pool (Pool เต็มแล้วปิดทิ้ง)"""
+        with self.pool_lock:
+            if len(self.idle) < READER_POOL_SIZE:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def write(self):
+        """เปิด Transaction สำหรับเขียน (BEGIN IMMEDIATE) ลองใหม่เมื่อฐานข้อมูลถูกล็อก, commit เมื่อสำเร็จ / rollback เมื่อผิดพลาด"""
+        if self.read_only:
+            raise sqlite3.OperationalError("database is opened read-only")
+        with self.write_lock:
+            if self.writer is None:
+                self.writer = self.connect(writer=True)
+            conn = self.writer
+            for attempt in range(WRITE_RETRIES):
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) or attempt == WRITE_RETRIES - 1:
+                        raise
+                    time.sleep(0.1 * 2 ** attempt)
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+
+def has_table(conn, name):
+    """ตรวจว่ามีตาราง/Virtual table ชื่อนี้ในฐานข้อมูลหรือไม่"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
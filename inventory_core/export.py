@@ -0,0 +1,81 @@
+"""เขียนข้อมูลออกเป็นไฟล์ทีละ Chunk (CSV / Excel / Parquet) หน่วยความจำไม่โตตามจำนวนแถว
+
+out เป็นได้ทั้ง path และไฟล์แบบ binary ที่เปิดไว้แล้ว (เช่น tempfile สำหรับปุ่มดาวน์โหลด)
+"""
+import io
+import os
+
+# ชนิดคอลัมน์ SQLite -> Arrow (ใช้ Schema ของตาราง ไม่ใช่ของ Chunk แรก ซึ่งอาจเป็นค่าว่างทั้งคอลัมน์)
+ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'string'}
+# แถวสูงสุดต่อ Sheet ของ Excel (รวมหัวตาราง) เกินนี้ขึ้น Sheet ใหม่
+XLSX_MAX_ROWS = 1048576
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def frame_chunks(df, size=50000):
+    """แบ่ง DataFrame ที่อยู่ในหน่วยความจำแล้วเป็น Chunk (ใช้กับตารางที่กรองบนหน้าจอ)"""
+    for start in range(0, max(len(df), 1), size):
+        yield df.iloc[start:start + size]
+
+
+def write_csv(chunks, out, encoding='utf-8-sig'):
+    """เขียน DataFrame ทีละ Chunk ต่อกันเป็น CSV (หัวตารางเฉพาะ Chunk แรก, utf-8-sig ให้ Excel อ่านภาษาไทยได้) คืนจำนวนแถว"""
+    is_path = isinstance(out, (str, os.PathLike))
+    f = open(out, 'w', encoding=encoding, newline='') if is_path else io.TextIOWrapper(out, encoding=encoding, newline='')
+    rows, header = 0, True
+    try:
+        for df in chunks:
+            df.to_csv(f, index=False, header=header)
+            rows += len(df)
+            header = False
+    finally:
+        if is_path:
+            f.close()
+        else:
+            f.flush()
+            f.detach()  # ไม่ปิดไฟล์ของผู้เรียก
+    return rows
+
+
+def write_xlsx(chunks, out, sheet='data'):
+    """เขียน DataFrame ทีละ Chunk เป็น .xlsx ด้วย openpyxl แบบ write-only (แถวถูกเขียนลงไฟล์ชั่วคราวทันที ไม่ค้างในหน่วยความจำ) คืนจำนวนแถว"""
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws, header, used, rows = None, None, 0, 0
+    for df in chunks:
+        if header is None:
+            header = [str(c) for c in df.columns]
+        values = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        for row in values:
+            if ws is None or used >= XLSX_MAX_ROWS:
+                ws = wb.create_sheet(sheet if ws is None else f"{sheet} ({len(wb.worksheets) + 1})")
+                ws.append(header)
+                used = 1
+            ws.append(row)
+            used += 1
+            rows += 1
+    if ws is None:
+        wb.create_sheet(sheet).append(header or [])
+    wb.save(out)
+    return rows
+
+
+def arrow_schema(conn, table):
+    """Schema ของ Parquet จากชนิดคอลัมน์ที่ประกาศไว้ในตาราง"""
+    import pyarrow as pa
+
+    return pa.schema([(name, ARROW_TYPES.get(decl.upper(), 'string')) for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})")])
+
+
+def write_parquet(chunks, out, schema):
+    """เขียน DataFrame ทีละ Chunk เป็น Row group ของไฟล์ Parquet (ต้องติดตั้ง pyarrow) คืนจำนวนแถว"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        for df in chunks:
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            rows += len(df)
+    return rows
@@ -0,0 +1,67 @@
+"""DataFrame แบบกำหนดชนิดคอลัมน์ (category / datetime64 / float32) ลดหน่วยความจำของข้อมูลที่โหลดค้างไว้ใน Cache"""
+
+# คอลัมน์ที่ค่าซ้ำกันมาก -> category (เก็บรหัสตัวเลขต่อแถว + ตารางค่าไม่ซ้ำชุดเดียว)
+CATEGORY_COLUMNS = {'action_type', 'unit', 'category', 'department', 'requester', 'upload_time', 'chem_code', 'chem_desc'}
+# คอลัมน์ข้อความอื่นเป็น category เมื่อค่าไม่ซ้ำน้อยกว่าสัดส่วนนี้ของจำนวนแถว (เช่น item_code / item_name)
+CATEGORY_RATIO = 0.5
+DATE_COLUMNS = {'date', 'expiry_date'}
+# ใช้ float32 เฉพาะเมื่อทุกค่าแปลงกลับเป็น float64 ได้ตรงเดิม (จำนวนเต็ม < 2^24, ทศนิยมฐานสองสั้น ๆ)
+FLOAT_COLUMNS = {'quantity', 'qty_kg', 'qty_l', 'density', 'bal_kg', 'bal_l'}
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def to_dates(s):
+    """คอลัมน์วันที่ (ข้อความ) -> datetime64 เมื่อแปลงได้ทุกค่าที่ไม่ว่าง ไม่อย่างนั้นคืน None (คงข้อความเดิมไว้ ไม่ให้กลายเป็น NaT)
+
+    รูปแบบอื่นนอกจาก YYYY-MM-DD (แถวเก่าที่บันทึกก่อนตรวจวันที่ตอนนำเข้า) แปลงด้วย parse_dates แบบเดียวกับตอนนำเข้า
+    """
+    import pandas as pd
+
+    from .ingest import parse_dates
+
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    dates = pd.to_datetime(s, errors='coerce', format='%Y-%m-%d')
+    if not dates.isna().any():
+        return dates
+    other = dates.isna() & s.notna() & (s.astype('string').str.strip() != '')
+    if other.any():
+        dates[other] = pd.to_datetime(parse_dates(s[other]), errors='coerce', format='%Y-%m-%d')
+        if dates[other].isna().any():
+            return None
+    return dates
+
+
+def compact_frame(df):
+    """แปลงชนิดคอลัมน์ของ DataFrame ที่อ่านจาก SQLite ในที่ (คืน df เดิม) และเก็บขนาดก่อนแปลงไว้ที่ df.attrs['raw_bytes']"""
+    import numpy as np
+    import pandas as pd
+
+    raw = frame_bytes(df)
+    for col in df.columns:
+        s = df[col]
+        if col in DATE_COLUMNS:
+            dates = to_dates(s)
+            if dates is not None:
+                df[col] = dates
+        elif col in FLOAT_COLUMNS:
+            s = pd.to_numeric(s, errors='coerce')
+            small = s.astype('float32')
+            df[col] = small if ((small.astype('float64') == s) | s.isna()).all() else s.astype('float64')
+        elif col in ('id', 'batch_id') and len(s) and s.notna().all() and s.max() < np.iinfo('int32').max:
+            df[col] = s.astype('int32')
+        elif (s.dtype == object or isinstance(s.dtype, pd.StringDtype)) and (col in CATEGORY_COLUMNS or s.nunique() < len(s) * CATEGORY_RATIO):
+            df[col] = s.astype('category')
+    df.attrs['raw_bytes'] = raw
+    return df
+
+
+def memory_report(frames):
+    """(ขนาดปัจจุบัน, ขนาดก่อนแปลงชนิด) รวมของ DataFrame ที่หน้าจอโหลดมาใช้ (bytes) DataFrame เดียวกันนับครั้งเดียว"""
+    frames = list({id(df): df for df in frames}.values())
+    now = sum(frame_bytes(df) for df in frames)
+    raw = sum(df.attrs.get('raw_bytes', frame_bytes(df)) for df in frames)
+    return now, raw
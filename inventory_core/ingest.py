@@ -0,0 +1,423 @@
+"""นำเข้าข้อมูล: อ่านไฟล์ Excel แบบ Streaming, ตรวจไฟล์ซ้ำด้วย hash, ตรวจทีละแถวแบบคอลัมน์ และบันทึกทีละ Chunk"""
+import hashlib
+import io
+from datetime import datetime
+from itertools import islice
+
+from .balances import build_checkpoints, invalidate_checkpoints, refresh_item_balances
+from .items import item_keys, resolve_items
+from .chemicals import convert_chem_chunk, ledger_starts, refresh_chem_ledger
+from .profiling import timed, timed_iter
+
+# จำนวนแถวต่อ Chunk (อ่านและบันทึกทีละ Chunk หน่วยความจำไม่โตตามขนาดไฟล์)
+CHUNK_ROWS = 5000
+
+# Mapping หัวคอลัมน์ในไฟล์ -> คอลัมน์ในฐานข้อมูล (หัวคอลัมน์ที่เป็นชื่อในฐานข้อมูลอยู่แล้วใช้ได้เลย)
+# วัสดุ: (Mapping, คอลัมน์ที่บันทึก) แยกตามประเภทรายการ
+MATERIAL_COLUMNS = {
+    'In': ({'วันที่รับเข้า': 'date', 'รหัสวัสดุ': 'item_code', 'คำอธิบาย': 'item_name',
+            'จำนวน': 'quantity', 'หน่วย': 'unit', 'วันที่หมดอายุ': 'expiry_date',
+            'ประเภทวัสดุ': 'category', 'หมายเหตุ': 'remark'},
+           ['date', 'item_code', 'item_name', 'quantity', 'unit', 'expiry_date', 'category', 'remark']),
+    'Out': ({'วันที่เบิกจ่าย': 'date', 'รหัสวัสดุ': 'item_code', 'คำอธิบาย': 'item_name',
+             'จำนวนที่เบิก': 'quantity', 'หน่วย': 'unit', 'หน่วยงานที่เบิก': 'department',
+             'ผู้ที่ทำการเบิก': 'requester', 'ประเภทวัสดุ': 'category', 'หมายเหตุ': 'remark'},
+            ['date', 'item_code', 'item_name', 'quantity', 'unit', 'department', 'requester', 'category', 'remark']),
+}
+# รูปแบบวันที่ที่รับได้ (วันที่จาก Excel เป็น datetime แปลงเป็นข้อความแบบแรก) ปีที่เกิน BE_YEAR_FROM คือ พ.ศ. (ลบ BE_OFFSET)
+# แบบที่สอง (xx/xx/ปี) กำกวม: ค่าเริ่มต้นอ่านเป็น เดือน/วัน/ปี เหมือน pd.to_datetime เดิม, DAY_FIRST = True -> วัน/เดือน/ปี
+DATE_PATTERNS = [
+    (r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:[ T].*)?$', ('year', 'month', 'day')),
+    (r'^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})(?: .*)?$', ('month', 'day', 'year')),
+]
+DAY_FIRST = False
+BE_YEAR_FROM = 2400
+BE_OFFSET = 543
+# สารเคมี: r_code = รหัส/ชื่อในไฟล์ (แปลงเป็นรหัสถังด้วย CHEM_MAPPING), qty_kg = จำนวน (KG)
+CHEM_COLUMNS = {
+    'In': {'วันที่รับเข้า': 'date', 'รหัสวัสดุ': 'r_code', 'คำอธิบาย': 'chem_desc', 'จำนวน': 'qty_kg'},
+    'Out': {'วันที่เบิกจ่าย': 'date', 'รหัสวัสดุ': 'r_code', 'คำอธิบาย': 'chem_desc', 'จำนวนที่เบิก': 'qty_kg',
+            'หน่วยงานที่เบิก': 'department', 'ผู้ที่ทำการเบิก': 'requester'},
+}
+
+
+class IngestError(Exception):
+    """การนำเข้าล้มเหลวกลางทาง: Chunk ก่อนหน้าถูกบันทึกไปแล้ว inserted แถว ในรอบ batch_id (ลบย้อนได้ด้วย delete_batch)"""
+
+    def __init__(self, cause, inserted, upload_time, report=None, batch_id=None):
+        where = f"รอบ #{batch_id} ({upload_time})" if batch_id is not None else f"รอบ {upload_time}"
+        super().__init__(f"{cause} (บันทึกไปแล้ว {inserted:,} รายการ ใน{where})")
+        self.inserted = inserted
+        self.upload_time = upload_time
+        self.batch_id = batch_id
+        self.report = report
+
+
+def upload_stamp(now=None):
+    """เวลาอัปโหลดที่ใช้เป็นรหัสรอบ (Batch ID) รูปแบบ YYYY-MM-DD HH:MM:SS"""
+    return (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def to_records(df):
+    """แปลง DataFrame เป็น tuple สำหรับ executemany (NaN -> NULL)"""
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def open_workbook(f):
+    """เปิดไฟล์ Excel แบบ read-only (อ่านทีละแถวจาก XML ไม่โหลดทั้งไฟล์เข้าหน่วยความจำ)"""
+    import openpyxl
+
+    return openpyxl.load_workbook(f, read_only=True, data_only=True)
+
+
+def sheet_rows(ws, cmap):
+    """คืน (ชื่อคอลัมน์หลัง Mapping, Iterator ของ (เลขแถวใน Excel, แถวข้อมูล)) โดยข้ามแถวที่ว่างทั้งแถว
+
+    เลขแถวนับจากแถวจริงใน Sheet (หัวตาราง = แถว 1) แถวว่างที่ข้ามไปจึงไม่ทำให้เลขแถวในรายงานเลื่อน
+    """
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, ())
+    cols = [cmap.get(h, h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+    return cols, ((n, r) for n, r in enumerate(rows, start=2) if any(v is not None for v in r))
+
+
+def preview_sheet(ws, cmap=None, n=3):
+    """อ่านเฉพาะ n แถวแรกไว้แสดงตัวอย่าง"""
+    import pandas as pd
+
+    cols, rows = sheet_rows(ws, cmap or {})
+    return pd.DataFrame([r for _, r in islice(rows, n)], columns=cols)
+
+
+def count_rows(ws):
+    """จำนวนแถวข้อมูลโดยประมาณจาก dimension ของ Sheet (ใช้แสดง Progress เท่านั้น)"""
+    return max(ws.max_row - 1, 0) if ws.max_row else None
+
+
+def read_sheet_chunks(ws, cmap, columns=None, size=CHUNK_ROWS):
+    """Generator คืน DataFrame ทีละ size แถว ผ่าน Mapping (columns = เติมคอลัมน์ที่ขาดให้ครบ)
+
+    index = เลขแถวใน Excel (นับแถวว่างที่ข้ามไปด้วย) ใช้เป็นเลขแถวในรายงานแถวที่ไม่ผ่านได้ตรง ๆ
+    """
+    import pandas as pd
+
+    cols, rows = sheet_rows(ws, cmap)
+    while True:
+        block = list(islice(rows, size))
+        if not block:
+            break
+        numbers, values = zip(*block)
+        chunk = pd.DataFrame(list(values), columns=cols, index=pd.Index(numbers, dtype='int64'))
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+        yield chunk.reindex(columns=columns) if columns else chunk
+
+
+def read_file_chunks(path, cmap, columns=None, size=CHUNK_ROWS, sheet=None):
+    """Generator คืน DataFrame ทีละ size แถวจากไฟล์ .xlsx / .csv / .jsonl (เลือกตามนามสกุลไฟล์)
+
+    CSV อ่านทุกคอลัมน์เป็นข้อความ (รหัสวัสดุที่ขึ้นต้นด้วย 0 ไม่หาย) ให้ SQLite แปลงตามชนิดคอลัมน์ตอนบันทึก
+    index = เลขแถวในไฟล์ (CSV: หัวตาราง = แถว 1, JSONL: บรรทัดแรก = แถว 1)
+    """
+    import pandas as pd
+
+    ext = str(path).lower().rsplit('.', 1)[-1]
+    if ext in ('xlsx', 'xlsm'):
+        wb = open_workbook(path)
+        try:
+            yield from read_sheet_chunks(wb[sheet] if sheet else wb.worksheets[0], cmap, columns, size)
+        finally:
+            wb.close()
+        return
+    if ext == 'csv':
+        reader, first = pd.read_csv(path, dtype=str, encoding='utf-8-sig', chunksize=size), 2
+    elif ext in ('jsonl', 'ndjson'):
+        reader, first = pd.read_json(path, lines=True, dtype=False, convert_dates=False, chunksize=size), 1
+    else:
+        raise ValueError(f"ไม่รองรับไฟล์ .{ext} (ใช้ได้ .xlsx, .csv, .jsonl)")
+    with reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns=cmap).set_axis(chunk.index + first)
+            chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+            yield chunk.reindex(columns=columns) if columns else chunk
+
+
+def file_digest(data):
+    """SHA-256 ของเนื้อไฟล์ ใช้เป็น Key ของ Cache และตรวจจับไฟล์ซ้ำ"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def path_digest(path, block=1 << 20):
+    """SHA-256 ของไฟล์บนดิสก์ (อ่านทีละ block ไม่โหลดทั้งไฟล์)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for part in iter(lambda: f.read(block), b''):
+            h.update(part)
+    return h.hexdigest()
+
+
+@timed('excel')
+def inspect_workbook(data):
+    """เปิดไฟล์ครั้งเดียว คืน {ชื่อ Sheet: (ตัวอย่าง 3 แถว, จำนวนแถว)} ตามลำดับ Sheet ในไฟล์"""
+    wb = open_workbook(io.BytesIO(data))
+    try:
+        return {name: (preview_sheet(wb[name]), count_rows(wb[name])) for name in wb.sheetnames}
+    finally:
+        wb.close()
+
+
+def find_upload(db, digest, sheet, action_type):
+    """รอบล่าสุดที่เคยนำเข้าไฟล์นี้ คืน (upload_time, rows) หรือ None"""
+    return db.reader().execute(
+        "SELECT upload_time, rows FROM upload_batches WHERE file_hash = ? AND sheet = ? AND action_type = ? ORDER BY id DESC LIMIT 1",
+        (digest, sheet, action_type)).fetchone()
+
+
+def record_batch(conn, batch_id, table, action_type, batch_timestamp, rows, upload=None, user=None):
+    """สร้างรอบอัปโหลดใน Transaction ของ Chunk แรก (batch_id=None) หรือเพิ่มจำนวนแถวของรอบเดิม คืน batch_id
+
+    upload = (hash, sheet) ของไฟล์ บันทึกพร้อม Chunk แรก (นำเข้าได้บางส่วนก็ยังถูกจับว่าเคยนำเข้าแล้ว)
+    """
+    if batch_id is not None:
+        conn.execute("UPDATE upload_batches SET rows = rows + ? WHERE id = ?", (rows, batch_id))
+        return batch_id
+    file_hash, sheet = upload or (None, None)
+    return conn.execute('''
+        INSERT INTO upload_batches (tbl, action_type, upload_time, file_hash, sheet, rows, uploaded_by) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (table, action_type, batch_timestamp, file_hash, sheet, rows, user)).lastrowid
+
+
+def as_chunks(data):
+    """รับได้ทั้ง DataFrame เดียว หรือ Iterable ของ DataFrame (index ของแต่ละ Chunk = เลขแถวที่ใช้ในรายงาน)"""
+    import pandas as pd
+
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+
+def is_blank(col):
+    """ค่าว่าง (NaN / None / ข้อความว่าง)"""
+    return col.isna() | (col.astype('string').str.strip() == '')
+
+
+def parse_dates(col, day_first=None):
+    """แปลงวันที่ทั้งคอลัมน์เป็น YYYY-MM-DD ตาม DATE_PATTERNS (ปี-เดือน-วัน หรือ เดือน/วัน/ปี, ปี พ.ศ. ได้) ที่แปลงไม่ได้ = None
+
+    day_first (ค่าเริ่มต้น DAY_FIRST) = อ่าน xx/xx/ปี เป็น วัน/เดือน/ปี เช่น 01/05/2024 -> 2024-05-01 แทน 2024-01-05
+    """
+    import pandas as pd
+
+    text = col.astype('string').str.strip().fillna('')
+    # ทางลัด: YYYY-MM-DD อยู่แล้ว (ค.ศ.) ใช้ข้อความเดิม ที่เหลือจึงแยกส่วนด้วย Regex
+    iso = (pd.to_datetime(text, format='%Y-%m-%d', errors='coerce').notna() & (text.str.len() == 10)
+           & (text.str[:4] <= str(BE_YEAR_FROM)))
+    out = text.where(iso, pd.NA)
+    for pattern, fields in DATE_PATTERNS:
+        parts = text[out.isna()].str.extract(pattern).dropna()
+        if parts.empty:
+            continue
+        parts = parts.astype('int64').set_axis(fields, axis=1)
+        if fields[0] != 'year' and (DAY_FIRST if day_first is None else day_first):
+            parts = parts.rename(columns={'day': 'month', 'month': 'day'})
+        parts['year'] = parts['year'].mask(parts['year'] > BE_YEAR_FROM, parts['year'] - BE_OFFSET)
+        out.loc[parts.index] = pd.to_datetime(parts[['year', 'month', 'day']], errors='coerce').dt.strftime('%Y-%m-%d')
+    return out.astype(object).where(out.notna(), None)
+
+
+def parse_quantity(col):
+    """จำนวนทั้งคอลัมน์เป็นตัวเลข (ตัดจุลภาคคั่นหลักพัน) ที่ไม่ใช่ตัวเลข = NaN"""
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype('float64')
+    return pd.to_numeric(col.astype('string').str.replace(',', '', regex=False).str.strip(), errors='coerce').astype('float64')
+
+
+def normalize_materials(df, action_type, batch_timestamp):
+    """เติม action_type/upload_time, แปลงวันที่เป็น YYYY-MM-DD / จำนวนเป็นตัวเลข และแทนรหัสวัสดุที่ว่างด้วย '-'"""
+    df = df.assign(action_type=action_type, upload_time=batch_timestamp)
+    for col in ['date', 'expiry_date']:
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    if 'quantity' in df.columns:
+        df['quantity'] = parse_quantity(df['quantity'])
+    if 'item_code' in df.columns:
+        df['item_code'] = df['item_code'].fillna('-')
+    return df
+
+
+def row_errors(index, problems):
+    """[(mask, เหตุผล)] -> DataFrame(row, reason) แถวละ 1 บรรทัด (หลายปัญหาคั่นด้วย ', ') row = index ของ Chunk"""
+    import pandas as pd
+
+    parts = [pd.Series(reason, index=index)[mask] for mask, reason in problems if mask.any()]
+    if not parts:
+        return pd.DataFrame({'row': pd.Series(dtype='int64'), 'reason': pd.Series(dtype=object)})
+    reasons = pd.concat(parts).groupby(level=0).agg(', '.join)
+    return pd.DataFrame({'row': reasons.index, 'reason': reasons.values})
+
+
+def validate_materials(df, action_type, batch_timestamp):
+    """ตรวจทั้ง Chunk แบบคอลัมน์ก่อนบันทึก คืน (แถวที่ผ่านหลัง normalize_materials, DataFrame(row, reason) ของแถวที่ไม่ผ่าน)
+
+    วันที่ต้องมีและแปลงได้, วันหมดอายุว่างได้แต่ถ้ามีต้องแปลงได้, จำนวนเป็นตัวเลขมากกว่า 0, ต้องมีรหัสหรือชื่อวัสดุ
+    ยอดคงเหลือของรายการเบิกตรวจภายหลังด้วย check_stock (ใน Transaction ที่บันทึก)
+    """
+    out = normalize_materials(df, action_type, batch_timestamp)
+    keys = item_keys(df)
+    problems = [
+        (is_blank(df['date']), 'ไม่มีวันที่'),
+        (~is_blank(df['date']) & out['date'].isna(), 'วันที่ไม่ถูกต้อง'),
+        (out['quantity'].isna(), 'จำนวนไม่ใช่ตัวเลข'),
+        (out['quantity'] <= 0, 'จำนวนต้องมากกว่า 0'),
+        ((keys['code_key'] == '') & (keys['name_key'] == ''), 'ไม่มีรหัสและชื่อวัสดุ'),
+    ]
+    if 'expiry_date' in df.columns:
+        problems.append((~is_blank(df['expiry_date']) & out['expiry_date'].isna(), 'วันหมดอายุไม่ถูกต้อง'))
+    bad = row_errors(df.index, problems)
+    return out.drop(index=bad['row']), bad
+
+
+def check_stock(conn, df):
+    """รายการเบิกที่เกินยอดคงเหลือปัจจุบัน (ไล่ตามลำดับแถวของแต่ละวัสดุ) คืน DataFrame(row, reason)
+
+    หักยอดเฉพาะแถวที่ผ่าน แถวที่เบิกเกินยอดที่เหลือไม่ผ่านและไม่ถูกหัก แถวถัดไปที่ยังพอจึงผ่านได้
+    (คงเหลือ 10 เบิก 6, 6, 3 -> ไม่ผ่านเฉพาะ 6 แถวที่สอง) Chunk ถัดไปเห็นยอดที่ Chunk ก่อนหน้าบันทึกแล้วใน item_balances
+
+    หาวัสดุแบบเดียวกับ resolve_items (ชื่อเรียกที่ตรงกันก่อน แล้วจึงรหัสเดียวกัน) แต่ไม่สร้างวัสดุใหม่: วัสดุที่ไม่เคยมีคงเหลือ 0
+    """
+    import pandas as pd
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS out_check (row INTEGER PRIMARY KEY, code_key TEXT, name_key TEXT, quantity REAL)")
+    conn.execute("DELETE FROM temp.out_check")
+    rows = item_keys(df).assign(row=df.index, quantity=df['quantity'])
+    conn.executemany("INSERT INTO temp.out_check VALUES (?, ?, ?, ?)",
+                     rows[['row', 'code_key', 'name_key', 'quantity']].itertuples(index=False, name=None))
+    found = conn.execute('''
+        SELECT c.row, c.item_id, c.quantity, IFNULL(b.balance, 0)
+        FROM (SELECT o.row, o.quantity, COALESCE(
+                     (SELECT a.item_id FROM item_aliases a WHERE a.code_key = o.code_key AND a.name_key = o.name_key),
+                     (SELECT a.item_id FROM item_aliases a WHERE o.code_key != '' AND a.code_key = o.code_key LIMIT 1)) AS item_id
+              FROM temp.out_check o) c
+        LEFT JOIN item_balances b ON b.item_id = c.item_id
+        ORDER BY c.row
+    ''').fetchall()
+    left, short = {}, []
+    for row, item_id, quantity, balance in found:
+        key = item_id if item_id is not None else -row  # วัสดุที่ยังไม่มีในระบบ: แยกกันทุกแถว (คงเหลือ 0)
+        available = left.setdefault(key, balance)
+        if quantity > available + 1e-9:
+            short.append((row, available))
+        else:
+            left[key] = available - quantity
+    return pd.DataFrame({'row': pd.Series([row for row, _ in short], dtype='int64'),
+                         'reason': pd.Series([f'เบิกเกินยอดคงเหลือ (คงเหลือ {available:,.2f})' for _, available in short], dtype=object)})
+
+
+def empty_material_report():
+    import pandas as pd
+
+    return {'inserted': 0, 'invalid': pd.DataFrame(columns=['row', 'reason'])}
+
+
+@timed('write')
+def insert_materials(db, data, action_type, upload_time=None, upload=None, on_progress=None, user=None, batch_id=None):
+    """ตรวจและบันทึกวัสดุทีละ Chunk (1 Chunk = 1 Transaction พร้อมอัปเดตยอดคงเหลือ) คืนรายงานรวม {'inserted', 'invalid'}
+
+    แถวที่ไม่ผ่าน validate_materials / check_stock ถูกข้ามและอยู่ใน invalid (row = index ของ Chunk = เลขแถวในไฟล์) แถวที่ผ่านบันทึกด้วย INSERT ครั้งเดียว
+    ทุก Chunk อยู่ในรอบอัปโหลด (upload_batches) เดียวกัน จึงยกเลิกได้ทั้งรอบ, on_progress(จำนวนแถวที่อ่านแล้ว) ถูกเรียกหลังแต่ละ Chunk
+    batch_id = รอบที่สร้างไว้แล้ว (งานในคิว) ไม่ต้องสร้างรอบใหม่
+    """
+    import pandas as pd
+
+    report = empty_material_report()
+    batch_timestamp = upload_time or upload_stamp()
+    done, invalid = 0, []
+    error = None
+    try:
+        for df in timed_iter(as_chunks(data), 'read chunks', 'excel'):
+            if df.empty:
+                continue
+            done += len(df)
+            df, bad = validate_materials(df, action_type, batch_timestamp)
+            invalid.append(bad)
+            if not df.empty:
+                with db.write() as conn:
+                    if action_type == 'Out':
+                        short = check_stock(conn, df)
+                        invalid.append(short)
+                        df = df.drop(index=short['row'])
+                    if not df.empty:
+                        bid = record_batch(conn, batch_id, 'transactions', action_type, batch_timestamp, len(df), upload, user)
+                        df = df.assign(batch_id=bid, item_id=resolve_items(conn, df))
+                        cols = list(df.columns)
+                        conn.executemany(f"INSERT INTO transactions ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", to_records(df))
+                        refresh_item_balances(conn, df['item_id'].unique())
+                        invalidate_checkpoints(conn, df['date'].min())
+                if not df.empty:
+                    batch_id = bid  # ใช้รอบนี้ต่อเมื่อ Chunk แรก commit แล้วเท่านั้น
+                    report['inserted'] += len(df)
+            if on_progress:
+                on_progress(done)
+        if report['inserted']:
+            # Checkpoint ของเดือนที่ถูกล้าง (รายการย้อนหลัง) สร้างใหม่ครั้งเดียวหลัง Chunk สุดท้าย หน้าจอยอด ณ วันที่ไม่ต้องเขียนเอง
+            with db.write() as conn:
+                build_checkpoints(conn)
+    except Exception as e:
+        error = e
+
+    invalid = [bad for bad in invalid if not bad.empty]
+    if invalid:
+        report['invalid'] = pd.concat(invalid, ignore_index=True).sort_values('row', ignore_index=True)
+    if error is not None:
+        raise IngestError(error, report['inserted'], batch_timestamp, report, batch_id) from error
+    return report
+
+
+def empty_chem_report():
+    import pandas as pd
+
+    return {'inserted': 0, 'unknown': pd.DataFrame(columns=['r_code', 'rows']), 'invalid': pd.DataFrame(columns=['row', 'reason'])}
+
+
+@timed('write')
+def insert_chemicals(db, data, action_type, upload_time=None, upload=None, on_progress=None, user=None, batch_id=None):
+    """แปลงและบันทึกสารเคมีทีละ Chunk (1 Chunk = 1 Transaction พร้อมอัปเดต Ledger) คืนรายงานรวม {'inserted', 'unknown', 'invalid'}
+
+    on_progress(จำนวนแถวที่อ่านแล้ว) ถูกเรียกหลังแต่ละ Chunk, batch_id เหมือน insert_materials
+    """
+    import pandas as pd
+
+    report = empty_chem_report()
+    batch_timestamp = upload_time or upload_stamp()
+    done, unknown, invalid = 0, [], []
+    error = None
+    try:
+        for df in timed_iter(as_chunks(data), 'read chunks', 'excel'):
+            if df.empty:
+                continue
+            out, bad_codes, bad_rows = convert_chem_chunk(df, action_type, batch_timestamp)
+            unknown.append(bad_codes)
+            invalid.append(bad_rows)
+            if not out.empty:
+                with db.write() as conn:
+                    bid = record_batch(conn, batch_id, 'chemical_transactions', action_type, batch_timestamp, len(out), upload, user)
+                    last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM chemical_transactions").fetchone()[0]
+                    conn.executemany('''
+                        INSERT INTO chemical_transactions (date, chem_code, chem_desc, action_type, qty_kg, qty_l, density, department, requester, upload_time, batch_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', to_records(out.assign(batch_id=bid)))
+                    refresh_chem_ledger(conn, ledger_starts(conn, "id > ?", (last_id,)))
+                batch_id = bid
+                report['inserted'] += len(out)
+            done += len(df)
+            if on_progress:
+                on_progress(done)
+    except Exception as e:
+        error = e
+
+    if unknown:
+        report['unknown'] = pd.concat(unknown).value_counts().rename_axis('r_code').reset_index(name='rows')
+    if invalid:
+        report['invalid'] = pd.concat(invalid, ignore_index=True)
+    if error is not None:
+        raise IngestError(error, report['inserted'], batch_timestamp, report, batch_id) from error
+    return report
@@ -0,0 +1,124 @@
+"""ทะเบียนวัสดุ (items) ที่มีรหัสเป็นตัวเลข และชื่อเรียกทุกแบบที่เคยพบ (item_aliases)
+
+ทุกรายการใน transactions อ้างถึงวัสดุด้วย item_id ตั้งแต่ตอนบันทึก ยอดคงเหลือ / Checkpoint รวมตาม item_id แทนคู่ข้อความ (รหัส, ชื่อ)
+ชื่อเรียก = (code_key, name_key) ที่ตัดช่องว่างซ้ำ / ไม่สนตัวพิมพ์แล้ว: รหัสเดียวกันคือวัสดุเดียวกันแม้ชื่อสะกดต่างกัน
+รายการที่ไม่มีรหัส ('-') แยกวัสดุตามชื่อ ชื่อเรียกที่ยังแยกกันอยู่รวมเป็นวัสดุเดียวได้ด้วย merge_items
+"""
+from .balances import refresh_item_balances
+
+# รหัสที่ถือว่า "ไม่มีรหัส" (หลังตัดช่องว่างและแปลงเป็นตัวพิมพ์ใหญ่)
+MISSING_CODES = ('', '-', 'NAN', 'NONE')
+
+
+def item_keys(df):
+    """ชื่อเรียกของแต่ละแถว DataFrame(code_key, name_key) จากคอลัมน์ item_code / item_name (แปลงทั้งคอลัมน์ทีเดียว)"""
+    import pandas as pd
+
+    code = df['item_code'].astype('string').fillna('').str.strip().str.upper()
+    code = code.mask(code.isin(MISSING_CODES), '')
+    name = df['item_name'].astype('string').fillna('').str.replace(r'\s+', ' ', regex=True).str.strip().str.casefold()
+    return pd.DataFrame({'code_key': code.astype(object), 'name_key': name.astype(object)}, index=df.index)
+
+
+def plain(value):
+    """ค่าสำหรับ bind ใน SQLite (NaN / NA -> NULL)"""
+    import pandas as pd
+
+    return None if pd.isna(value) else value
+
+
+def resolve_items(conn, df):
+    """item_id ของทุกแถวใน df (Series ตาม index ของ df) ภายใน Transaction ของผู้เรียก
+
+    ชื่อเรียกที่ยังไม่เคยพบ: ถ้ามีรหัสและรหัสนี้มีวัสดุอยู่แล้วใช้วัสดุนั้น ไม่งั้นสร้างวัสดุใหม่ (ชื่อแรกที่พบเป็นชื่อหลัก)
+    """
+    import pandas as pd
+
+    keys = item_keys(df)
+    if keys.empty:
+        return pd.Series(index=df.index, dtype='int64')
+    uniq = keys.assign(item_code=df['item_code'], item_name=df['item_name']).drop_duplicates(['code_key', 'name_key'])
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS item_lookup (code_key TEXT, name_key TEXT)")
+    conn.execute("DELETE FROM temp.item_lookup")
+    conn.executemany("INSERT INTO temp.item_lookup VALUES (?, ?)", uniq[['code_key', 'name_key']].itertuples(index=False, name=None))
+    ids = {(c, n): i for c, n, i in conn.execute(
+        "SELECT l.code_key, l.name_key, a.item_id FROM temp.item_lookup l JOIN item_aliases a USING (code_key, name_key)")}
+    for ck, nk, code, name in uniq.itertuples(index=False, name=None):
+        if (ck, nk) in ids:
+            continue
+        row = conn.execute("SELECT item_id FROM item_aliases WHERE code_key = ? LIMIT 1", (ck,)).fetchone() if ck else None
+        if row is None:
+            row = conn.execute("INSERT INTO items (item_code, item_name) VALUES (?, ?) RETURNING id", (plain(code), plain(name))).fetchone()
+        conn.execute("INSERT INTO item_aliases (code_key, name_key, item_id) VALUES (?, ?, ?)", (ck, nk, row[0]))
+        ids[ck, nk] = row[0]
+    return pd.Series([ids[k] for k in zip(keys['code_key'], keys['name_key'])], index=df.index, dtype='int64')
+
+
+def lookup_items(conn, df):
+    """เหมือน resolve_items แต่อ่านอย่างเดียว (ชื่อเรียกที่ไม่รู้จัก = <NA>) ใช้กับรายการจาก Archive ที่ยังไม่มี item_id"""
+    import pandas as pd
+
+    keys = item_keys(df)
+    aliases = pd.read_sql_query("SELECT code_key, name_key, item_id FROM item_aliases", conn)
+    found = keys.merge(aliases, on=['code_key', 'name_key'], how='left')['item_id']
+    return pd.Series(found.to_numpy(), index=df.index).astype('Int64')
+
+
+def backfill_item_ids(conn):
+    """ใส่ item_id ให้รายการเดิมที่ยังไม่มี (ย้ายฐานข้อมูลเดิม) ชื่อที่ใช้บ่อยที่สุดของแต่ละรหัสเป็นชื่อหลัก คืนจำนวนชื่อเรียกที่พบ"""
+    import pandas as pd
+
+    pairs = pd.read_sql_query('''
+        SELECT item_code, item_name FROM transactions WHERE item_id IS NULL
+        GROUP BY item_code, item_name ORDER BY COUNT(*) DESC
+    ''', conn)
+    if pairs.empty:
+        return 0
+    pairs['item_id'] = resolve_items(conn, pairs)
+    conn.execute("DROP TABLE IF EXISTS temp.item_map")
+    conn.execute("CREATE TEMP TABLE item_map (item_code TEXT, item_name TEXT, item_id INTEGER)")
+    conn.executemany("INSERT INTO temp.item_map VALUES (?, ?, ?)",
+                     [(plain(c), plain(n), int(i)) for c, n, i in pairs.itertuples(index=False, name=None)])
+    # +item_id: ค้นผ่าน Index (รหัส, ชื่อ) ไม่ใช่ Index ของ item_id (ที่ทุกแถวยังเป็น NULL)
+    conn.execute('''
+        UPDATE transactions SET item_id = m.item_id FROM temp.item_map m
+        WHERE +transactions.item_id IS NULL AND transactions.item_code IS m.item_code AND transactions.item_name IS m.item_name
+    ''')
+    conn.execute("DROP TABLE temp.item_map")
+    return len(pairs)
+
+
+def read_items(db):
+    """ทะเบียนวัสดุพร้อมจำนวนชื่อเรียกและยอดคงเหลือ (สำหรับหน้าจอรวมรายการ)"""
+    import pandas as pd
+
+    return pd.read_sql_query('''
+        SELECT i.id AS item_id, i.item_code, i.item_name, i.unit, i.category,
+               (SELECT COUNT(*) FROM item_aliases a WHERE a.item_id = i.id) AS aliases,
+               IFNULL(b.balance, 0) AS balance
+        FROM items i LEFT JOIN item_balances b ON b.item_id = i.id
+        ORDER BY i.item_code, i.item_name
+    ''', db.reader())
+
+
+def merge_items(db, keep, others):
+    """รวมวัสดุ others เข้ากับ keep: ชื่อเรียกและรายการทั้งหมดย้ายไปที่ keep แล้วลบ others ออกจากทะเบียน คืนจำนวนรายการที่ย้าย"""
+    others = [int(i) for i in others if int(i) != int(keep)]
+    if not others:
+        return 0
+    marks = ', '.join('?' * len(others))
+    with db.write() as conn:
+        if conn.execute("SELECT 1 FROM items WHERE id = ?", (int(keep),)).fetchone() is None:
+            raise ValueError(f"ไม่พบวัสดุ #{keep}")
+        conn.execute(f"UPDATE item_aliases SET item_id = ? WHERE item_id IN ({marks})", [int(keep)] + others)
+        moved = conn.execute(f"UPDATE transactions SET item_id = ? WHERE item_id IN ({marks})", [int(keep)] + others).rowcount
+        conn.execute(f"DELETE FROM items WHERE id IN ({marks})", others)
+        refresh_item_balances(conn, [int(keep)] + others)
+        # Checkpoint รวมยอดเข้าวัสดุที่เหลือ (ยังใช้ได้ทุกเดือน รวมถึงเดือนก่อน cutoff ของ Archive ที่สร้างใหม่ไม่ได้)
+        conn.execute(f'''
+            INSERT INTO balance_checkpoints (month, item_id, qty_in, qty_out)
+            SELECT month, ?, TOTAL(qty_in), TOTAL(qty_out) FROM balance_checkpoints WHERE item_id IN (?, {marks}) GROUP BY month
+            ON CONFLICT (month, item_id) DO UPDATE SET qty_in = excluded.qty_in, qty_out = excluded.qty_out
+        ''', [int(keep), int(keep)] + others)
+        conn.execute(f"DELETE FROM balance_checkpoints WHERE item_id IN ({marks})", others)
+    return moved
@@ -0,0 +1,275 @@
+"""คิวงานนำเข้าเบื้องหลัง: หน้าจอส่งไฟล์เข้าคิว (submit_job) แล้วแสดงผลต่อได้ทันที ไม่ต้องรอจนบันทึกเสร็จ
+
+IngestWorker (Thread ใน Process เดียวกับหน้าเว็บ) ดึงงานจากตาราง ingest_jobs ทีละงาน บันทึกทีละ Chunk ผ่าน
+insert_materials / insert_chemicals แล้วเขียนความคืบหน้า ผลลัพธ์ และแถวที่ผิดพลาดกลับลงตาราง ให้หน้าจอ Poll ด้วย list_jobs
+
+ไฟล์ที่ส่งเข้าคิวถูกเก็บในโฟลเดอร์ spool ข้างไฟล์ .db จนงานจบ รอบอัปโหลดถูกจองไว้ตั้งแต่ส่งงาน งานที่ล้มเหลว/ถูกยกเลิก
+จึงลบรายการที่บันทึกไปแล้วทิ้งได้ทั้งรอบ งานที่ค้างสถานะ running (App ปิดกลางทาง = ไม่มี heartbeat เกิน JOB_STALE_SECONDS)
+ถูกลบรายการของรอบนั้นแล้วเข้าคิวใหม่ตั้งแต่ต้น (ไม่เกิน JOB_MAX_ATTEMPTS ครั้ง) heartbeat มาจาก Thread แยกของงาน ไม่ใช่จากลูปบันทึก
+งานที่ยังทำอยู่ (แม้อยู่อีก Process หรือติดอยู่ใน Chunk ที่ใช้เวลานาน) จึงไม่ถูกนับว่าค้าง
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .ingest import (CHEM_COLUMNS, CHUNK_ROWS, MATERIAL_COLUMNS, IngestError, insert_chemicals, insert_materials,
+                     read_file_chunks, record_batch, upload_stamp)
+from .queries import clear_batch, read_sql
+
+# ชนิดงาน -> ตารางที่บันทึก (ชื่อเดียวกับคำสั่ง import ของ CLI)
+JOB_TABLES = {'material': 'transactions', 'chemical': 'chemical_transactions'}
+# Worker ว่างงานจะตรวจคิวทุกกี่วินาที (ส่งงานผ่าน IngestWorker.submit จะปลุกทันที)
+JOB_POLL_SECONDS = 1.0
+# งาน running ที่ไม่มี heartbeat นานเท่านี้ถือว่า Process ที่ทำอยู่ตายไปแล้ว
+JOB_STALE_SECONDS = 60
+# Thread heartbeat ของงานที่กำลังทำเขียนเวลาล่าสุดทุกกี่วินาที (น้อยกว่า JOB_STALE_SECONDS หลายเท่า เผื่อรอ Lock)
+JOB_HEARTBEAT_SECONDS = 10
+JOB_MAX_ATTEMPTS = 3
+# จำนวนแถวที่ผิดพลาดที่เก็บต่องาน (ไฟล์ที่ผิดทั้งไฟล์ไม่ทำให้ ingest_jobs ใหญ่เกินไป)
+JOB_MAX_ERRORS = 1000
+JOB_COLUMNS = ['id', 'kind', 'action_type', 'sheet', 'batch_id', 'status', 'total_rows', 'done_rows', 'inserted',
+               'attempts', 'error', 'report', 'created_at', 'finished_at']
+
+
+class JobCancelled(Exception):
+    """ผู้ใช้กดยกเลิกระหว่างที่ Worker กำลังบันทึก (ตรวจหลังแต่ละ Chunk)"""
+
+
+def spool_root(db):
+    """โฟลเดอร์เก็บไฟล์ที่รออยู่ในคิวของฐานข้อมูลนี้ (ข้างไฟล์ .db)"""
+    base = os.path.dirname(os.path.abspath(db.path))
+    return os.path.join(base, 'spool', os.path.splitext(os.path.basename(db.path))[0])
+
+
+def spool_file(db, data, digest, ext='xlsx'):
+    """เขียนเนื้อไฟล์ลง spool คืน path (ชื่อไฟล์ = hash หลาย Sheet ของไฟล์เดียวกันใช้ไฟล์เดียว)"""
+    root = spool_root(db)
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{digest}.{ext}")
+    if not os.path.exists(path):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
+
+
+def submit_job(db, kind, action_type, path, sheet=None, total=None, upload_time=None, upload=None, user=None):
+    """ส่งไฟล์ (ที่อยู่ใน spool แล้ว) เข้าคิว จองรอบอัปโหลดไว้ในคราวเดียวกัน คืนเลขงาน
+
+    upload = (hash, sheet) บันทึกกับรอบทันที ไฟล์ที่รออยู่ในคิวจึงถูกจับว่าเคยนำเข้าแล้วเหมือนไฟล์ที่บันทึกเสร็จ
+    """
+    table = JOB_TABLES[kind]
+    with db.write() as conn:
+        batch_id = record_batch(conn, None, table, action_type, upload_time or upload_stamp(), 0, upload, user)
+        return conn.execute('''
+            INSERT INTO ingest_jobs (kind, action_type, path, sheet, batch_id, total_rows, created_at, heartbeat)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (kind, action_type, path, sheet, batch_id, total, upload_stamp(), time.time())).lastrowid
+
+
+def report_json(report):
+    """รายงานของ insert_materials / insert_chemicals -> JSON (แถวที่ผิดพลาดเก็บไม่เกิน JOB_MAX_ERRORS แถว)"""
+    if not report:
+        return None
+    invalid = report['invalid']
+    unknown = report.get('unknown')
+    return json.dumps({'unknown': [] if unknown is None else unknown.to_dict('records'),
+                       'invalid': invalid.head(JOB_MAX_ERRORS).to_dict('records'), 'invalid_rows': len(invalid)},
+                      ensure_ascii=False, default=str)
+
+
+def read_report(text):
+    """report ของงาน -> {'unknown': DataFrame, 'invalid': DataFrame, 'invalid_rows': จำนวนแถวที่ผิดทั้งหมด}"""
+    import pandas as pd
+
+    data = json.loads(text) if isinstance(text, str) and text else {}
+    return {'unknown': pd.DataFrame(data.get('unknown', []), columns=['r_code', 'rows']),
+            'invalid': pd.DataFrame(data.get('invalid', []), columns=['row', 'reason']),
+            'invalid_rows': data.get('invalid_rows', 0)}
+
+
+def close_job(conn, job_id, status, inserted=0, error=None, report=None):
+    """จบงานใน Transaction ที่เปิดอยู่: ไม่สำเร็จ = ลบรายการของรอบทิ้งทั้งหมด, ไม่มีรายการเลย = ลบตัวรอบด้วย คืน path ของไฟล์"""
+    kind, batch_id, path = conn.execute("SELECT kind, batch_id, path FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+    if status != 'done':
+        clear_batch(conn, JOB_TABLES[kind], batch_id)
+        inserted = 0
+    if not inserted:
+        conn.execute("DELETE FROM upload_batches WHERE id = ?", (batch_id,))
+    conn.execute('''
+        UPDATE ingest_jobs SET status = ?, inserted = ?, error = ?, report = ?, finished_at = ?, heartbeat = ? WHERE id = ?
+    ''', (status, inserted, error, report, upload_stamp(), time.time(), job_id))
+    return path
+
+
+def drop_spool(db, path):
+    """ลบไฟล์ใน spool เมื่อไม่มีงานที่ยังค้างใช้ไฟล์นี้ (เช่น Sheet อื่นของไฟล์เดียวกัน)"""
+    if path and not db.reader().execute(
+            "SELECT 1 FROM ingest_jobs WHERE path = ? AND status IN ('queued', 'running') LIMIT 1", (path,)).fetchone():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cancel_job(db, job_id):
+    """ยกเลิกงาน: งานที่ยังรอคิวจบทันที, งานที่กำลังบันทึกจะหยุดและลบรายการทิ้งหลัง Chunk ปัจจุบัน คืนสถานะก่อนยกเลิก"""
+    with db.write() as conn:
+        row = conn.execute("SELECT status FROM ingest_jobs WHERE id = ?", (int(job_id),)).fetchone()
+        if row is None:
+            raise ValueError(f"ไม่พบงานนำเข้า #{job_id}")
+        path = None
+        if row[0] == 'queued':
+            path = close_job(conn, int(job_id), 'cancelled')
+        elif row[0] == 'running':
+            conn.execute("UPDATE ingest_jobs SET cancel = 1 WHERE id = ?", (int(job_id),))
+    drop_spool(db, path)
+    return row[0]
+
+
+def recover_jobs(db, stale=JOB_STALE_SECONDS):
+    """งาน running ที่ไม่มี heartbeat เกิน stale วินาที: ลบรายการที่บันทึกไปบางส่วน แล้วเข้าคิวใหม่ (หรือจบเป็น failed
+    เมื่อครบ JOB_MAX_ATTEMPTS) คืนจำนวนงานที่จัดการ"""
+    cutoff = time.time() - stale
+    # ตรวจด้วย Connection อ่านก่อน: Worker เรียกทุกครั้งที่ว่าง ไม่ต้องเปิด Transaction เขียนถ้าไม่มีงานค้าง
+    if not db.reader().execute("SELECT 1 FROM ingest_jobs WHERE status = 'running' AND heartbeat < ? LIMIT 1", (cutoff,)).fetchone():
+        return 0
+    paths = []
+    with db.write() as conn:
+        stuck = conn.execute("SELECT id, kind, batch_id, attempts FROM ingest_jobs WHERE status = 'running' AND heartbeat < ?",
+                             (cutoff,)).fetchall()
+        for job_id, kind, batch_id, attempts in stuck:
+            if attempts >= JOB_MAX_ATTEMPTS:
+                paths.append(close_job(conn, job_id, 'failed', error=f"หยุดกลางทาง {attempts} ครั้ง (App ปิดระหว่างบันทึก)"))
+                continue
+            clear_batch(conn, JOB_TABLES[kind], batch_id)
+            conn.execute("UPDATE ingest_jobs SET status = 'queued', done_rows = 0, heartbeat = ? WHERE id = ?", (time.time(), job_id))
+    for path in paths:
+        drop_spool(db, path)
+    return len(stuck)
+
+
+def claim_next(db):
+    """เปลี่ยนงานที่รอนานที่สุดเป็น running คืน (id, kind, action_type, path, sheet, batch_id, upload_time) หรือ None"""
+    if not db.reader().execute("SELECT 1 FROM ingest_jobs WHERE status = 'queued' LIMIT 1").fetchone():
+        return None
+    with db.write() as conn:
+        row = conn.execute('''
+            UPDATE ingest_jobs SET status = 'running', attempts = attempts + 1, heartbeat = ?
+            WHERE id = (SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+            RETURNING id, kind, action_type, path, sheet, batch_id
+        ''', (time.time(),)).fetchone()
+        if row is None:
+            return None
+        upload_time = conn.execute("SELECT upload_time FROM upload_batches WHERE id = ?", (row[5],)).fetchone()
+    return row + (upload_time[0] if upload_time else None,)
+
+
+def heartbeat(db, job_id, stop, every=JOB_HEARTBEAT_SECONDS):
+    """เขียน heartbeat ของงานทุก every วินาทีจนกว่า stop ถูก set (รันใน Thread แยกจากลูปบันทึก)"""
+    while not stop.wait(every):
+        try:
+            with db.write() as conn:
+                conn.execute("UPDATE ingest_jobs SET heartbeat = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+        except sqlite3.OperationalError:
+            pass  # ฐานข้อมูลถูกล็อกนานเกิน retry: เขียนใหม่รอบถัดไป
+
+
+def run_job(db, job, size=CHUNK_ROWS):
+    """บันทึกงานที่ claim_next คืนมาจนจบ (สำเร็จ / ล้มเหลว / ถูกยกเลิก) แล้วบันทึกผลลงตาราง คืนสถานะสุดท้าย"""
+    job_id, kind, action_type, path, sheet, batch_id, upload_time = job
+
+    def progress(done):
+        with db.write() as conn:
+            cancel = conn.execute("UPDATE ingest_jobs SET done_rows = ?, heartbeat = ? WHERE id = ? RETURNING cancel",
+                                  (done, time.time(), job_id)).fetchone()[0]
+        if cancel:
+            raise JobCancelled("ยกเลิกโดยผู้ใช้")
+
+    status, inserted, error, report = 'done', 0, None, None
+    stop = threading.Event()
+    threading.Thread(target=heartbeat, args=(db, job_id, stop, JOB_HEARTBEAT_SECONDS), name=f"ingest-heartbeat-{job_id}", daemon=True).start()
+    try:
+        if kind == 'material':
+            cmap, columns = MATERIAL_COLUMNS[action_type]
+            report = insert_materials(db, read_file_chunks(path, cmap, columns, size, sheet), action_type, upload_time,
+                                      on_progress=progress, batch_id=batch_id)
+        else:
+            report = insert_chemicals(db, read_file_chunks(path, CHEM_COLUMNS[action_type], None, size, sheet), action_type,
+                                      upload_time, on_progress=progress, batch_id=batch_id)
+        inserted = report['inserted']
+    except Exception as e:
+        cause = e.__cause__ if isinstance(e, IngestError) and e.__cause__ is not None else e
+        status = 'cancelled' if isinstance(cause, JobCancelled) else 'failed'
+        error = None if status == 'cancelled' else f"{type(cause).__name__}: {cause}"
+        report = getattr(e, 'report', None)
+    try:
+        with db.write() as conn:
+            path = close_job(conn, job_id, status, inserted, error, report_json(report))
+    finally:
+        stop.set()
+    drop_spool(db, path)
+    return status
+
+
+def list_jobs(db, limit=20):
+    """งานล่าสุด limit งาน (ใหม่ก่อน) สำหรับหน้าจอ Poll สถานะ/ความคืบหน้า"""
+    return read_sql(db, f"SELECT {', '.join(JOB_COLUMNS)} FROM ingest_jobs ORDER BY id DESC LIMIT ?", [int(limit)])
+
+
+def active_jobs(db):
+    """จำนวนงานที่ยังรอคิวหรือกำลังบันทึก"""
+    return db.reader().execute("SELECT COUNT(*) FROM ingest_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+
+class IngestWorker:
+    """Thread เบื้องหลัง 1 ตัวต่อฐานข้อมูลต่อ Process ทำงานในคิวทีละงานตามลำดับที่ส่ง (หน้าเว็บสร้างผ่าน st.cache_resource)"""
+
+    def __init__(self, db, poll=JOB_POLL_SECONDS, stale=JOB_STALE_SECONDS):
+        self.db = db
+        self.poll = poll
+        self.stale = stale
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            name = f"ingest-{os.path.basename(self.db.path)}"
+            self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """หยุดหลังงานปัจจุบันจบ (งานที่เหลือยังอยู่ในคิว)"""
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def submit(self, kind, action_type, path, sheet=None, total=None, upload_time=None, upload=None, user=None):
+        job_id = submit_job(self.db, kind, action_type, path, sheet, total, upload_time, upload, user)
+        self.wake.set()
+        return job_id
+
+    def run_once(self):
+        """ทำงานถัดไปในคิว 1 งาน คืนสถานะสุดท้าย หรือ None ถ้าไม่มีงาน"""
+        recover_jobs(self.db, self.stale)
+        job = claim_next(self.db)
+        return None if job is None else run_job(self.db, job)
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                if self.run_once() is not None:
+                    continue
+            except Exception:
+                # ฐานข้อมูลถูกล็อกนานเกิน retry ฯลฯ: ลองใหม่รอบถัดไป (งานที่ค้างจะถูก recover_jobs จัดการ)
+                logging.getLogger(__name__).exception("ingest worker")
+            self.wake.wait(self.poll)
+            self.wake.clear()
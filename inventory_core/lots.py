@@ -0,0 +1,52 @@
+"""ล็อตของรายการรับเข้าที่มีวันหมดอายุ (ตาราง item_lots) ตัดจ่ายแบบ FIFO สำหรับแจ้งเตือนของหมดอายุ / ใกล้หมดอายุ
+
+FIFO: รายการเบิกทั้งหมดของวัสดุตัดจากรายการรับเข้าตามลำดับ (date, id) ล็อตที่ k จึงเหลือ
+    MIN(จำนวนรับ, MAX(0, ยอดรับสะสมถึงล็อต k - ยอดเบิกรวม))
+รายการรับที่ไม่มีวันหมดอายุถูกตัดตามลำดับเหมือนกัน แต่ไม่เก็บเป็นล็อต
+Index บางส่วน (remaining > 0) เรียงตามวันหมดอายุ ทำให้แจ้งเตือนเป็นการค้นช่วงวันที่ครั้งเดียว ไม่ต้องอ่านล็อตที่ใช้หมดแล้ว
+"""
+from .profiling import read_frame, timed
+
+# ยอดคงเหลือแบบ FIFO ของรายการรับเข้า t เมื่อ o.qty_out = ยอดเบิกรวมของวัสดุ
+FIFO_REMAINING = "MIN(t.quantity, MAX(0, SUM(t.quantity) OVER (PARTITION BY t.item_id ORDER BY t.date, t.id) - o.qty_out))"
+
+
+def refresh_item_lots(conn, ids=None):
+    """คำนวณล็อตใหม่เฉพาะวัสดุ (item_id) ที่ระบุ (ids=None คือทั้งตาราง) จากยอดเบิกรวมใน item_balances ภายใน Transaction ของผู้เรียก"""
+    if ids is None:
+        conn.execute("DELETE FROM item_lots")
+        scope = ""
+    else:
+        ids = {int(i) for i in ids if i is not None}
+        if not ids:
+            return
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS dirty_lots (item_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.dirty_lots")
+        conn.executemany("INSERT INTO temp.dirty_lots VALUES (?)", [(i,) for i in ids])
+        conn.execute("DELETE FROM item_lots WHERE item_id IN (SELECT item_id FROM temp.dirty_lots)")
+        scope = "AND t.item_id IN (SELECT item_id FROM temp.dirty_lots)"
+    conn.execute(f'''
+        INSERT INTO item_lots (receipt_id, item_id, expiry_date, quantity, remaining)
+        SELECT id, item_id, expiry_date, quantity, remaining FROM (
+            SELECT t.id, t.item_id, t.expiry_date, t.quantity, {FIFO_REMAINING} AS remaining
+            FROM transactions t JOIN item_balances o ON o.item_id = t.item_id
+            WHERE t.action_type = 'In' {scope}
+        ) WHERE expiry_date != ''
+    ''')
+
+
+@timed('load')
+def expiring_lots(db, start=None, end=None):
+    """ล็อตที่ยังเหลือของและหมดอายุในช่วง start..end (YYYY-MM-DD รวมทั้งสองวัน, start=None คือตั้งแต่ล็อตแรก) เรียงตามวันหมดอายุ"""
+    clauses, params = ["l.remaining > 0"], []
+    if start is not None:
+        clauses.append("l.expiry_date >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("l.expiry_date <= ?")
+        params.append(end)
+    return read_frame(db.reader(), f'''
+        SELECT l.expiry_date, i.item_code, i.item_name, l.remaining AS "Balance", i.unit, l.receipt_id
+        FROM item_lots l JOIN items i ON i.id = l.item_id
+        WHERE {' AND '.join(clauses)} ORDER BY l.expiry_date, i.item_code
+    ''', params)
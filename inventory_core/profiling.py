@@ -0,0 +1,174 @@
+"""จับเวลาแต่ละขั้นตอนของ 1 Rerun (โหลดข้อมูล, SQL, คำนวณ, อ่าน Excel, แสดงผล) และบันทึกงานที่ช้าเกินเกณฑ์ลง Log แบบหมุนไฟล์
+
+หน้าจอสร้าง Profiler ต่อ Rerun แล้ว activate() ไว้กับ Thread ของ Script; ฟังก์ชันใน inventory_core
+ที่ครอบด้วย timed()/profile() จะบันทึกเข้า Profiler นั้นเอง (ไม่มี Profiler ที่ active = ไม่ทำอะไร)
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# งานที่ใช้เวลาตั้งแต่เท่านี้ขึ้นไปถูกเขียนลง Log (มิลลิวินาที)
+SLOW_LOG_MS = 500
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 5
+
+_local = threading.local()
+
+
+def current():
+    """Profiler ของ Rerun ที่กำลังทำงานใน Thread นี้ (None ถ้าไม่ได้เปิด)"""
+    return getattr(_local, 'profiler', None)
+
+
+def slow_log(path, max_bytes=SLOW_LOG_BYTES, backups=SLOW_LOG_BACKUPS):
+    """Logger ที่เขียนลงไฟล์ path หมุนไฟล์เมื่อเกิน max_bytes เก็บย้อนหลัง backups ไฟล์ (เรียกซ้ำได้ ไม่เพิ่ม Handler ซ้ำ)"""
+    logger = logging.getLogger(f"inventory_core.slow.{os.path.abspath(path)}")
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s\t%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class Profiler:
+    """เหตุการณ์ของ 1 Rerun เรียงตามเวลาที่เริ่ม (depth = ซ้อนอยู่ในขั้นตอนไหน) งานที่ช้ากว่า slow_ms ถูกเขียนลง logger"""
+
+    def __init__(self, app, slow_ms=SLOW_LOG_MS, logger=None):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.logger = logger
+        self.events = []
+        self.depth = 0
+        self.started = time.perf_counter()
+
+    def activate(self):
+        _local.profiler = self
+        return self
+
+    def finish(self, label='', error=None):
+        """ปิด Profiler ของ Thread นี้ คืนเวลารวมของ Rerun (วินาที) และ Log ถ้าช้ากว่าเกณฑ์
+
+        error = Exception ที่ทำให้ Rerun ล้มเหลว: Log เสมอไม่ว่าจะใช้เวลาเท่าไร (ชื่อ Exception อยู่ในช่องจำนวนแถว)
+        """
+        if current() is self:
+            _local.profiler = None
+        total = time.perf_counter() - self.started
+        if error is None:
+            self.log('rerun', label, total)
+        elif self.logger is not None:
+            self.logger.info('\t'.join([self.app, 'error', label or '', f"{total * 1000:.0f}ms", f"{type(error).__name__}: {error}"]))
+        return total
+
+    @contextmanager
+    def stage(self, name, kind='stage'):
+        """จับเวลาช่วงโค้ด ผู้เรียกใส่จำนวนแถวได้ทาง info['rows']"""
+        info = {'kind': kind, 'name': name, 'depth': self.depth, 'ms': None, 'rows': None}
+        self.events.append(info)
+        self.depth += 1
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - started
+            self.depth -= 1
+            info['ms'] = seconds * 1000
+            self.log(kind, name, seconds, info['rows'])
+
+    def add(self, kind, name, seconds, rows=None):
+        self.events.append({'kind': kind, 'name': name, 'depth': self.depth, 'ms': seconds * 1000, 'rows': rows})
+        self.log(kind, name, seconds, rows)
+
+    def log(self, kind, name, seconds, rows=None):
+        if self.logger is not None and seconds * 1000 >= self.slow_ms:
+            self.logger.info('\t'.join([self.app, kind, name, f"{seconds * 1000:.0f}ms", '' if rows is None else str(rows)]))
+
+    def table(self):
+        """เหตุการณ์ทั้งหมดเป็น DataFrame (ชื่อย่อหน้าตามความลึก) สำหรับแสดงใน Panel"""
+        import pandas as pd
+
+        rows = [{'ขั้นตอน': ' ' * e['depth'] + ('└ ' if e['depth'] else '') + e['name'], 'ชนิด': e['kind'], 'ms': e['ms'], 'แถว': e['rows']}
+                for e in self.events]
+        return pd.DataFrame(rows, columns=['ขั้นตอน', 'ชนิด', 'ms', 'แถว']).astype({'แถว': 'Int64'})
+
+
+@contextmanager
+def profile(name, kind='stage'):
+    """เหมือน Profiler.stage ของ Profiler ปัจจุบัน (ไม่มี = ไม่จับเวลา แต่ยังได้ info ให้ใส่ rows ได้)"""
+    prof = current()
+    if prof is None:
+        yield {}
+        return
+    with prof.stage(name, kind) as info:
+        yield info
+
+
+def row_count(result):
+    """จำนวนแถวของผลลัพธ์ (DataFrame, tuple ที่ตัวแรกเป็น DataFrame, จำนวนที่บันทึก หรือรายงาน {'inserted': ...})"""
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict) and 'inserted' in result:
+        return result['inserted']
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def timed(kind='stage', name=None):
+    """Decorator: จับเวลาฟังก์ชันเข้า Profiler ปัจจุบัน พร้อมจำนวนแถวของผลลัพธ์"""
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if current() is None:
+                return fn(*args, **kwargs)
+            with profile(label, kind) as info:
+                result = fn(*args, **kwargs)
+                info['rows'] = row_count(result)
+                return result
+        return inner
+    return wrap
+
+
+def timed_iter(chunks, name, kind='read'):
+    """ครอบ Iterable ของ DataFrame: รวมเวลาที่รอ Chunk ถัดไป (เช่นอ่าน/แปลง Excel) เป็นเหตุการณ์เดียว"""
+    prof = current()
+    if prof is None:
+        yield from chunks
+        return
+    it, spent, rows = iter(chunks), 0.0, 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(it)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - started
+            rows += len(chunk)
+            yield chunk
+    finally:
+        prof.add(kind, name, spent, rows)
+
+
+def read_frame(conn, sql, params=None):
+    """pd.read_sql_query ที่จับเวลาและจำนวนแถวเข้า Profiler ปัจจุบัน (ชื่อเหตุการณ์ = SQL บรรทัดแรกแบบย่อ)"""
+    import pandas as pd
+
+    if current() is None:
+        return pd.read_sql_query(sql, conn, params=params)
+    with profile(' '.join(sql.split())[:90], 'sql') as info:
+        df = pd.read_sql_query(sql, conn, params=params)
+        info['rows'] = len(df)
+    return df
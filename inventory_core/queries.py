@@ -0,0 +1,324 @@
+"""อ่านข้อมูล (ช่วงวันที่, ค้นหาแบบแบ่งหน้า) และลบข้อมูลพร้อมอัปเดตยอดคงเหลือ"""
+from datetime import datetime, timedelta
+
+from .archive import REAL_ROWS, archive_cutoff, day_before, iter_archive, read_archive, reaches_archive
+from .balances import IN_OUT_TOTALS, build_checkpoint, build_checkpoints, has_checkpoint, invalidate_checkpoints, refresh_item_balances
+from .chemicals import ledger_starts, refresh_chem_ledger
+from .db import has_table
+from .frames import compact_frame
+from .items import lookup_items
+from .profiling import read_frame, timed
+from .schema import FTS_COLUMNS
+
+# จำนวนแถวต่อหน้าเริ่มต้นของการค้นหา
+PAGE_SIZE = 50
+# คอลัมน์ที่ค้นหาด้วย LIKE ใน chemical_transactions (ไม่มี Full-text index)
+CHEM_SEARCH_COLUMNS = ['chem_code', 'chem_desc', 'department', 'requester']
+
+
+def read_sql(db, sql, params=None):
+    return read_frame(db.reader(), sql, params)
+
+
+@timed('load')
+def read_table(db, table, columns=None):
+    """ประวัติทั้งตาราง เรียงจากล่าสุด แปลงชนิดคอลัมน์แบบประหยัดหน่วยความจำแล้ว (columns = เลือกเฉพาะคอลัมน์ที่หน้าจอใช้)"""
+    cols = ', '.join(columns) if columns else '*'
+    return compact_frame(read_sql(db, f"SELECT {cols} FROM {table} ORDER BY date DESC, id DESC"))
+
+
+def range_where(start=None, end=None, action_type=None, real_only=False):
+    """WHERE ของช่วงวันที่/ประเภทรายการ (real_only = ไม่รวมแถวยอดยกมา ใช้เมื่ออ่านส่วนที่ Archive ไปแล้วจากไฟล์)"""
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("date BETWEEN ? AND ?")
+        params += [start, end]
+    if action_type:
+        clauses.append("action_type = ?")
+        params.append(action_type)
+    if real_only:
+        clauses.append(REAL_ROWS)
+    return (f" WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+@timed('load')
+def load_range(db, table, start=None, end=None, action_type=None):
+    """ดึงเฉพาะรายการในช่วงวันที่ start..end (YYYY-MM-DD) ผ่าน Index แทนการโหลดทั้งตาราง (start=None คือทุกวันที่)
+
+    ช่วงที่ย้อนไปก่อน cutoff ของ Archive จะรวมรายการจากไฟล์ Archive แทนแถวยอดยกมาให้อัตโนมัติ
+    """
+    import pandas as pd
+
+    cutoff = reaches_archive(db.reader(), start)
+    where, params = range_where(start, end, action_type, real_only=cutoff is not None)
+    df = read_sql(db, f"SELECT * FROM {table}{where} ORDER BY date DESC, id DESC", params)
+    if cutoff is None:
+        return df
+    old = read_archive(db, table, start, min(end or cutoff, day_before(cutoff)), action_type)
+    if old.empty:
+        return df
+    return pd.concat([df, old], ignore_index=True).sort_values(['date', 'id'], ascending=False, ignore_index=True)
+
+
+def iter_range(db, table, start=None, end=None, action_type=None, size=5000):
+    """เหมือน load_range แต่คืนทีละ size แถว (ส่วนที่อยู่ใน Archive ก่อน แล้วตามด้วย SQLite เรียงตามวันที่) สำหรับ Export ข้อมูลจำนวนมาก"""
+    import pandas as pd
+
+    cutoff = reaches_archive(db.reader(), start)
+    if cutoff is not None:
+        yield from iter_archive(db, table, start, min(end or cutoff, day_before(cutoff)), action_type, size)
+    where, params = range_where(start, end, action_type, real_only=cutoff is not None)
+    # Connection แยกจาก reader() ของ Thread: Cursor ค้างอยู่ระหว่าง yield ได้โดยไม่ชนกับ Query อื่น
+    conn = db.connect()
+    try:
+        yield from pd.read_sql_query(f"SELECT * FROM {table}{where} ORDER BY date, id", conn, params=params, chunksize=size)
+    finally:
+        conn.close()
+
+
+@timed('load')
+def balances_as_of(db, day, build=False):
+    """ยอดคงเหลือทุกวัสดุ ณ สิ้นวัน day (YYYY-MM-DD) = Checkpoint ต้นเดือน + รายการตั้งแต่ต้นเดือนถึง day (คอลัมน์เดียวกับ read_balances)
+
+    อ่านอย่างเดียว: Checkpoint สร้างฝั่งบันทึก (build_checkpoints) เดือนที่ยังไม่มีรวมต่อจาก Checkpoint ที่ใกล้ที่สุด
+    build=True สร้าง Checkpoint ของเดือนนั้นก่อน (เฉพาะงาน Batch / CLI ที่ยอมรอ Lock ของการเขียนได้)
+    ก่อน cutoff ของ Archive อ่านรายการจากไฟล์ ประเภท/หน่วย/วันหมดอายุเป็นค่าปัจจุบันจาก item_balances
+    """
+    import pandas as pd
+
+    month, conn = day[:8] + '01', db.reader()
+    cutoff = archive_cutoff(conn)
+    if build and not db.read_only and month >= (cutoff or '') and not has_checkpoint(conn, month):
+        with db.write() as w:
+            build_checkpoint(w, month, cutoff)
+    base = conn.execute("SELECT MAX(month) FROM checkpoint_months WHERE month <= ?", (month,)).fetchone()[0]
+    if cutoff is None or (base or '') >= cutoff:
+        totals = read_frame(conn, f'''
+            SELECT item_id, TOTAL(qty_in) AS qty_in, TOTAL(qty_out) AS qty_out FROM (
+                SELECT item_id, qty_in, qty_out FROM balance_checkpoints WHERE month = ?
+                UNION ALL
+                SELECT item_id, {IN_OUT_TOTALS} FROM transactions WHERE date >= ? AND date <= ? GROUP BY item_id
+            ) GROUP BY item_id
+        ''', [base or '', base or '', day])
+    else:
+        # ย้อนไปก่อน cutoff: Checkpoint (ถ้ามี) + รายการจริงจาก Archive/SQLite ตั้งแต่ Checkpoint นั้น
+        # item_id ของรายการหาจากชื่อเรียก (ไฟล์ Archive เก่าไม่มี item_id และวัสดุที่ถูกรวมแล้วชี้ไปวัสดุที่เหลือ)
+        rows = load_range(db, 'transactions', base or '', day)
+        moved = pd.DataFrame({'item_id': lookup_items(conn, rows),
+                              'qty_in': rows['quantity'].where(rows['action_type'] == 'In', 0.0),
+                              'qty_out': rows['quantity'].where(rows['action_type'] == 'Out', 0.0)})
+        start = read_frame(conn, "SELECT item_id, qty_in, qty_out FROM balance_checkpoints WHERE month = ?", [base or ''])
+        totals = pd.concat([start, moved], ignore_index=True).groupby('item_id', as_index=False)[['qty_in', 'qty_out']].sum()
+    current = read_frame(conn, '''
+        SELECT i.id AS item_id, i.item_code, i.item_name, IFNULL(i.category, '-') AS category, IFNULL(i.unit, '') AS unit, b.expiry_date
+        FROM items i LEFT JOIN item_balances b ON b.item_id = i.id
+    ''')
+    df = totals.astype({'item_id': 'int64'}).merge(current, on='item_id', how='left')
+    df = df.assign(Balance=df['qty_in'] - df['qty_out'])
+    df = df.rename(columns={'qty_in': 'In', 'qty_out': 'Out'}).sort_values(['item_code', 'item_name'], ignore_index=True)
+    return df[['item_code', 'item_name', 'category', 'In', 'Out', 'Balance', 'unit', 'expiry_date']]
+
+
+def get_date_range(mode, picked, today=None):
+    """แปลงโหมดรายงาน (วัน/สัปดาห์/เดือน/กำหนดเอง) เป็นช่วงวันที่ (start, end)"""
+    if mode == "รายสัปดาห์":
+        start = picked - timedelta(days=picked.weekday())
+        end = start + timedelta(days=6)
+    elif mode == "รายเดือน":
+        start = picked.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    elif mode == "กำหนดเอง":
+        start, end = (picked[0], picked[-1]) if picked else (today or datetime.now().date(),) * 2
+    else:
+        start = end = picked
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def like_filter(columns, txt):
+    """เงื่อนไข LIKE '%txt%' บนหลายคอลัมน์ (escape % และ _ ในคำค้น) คืน (cond, params)"""
+    like = '%' + txt.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return '(' + ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ')', [like] * len(columns)
+
+
+def search_filter(conn, txt):
+    """เงื่อนไขค้นหา transactions: ใช้ FTS5 (trigram ต้องยาว >= 3 ตัวอักษร) ไม่งั้นใช้ LIKE คืน (cond, params, ranked)"""
+    if len(txt) >= 3 and has_table(conn, 'transactions_fts'):
+        return "id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)", ['"' + txt.replace('"', '""') + '"'], True
+    return like_filter(FTS_COLUMNS, txt) + (False,)
+
+
+@timed('search')
+def search_transactions(db, txt, page=1, page_size=PAGE_SIZE):
+    """ค้นหาประวัติแบบแบ่งหน้า เรียงตามความใกล้เคียง คืน (DataFrame, จำนวนทั้งหมด, ยอดรับ, ยอดจ่าย)"""
+    conn = db.reader()
+    cond, params, ranked = search_filter(conn, txt)
+    total, in_sum, out_sum = conn.execute(f'''
+        SELECT COUNT(*), TOTAL(CASE WHEN action_type = 'In' THEN quantity END), TOTAL(CASE WHEN action_type = 'Out' THEN quantity END)
+        FROM transactions WHERE {cond}
+    ''', params).fetchone()
+    offset = (page - 1) * page_size
+    if ranked:
+        res = read_frame(conn, '''
+            SELECT t.* FROM (SELECT rowid, rank FROM transactions_fts WHERE transactions_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?) f
+            JOIN transactions t ON t.id = f.rowid ORDER BY f.rank
+        ''', params + [page_size, offset])
+    else:
+        res = read_frame(conn, f"SELECT * FROM transactions WHERE {cond} ORDER BY date DESC, id DESC LIMIT ? OFFSET ?", params + [page_size, offset])
+    return res, total, in_sum, out_sum
+
+
+@timed('search')
+def search_balances(db, txt, page=1, page_size=PAGE_SIZE):
+    """ค้นหาวัสดุจากประวัติ แล้วคืนยอดคงเหลือของวัสดุที่พบ (แบ่งหน้า) คืน (DataFrame, จำนวนทั้งหมด)"""
+    conn = db.reader()
+    cond, params, _ = search_filter(conn, txt)
+    matched = f'''
+        FROM (SELECT DISTINCT item_id FROM transactions WHERE {cond}) m
+        JOIN item_balances b ON b.item_id = m.item_id
+    '''
+    total = conn.execute(f"SELECT COUNT(*) {matched}", params).fetchone()[0]
+    res = read_frame(conn, f'''
+        SELECT b.item_code, b.item_name, b.category, b.qty_in AS "In", b.qty_out AS "Out", b.balance AS "Balance", b.unit, b.expiry_date
+        {matched} ORDER BY b.item_code, b.item_name LIMIT ? OFFSET ?
+    ''', params + [page_size, (page - 1) * page_size])
+    return res, total
+
+
+def grid_filter(conn, table, txt='', start=None, end=None, action_type=None, batch_id=None):
+    """เงื่อนไขของตารางแบบแบ่งหน้า (คำค้น + ช่วงวันที่ + ประเภทรายการ + รอบอัปโหลด) คืน (clauses, params)"""
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("date BETWEEN ? AND ?")
+        params += [start, end]
+    if action_type:
+        clauses.append("action_type = ?")
+        params.append(action_type)
+    if batch_id is not None:
+        clauses.append("batch_id = ?")
+        params.append(int(batch_id))
+    if txt:
+        cond, p = search_filter(conn, txt)[:2] if table == 'transactions' else like_filter(CHEM_SEARCH_COLUMNS, txt)
+        clauses.append(cond)
+        params += p
+    return clauses, params
+
+
+@timed('load')
+def read_page(db, table, columns=None, filters=None, cursor=None, page_size=PAGE_SIZE):
+    """1 หน้าของตาราง เรียงจากล่าสุด (date DESC, id DESC) แบบ Keyset คืน (DataFrame, cursor ของหน้าถัดไป หรือ None ถ้าหมดแล้ว)
+
+    cursor = (date, id) ของแถวสุดท้ายของหน้าก่อน (None = หน้าแรก) อ่านต่อจากจุดนั้นผ่าน Index (date, id)
+    ไม่ต้องนับข้าม OFFSET แถว หน้าลึกแค่ไหนก็เร็วเท่าหน้าแรก และแถวที่เพิ่ม/ลบระหว่างเปิดดูไม่ทำให้หน้าเลื่อน
+    """
+    import pandas as pd
+
+    conn = db.reader()
+    clauses, params = grid_filter(conn, table, **(filters or {}))
+    cols = ', '.join(dict.fromkeys(['id', 'date'] + list(columns))) if columns else '*'
+
+    def fetch(cond, p, limit):
+        where = ' AND '.join(clauses + [cond] if cond else clauses)
+        return read_frame(conn, f"SELECT {cols} FROM {table}{' WHERE ' + where if where else ''} ORDER BY date DESC, id DESC LIMIT ?",
+                          params + p + [limit])
+
+    # แถวที่ไม่มีวันที่อยู่ท้ายสุด: (date, id) < (?, ?) ไม่รวม NULL จึงต่อด้วยส่วนที่ date IS NULL เมื่อแถวที่มีวันที่หมดแล้ว
+    if cursor is None:
+        df = fetch(None, [], page_size + 1)
+    elif cursor[0] is None:
+        df = fetch("date IS NULL AND id < ?", [cursor[1]], page_size + 1)
+    else:
+        df = fetch("(date, id) < (?, ?)", list(cursor), page_size + 1)
+        if len(df) <= page_size:
+            df = pd.concat([df, fetch("date IS NULL", [], page_size + 1 - len(df))], ignore_index=True)
+    if len(df) <= page_size:
+        return compact_frame(df), None
+    df = df.iloc[:page_size]
+    last_date = df['date'].iloc[-1]
+    return compact_frame(df), (None if pd.isna(last_date) else last_date, int(df['id'].iloc[-1]))
+
+
+def count_matching(db, table, filters=None):
+    """จำนวนแถวที่ตรงกับตัวกรองของตารางแบบแบ่งหน้า"""
+    conn = db.reader()
+    clauses, params = grid_filter(conn, table, **(filters or {}))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+
+
+def list_batches(db):
+    """รอบอัปโหลดทั้งหมด ล่าสุดก่อน (ใช้เลือกรอบที่จะลบ โดยไม่ต้องโหลดประวัติทั้งตาราง)"""
+    return read_sql(db, "SELECT id, upload_time, tbl, action_type, rows, sheet, uploaded_by FROM upload_batches ORDER BY id DESC")
+
+
+def clear_batch(conn, table, batch_id):
+    """ลบทุกรายการของรอบใน Transaction ที่เปิดอยู่ แล้วคำนวณยอดคงเหลือ/Ledger ใหม่เฉพาะส่วนที่กระทบ (ไม่ลบตัวรอบ)"""
+    if table == 'transactions':
+        ids = [i for (i,) in conn.execute("SELECT DISTINCT item_id FROM transactions WHERE batch_id = ?", (batch_id,))]
+        since = conn.execute("SELECT MIN(date) FROM transactions WHERE batch_id = ?", (batch_id,)).fetchone()[0]
+        conn.execute("DELETE FROM transactions WHERE batch_id = ?", (batch_id,))
+        refresh_item_balances(conn, ids)
+        invalidate_checkpoints(conn, since)
+        build_checkpoints(conn)
+    else:
+        starts = ledger_starts(conn, "batch_id = ?", (batch_id,))
+        conn.execute("DELETE FROM chemical_transactions WHERE batch_id = ?", (batch_id,))
+        refresh_chem_ledger(conn, starts)
+    conn.execute("UPDATE upload_batches SET rows = 0 WHERE id = ?", (batch_id,))
+
+
+def delete_batch(db, batch_id):
+    """ลบข้อมูลทั้งรอบอัปโหลด (Undo) ผ่าน Index ของ batch_id แล้วคำนวณยอดคงเหลือ/Ledger ใหม่เฉพาะส่วนที่กระทบ"""
+    batch_id = int(batch_id)
+    with db.write() as conn:
+        row = conn.execute("SELECT tbl, rows FROM upload_batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"ไม่พบรอบอัปโหลด #{batch_id}")
+        table, rows = row
+        # รอบของงานที่ยังอยู่ในคิว ให้ยกเลิกที่งาน (Worker ลบรายการที่บันทึกไปแล้วให้เอง)
+        job = conn.execute("SELECT id FROM ingest_jobs WHERE batch_id = ? AND status IN ('queued', 'running')", (batch_id,)).fetchone()
+        if job is not None:
+            raise ValueError(f"รอบอัปโหลด #{batch_id} ยังนำเข้าอยู่ (งาน #{job[0]}) ยกเลิกงานก่อน")
+        # จำนวนที่เหลือน้อยกว่าที่บันทึกไว้ = บางรายการถูกย้ายไป Archive แล้ว (ลบรายรายการจะลด rows ให้ตรงอยู่เสมอ)
+        if conn.execute(f"SELECT COUNT(*) FROM {table} WHERE batch_id = ?", (batch_id,)).fetchone()[0] < rows:
+            raise ValueError(f"รอบอัปโหลด #{batch_id} มีรายการที่ถูกย้ายไป Archive แล้ว ลบทั้งรอบไม่ได้")
+        clear_batch(conn, table, batch_id)
+        conn.execute("DELETE FROM upload_batches WHERE id = ?", (batch_id,))
+
+
+def delete_where(conn, table, cond, params):
+    """ลบรายการที่ตรงกับ cond ใน Transaction ที่เปิดอยู่ พร้อมอัปเดตรอบอัปโหลด/ยอดคงเหลือ/Ledger ที่กระทบ คืนจำนวนที่ลบ"""
+    if table not in ('transactions', 'chemical_transactions'):
+        raise ValueError(f"unknown table: {table}")
+    ids = [i for (i,) in conn.execute(f"SELECT DISTINCT item_id FROM transactions WHERE {cond}", params)] if table == 'transactions' else []
+    since = conn.execute(f"SELECT MIN(date) FROM transactions WHERE {cond}", params).fetchone()[0] if table == 'transactions' else None
+    starts = ledger_starts(conn, cond, params) if table == 'chemical_transactions' else {}
+    # จำนวนแถวของรอบอัปโหลดลดตามรายการที่ลบ
+    conn.execute(f'''
+        UPDATE upload_batches SET rows = rows - d.n
+        FROM (SELECT batch_id, COUNT(*) AS n FROM {table} WHERE {cond} GROUP BY batch_id) d WHERE upload_batches.id = d.batch_id
+    ''', params)
+    deleted = conn.execute(f"DELETE FROM {table} WHERE {cond}", params).rowcount
+    refresh_item_balances(conn, ids)
+    invalidate_checkpoints(conn, since)
+    if since is not None:
+        build_checkpoints(conn)
+    refresh_chem_ledger(conn, starts)
+    return deleted
+
+
+def delete_data(db, ids, table='transactions'):
+    """ลบรายการตาม ID จาก transactions หรือ chemical_transactions"""
+    if not ids:
+        return
+    ids = [int(i) for i in ids]
+    with db.write() as conn:
+        delete_where(conn, table, f"id IN ({', '.join('?' * len(ids))})", ids)
+
+
+def delete_matching(db, table, filters):
+    """ลบทุกรายการที่ตรงกับตัวกรองของตารางแบบแบ่งหน้า (ไม่ต้องส่ง ID ทีละแถว) คืนจำนวนที่ลบ ต้องมีตัวกรองอย่างน้อย 1 อย่าง"""
+    with db.write() as conn:
+        clauses, params = grid_filter(conn, table, **filters)
+        if not clauses:
+            raise ValueError("ต้องกำหนดตัวกรองก่อนลบทั้งหมดที่ตรงกัน")
+        return delete_where(conn, table, ' AND '.join(clauses), params)
@@ -0,0 +1,273 @@
+"""โครงสร้างตาราง, Index, Full-text search และตัวนับ version ของตาราง"""
+import sqlite3
+
+from .balances import refresh_item_balances
+from .chemicals import refresh_chem_ledger
+from .db import has_table
+from .items import backfill_item_ids
+from .lots import refresh_item_lots
+
+# คอลัมน์ที่ใช้ค้นหา (Full-text search)
+FTS_COLUMNS = ['item_code', 'item_name', 'category', 'department', 'requester', 'remark']
+
+
+def fts_update_trigger():
+    """Trigger แก้ FTS เฉพาะเมื่อคอลัมน์ที่ค้นหาเปลี่ยน (UPDATE คอลัมน์อื่น เช่น batch_id ไม่ต้องเขียน Index ใหม่)"""
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join('new.' + x for x in FTS_COLUMNS)
+    old_cols = ', '.join('old.' + x for x in FTS_COLUMNS)
+    return (f"CREATE TRIGGER transactions_fts_au AFTER UPDATE OF {cols} ON transactions BEGIN "
+            f"INSERT INTO transactions_fts(transactions_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO transactions_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END")
+
+
+def migrate_batches(conn, table):
+    """DB เดิม: เพิ่ม batch_id แล้วสร้างรอบอัปโหลดจาก upload_time เดิม (1 รอบต่อ upload_time + ประเภทรายการ, ไม่รวมแถวยอดยกมา)"""
+    from .archive import REAL_ROWS
+
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN batch_id INTEGER REFERENCES upload_batches(id)")
+    if table == 'transactions' and has_table(conn, 'transactions_fts'):
+        conn.execute("DROP TRIGGER IF EXISTS transactions_fts_au")
+        conn.execute(fts_update_trigger())
+    conn.execute(f'''
+        INSERT INTO upload_batches (tbl, action_type, upload_time, rows)
+        SELECT ?, action_type, upload_time, COUNT(*) FROM {table} WHERE {REAL_ROWS}
+        GROUP BY upload_time, action_type ORDER BY upload_time
+    ''', (table,))
+    conn.execute(f'''
+        UPDATE {table} SET batch_id = b.id FROM upload_batches b
+        WHERE b.tbl = ? AND b.upload_time IS {table}.upload_time AND b.action_type IS {table}.action_type
+    ''', (table,))
+
+
+def migrate_uploaded_files(conn, chemicals):
+    """ย้าย Hash ของไฟล์จากตาราง uploaded_files เดิมเข้า upload_batches แล้วลบตารางเดิม
+
+    รอบเดิมที่นำเข้าหลายไฟล์ (CLI) ได้ Hash ของไฟล์แรก ไฟล์ที่เหลือถูกเก็บเป็นรอบ 0 แถว (ไม่มีรายการอ้างถึง แต่ยังตรวจไฟล์ซ้ำได้)
+    """
+    rows = conn.execute("SELECT file_hash, sheet, action_type, upload_time FROM uploaded_files ORDER BY upload_time").fetchall()
+    for file_hash, sheet, action_type, upload_time in rows:
+        table = 'chemical_transactions' if chemicals and sheet == 'Chemical Tank' else 'transactions'
+        matched = conn.execute('''
+            UPDATE upload_batches SET file_hash = ?, sheet = ?
+            WHERE id = (SELECT id FROM upload_batches WHERE tbl = ? AND action_type = ? AND upload_time = ? AND file_hash IS NULL LIMIT 1)
+        ''', (file_hash, sheet, table, action_type, upload_time)).rowcount
+        if not matched:
+            conn.execute("INSERT INTO upload_batches (tbl, action_type, upload_time, file_hash, sheet, rows) VALUES (?, ?, ?, ?, ?, 0)",
+                         (table, action_type, upload_time, file_hash, sheet))
+    conn.execute("DROP TABLE uploaded_files")
+
+
+def init_db(db, chemicals=True):
+    """สร้างตารางทั้งหมดถ้ายังไม่มี (chemicals=False สำหรับฐานข้อมูลที่มีเฉพาะวัสดุทั่วไป)"""
+    with db.write() as conn:
+        c = conn.cursor()
+        # ตารางวัสดุทั่วไป
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT,
+                item_code TEXT,
+                item_name TEXT,
+                action_type TEXT,
+                quantity REAL,
+                unit TEXT,
+                category TEXT,
+                expiry_date TEXT,
+                department TEXT,
+                requester TEXT,
+                remark TEXT,
+                upload_time TEXT,
+                batch_id INTEGER REFERENCES upload_batches(id),
+                item_id INTEGER REFERENCES items(id)
+            )
+        ''')
+        tables = ['transactions']
+        if chemicals:
+            # ตารางสารเคมี
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS chemical_transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT,
+                    chem_code TEXT,
+                    chem_desc TEXT,
+                    action_type TEXT,
+                    qty_kg REAL,
+                    qty_l REAL,
+                    density REAL,
+                    department TEXT,
+                    requester TEXT,
+                    upload_time TEXT,
+                    bal_kg REAL,
+                    bal_l REAL,
+                    batch_id INTEGER REFERENCES upload_batches(id)
+                )
+            ''')
+            # DB เดิม: เพิ่มคอลัมน์ยอดสะสม (Running balance) ของแต่ละถัง แล้วคำนวณย้อนหลังครั้งเดียว
+            chem_cols = [r[1] for r in c.execute("PRAGMA table_info(chemical_transactions)")]
+            if 'bal_kg' not in chem_cols:
+                c.execute("ALTER TABLE chemical_transactions ADD COLUMN bal_kg REAL")
+                c.execute("ALTER TABLE chemical_transactions ADD COLUMN bal_l REAL")
+                refresh_chem_ledger(conn)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chem_ledger ON chemical_transactions(chem_code, date, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chem_date ON chemical_transactions(date, action_type)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chem_page ON chemical_transactions(date, id)")
+            tables.append('chemical_transactions')
+        # ทะเบียนวัสดุ (items.py): รหัสตัวเลขต่อวัสดุ + ชื่อเรียกทุกแบบที่เคยพบ (code_key / name_key ที่ปรับรูปแบบแล้ว)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                item_code TEXT,
+                item_name TEXT,
+                unit TEXT,
+                category TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS item_aliases (
+                code_key TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                item_id INTEGER NOT NULL REFERENCES items(id),
+                PRIMARY KEY (code_key, name_key)
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_aliases_item ON item_aliases(item_id)")
+        # DB เดิม: เพิ่ม item_id ให้รายการเดิม ยอดคงเหลือ/Checkpoint ที่ยังรวมตาม (รหัส, ชื่อ) สร้างใหม่ (เป็นข้อมูลที่คำนวณได้จากประวัติ)
+        if 'item_id' not in [r[1] for r in c.execute("PRAGMA table_info(transactions)")]:
+            c.execute("ALTER TABLE transactions ADD COLUMN item_id INTEGER REFERENCES items(id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_item_id ON transactions(item_id, date)")
+        if c.execute("SELECT 1 FROM transactions WHERE item_id IS NULL LIMIT 1").fetchone():
+            backfill_item_ids(conn)
+        c.execute("DROP INDEX IF EXISTS idx_transactions_item")  # (รหัส, ชื่อ) เดิม ใช้ตอนย้ายข้อมูลด้านบนเป็นครั้งสุดท้าย
+        if has_table(conn, 'item_balances') and 'item_id' not in [r[1] for r in c.execute("PRAGMA table_info(item_balances)")]:
+            c.execute("DROP TABLE item_balances")
+        if has_table(conn, 'balance_checkpoints') and 'item_id' not in [r[1] for r in c.execute("PRAGMA table_info(balance_checkpoints)")]:
+            c.execute("DROP TABLE balance_checkpoints")
+            c.execute("DROP TABLE IF EXISTS checkpoint_months")
+        # ตารางยอดคงเหลือรายวัสดุ (อัปเดตพร้อมการบันทึก/ลบ แทนการคำนวณใหม่ทุกครั้ง)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS item_balances (
+                item_id INTEGER PRIMARY KEY,
+                item_code TEXT,
+                item_name TEXT,
+                qty_in REAL DEFAULT 0,
+                qty_out REAL DEFAULT 0,
+                balance REAL DEFAULT 0,
+                unit TEXT,
+                category TEXT,
+                expiry_date TEXT
+            )
+        ''')
+        # ล็อตของรายการรับเข้าที่มีวันหมดอายุ (lots.py) ยอดคงเหลือตัดจ่ายแบบ FIFO อัปเดตพร้อม item_balances
+        # Index บางส่วนเฉพาะล็อตที่ยังเหลือของ: แจ้งเตือนหมดอายุ/ใกล้หมดอายุค้นช่วงวันที่ได้ทันที
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS item_lots (
+                receipt_id INTEGER PRIMARY KEY,
+                item_id INTEGER NOT NULL,
+                expiry_date TEXT NOT NULL,
+                quantity REAL,
+                remaining REAL
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_lots_item ON item_lots(item_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_lots_expiry ON item_lots(expiry_date, item_id) WHERE remaining > 0")
+        # Index สำหรับรายงานตามช่วงวันที่ (ใช้ได้ทั้งค้นด้วย date อย่างเดียว และ date + action_type)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date, action_type)")
+        # Index สำหรับตารางแบบแบ่งหน้า (Keyset ต่อจาก (date, id) ของแถวสุดท้ายของหน้าก่อน)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_page ON transactions(date, id)")
+        # Full-text search (trigram รองรับการค้นหาคำย่อยในชื่อภาษาไทย) + Trigger ให้ข้อมูลตรงกับ transactions เสมอ
+        if not has_table(conn, 'transactions_fts'):
+            try:
+                c.execute(f"CREATE VIRTUAL TABLE transactions_fts USING fts5({', '.join(FTS_COLUMNS)}, content='transactions', content_rowid='id', tokenize='trigram')")
+                cols = ', '.join(FTS_COLUMNS)
+                new_cols = ', '.join('new.' + x for x in FTS_COLUMNS)
+                old_cols = ', '.join('old.' + x for x in FTS_COLUMNS)
+                c.execute(f"CREATE TRIGGER transactions_fts_ai AFTER INSERT ON transactions BEGIN INSERT INTO transactions_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END")
+                c.execute(f"CREATE TRIGGER transactions_fts_ad AFTER DELETE ON transactions BEGIN INSERT INTO transactions_fts(transactions_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END")
+                c.execute(fts_update_trigger())
+                c.execute("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError:
+                pass  # SQLite ไม่มี FTS5/trigram -> ค้นหาด้วย LIKE แทน
+        # รอบอัปโหลด: 1 แถวต่อไฟล์/Sheet ที่นำเข้า (Hash ของไฟล์ใช้ตรวจจับการอัปโหลดไฟล์เดิมซ้ำ)
+        # รายการใน transactions / chemical_transactions อ้างถึงด้วย batch_id (มี Index) ลบทั้งรอบได้ในคำสั่งเดียว
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS upload_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tbl TEXT,
+                action_type TEXT,
+                upload_time TEXT,
+                file_hash TEXT,
+                sheet TEXT,
+                rows INTEGER DEFAULT 0,
+                uploaded_by TEXT
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_batches_file ON upload_batches(file_hash, sheet, action_type)")
+        for table in tables:
+            if 'batch_id' not in [r[1] for r in c.execute(f"PRAGMA table_info({table})")]:
+                migrate_batches(conn, table)
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_batch ON {table}(batch_id)")
+        if has_table(conn, 'uploaded_files'):
+            migrate_uploaded_files(conn, chemicals)
+        # คิวงานนำเข้าเบื้องหลัง (jobs.py): 1 แถวต่อไฟล์/Sheet ที่ส่งเข้าคิว พร้อมรอบอัปโหลดที่จองไว้ตั้งแต่ส่ง
+        # heartbeat = เวลาล่าสุดที่ Worker รายงานความคืบหน้า (ใช้ตรวจงานที่ค้างเพราะ App ปิดไปกลางทาง)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                action_type TEXT,
+                path TEXT,
+                sheet TEXT,
+                batch_id INTEGER REFERENCES upload_batches(id),
+                status TEXT DEFAULT 'queued',
+                total_rows INTEGER,
+                done_rows INTEGER DEFAULT 0,
+                inserted INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                cancel INTEGER DEFAULT 0,
+                error TEXT,
+                report TEXT,
+                created_at TEXT,
+                finished_at TEXT,
+                heartbeat REAL
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON ingest_jobs(status, id)")
+        # ไฟล์ Archive (Parquet รายเดือน) ที่ย้ายรายการเก่าออกไปแล้ว cutoff = วันแรกที่ยังอยู่ใน SQLite
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS archive_periods (
+                tbl TEXT,
+                month TEXT,
+                path TEXT,
+                rows INTEGER,
+                cutoff TEXT,
+                archived_at TEXT,
+                PRIMARY KEY (tbl, month, path)
+            )
+        ''')
+        # ยอดสะสมรายวัสดุก่อนวันแรกของแต่ละเดือน (Checkpoint) สำหรับยอด ณ วันที่ย้อนหลัง
+        # checkpoint_months = เดือนที่ใช้ได้ การบันทึก/ลบรายการย้อนหลังจะลบเฉพาะเดือนหลังวันที่นั้น
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                month TEXT,
+                item_id INTEGER,
+                qty_in REAL,
+                qty_out REAL,
+                PRIMARY KEY (month, item_id)
+            )
+        ''')
+        c.execute("CREATE TABLE IF NOT EXISTS checkpoint_months (month TEXT PRIMARY KEY, items INTEGER, created_at TEXT)")
+        # ตัวนับการเปลี่ยนแปลงของแต่ละตาราง (Trigger นับทุก insert/update/delete) ใช้เป็น Key ของ Cache
+        c.execute("CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER DEFAULT 0, deletes INTEGER DEFAULT 0)")
+        for table in tables:
+            c.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ver_ai AFTER INSERT ON {table} BEGIN UPDATE table_versions SET version = version + 1 WHERE name = '{table}'; END")
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ver_au AFTER UPDATE ON {table} BEGIN UPDATE table_versions SET version = version + 1 WHERE name = '{table}'; END")
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ver_ad AFTER DELETE ON {table} BEGIN UPDATE table_versions SET version = version + 1, deletes = deletes + 1 WHERE name = '{table}'; END")
+        # ฐานข้อมูลเดิมที่ยังไม่มียอดคงเหลือ ให้สร้างจากประวัติทั้งหมดครั้งแรก
+        if c.execute("SELECT 1 FROM item_balances LIMIT 1").fetchone() is None and c.execute("SELECT 1 FROM transactions LIMIT 1").fetchone():
+            refresh_item_balances(conn)
+        # DB เดิมก่อนมีล็อต: ตัดจ่ายล็อตจากรายการรับเข้าที่มีวันหมดอายุครั้งแรก
+        elif c.execute("SELECT 1 FROM item_lots LIMIT 1").fetchone() is None:
+            if c.execute("SELECT 1 FROM transactions WHERE action_type = 'In' AND expiry_date != '' LIMIT 1").fetchone():
+                refresh_item_lots(conn)
@@ -1,9 +1,17 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import os
+import inspect
+import tempfile
 from datetime import datetime, timedelta, timezone
-import time
+from inventory_core import (
+    ARCHIVE_KEEP_MONTHS, CHEM_COLUMNS, CHEMICAL_CONFIG, MATERIAL_COLUMNS, XLSX_MIME, Database, FrameCache,
+    IngestWorker, Profiler, active_jobs, archive_before, archive_preview, archive_summary, balances_as_of, cancel_job, chem_level_history, chem_levels_as_of,
+    count_matching, cutoff_for, search_archive, delete_batch, delete_data, delete_matching, expiring_lots, file_digest, find_upload, frame_chunks, get_date_range, init_db,
+    inspect_workbook, iter_range, list_batches, list_jobs, load_range, memory_report, merge_items, read_balances, read_chem_levels,
+    read_items, read_job_report, read_page, rebuild_item_balances, search_balances, search_transactions, spool_file, upload_stamp,
+    profile, slow_log, write_csv, write_xlsx
+)
 
 # ==========================================
 # 1. ตั้งค่าระบบและฐานข้อมูล
@@ -14,409 +22,467 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # 🔥 ใช้ DB v6 (โครงสร้างเดิมที่เสถียรแล้ว)
 DB_NAME = os.path.join(BASE_DIR, 'inventory_chem_v6.db')
 
-# 🔥 ค่าคงที่สำหรับสารเคมี (Config)
-CHEMICAL_CONFIG = {
-    "T11-2005B":    {"capacity": 60000, "limit": 48000, "density": 1.48, "name": "Sodium hydroxide 45% (NaOH)"},
-    "T11-1002A":    {"capacity": 60000, "limit": 48000, "density": 1.40, "name": "Sulphuric acid 50% (H2SO4)"},
-    "T11-1001":     {"capacity": 60000, "limit": 48000, "density": 1.16, "name": "Hydrochloric acid 31.2% (HCL)"},
-    "T11-9007B102": {"capacity": 30000, "limit": 24000, "density": 1.20, "name": "Hydrogen Peroxide (ไฮโดรเจนเปอร์ออกไซด์ 50%)"}
-}
-
-# 🔥 ตารางเทียบชื่อสารเคมี (Mapping)
-CHEM_MAPPING = {
-    # NaOH (Map เข้า T11-2005B)
-    "T11-2005A": "T11-2005B", "T11-2005": "T11-2005B", "Sodium hydroxide": "T11-2005B", "โซดาไฟ": "T11-2005B", "NaOH": "T11-2005B",
-    # H2SO4
-    "T11-1002A": "T11-1002A", "T11-1002": "T11-1002A", "T11-1003": "T11-1002A", "Sulfuric acid": "T11-1002A", "กรดซัลฟิวริก": "T11-1002A", "H2SO4": "T11-1002A",
-    # HCl
-    "T11-1001": "T11-1001", "Hydrochloric acid": "T11-1001", "กรดเกลือ": "T11-1001", "HCl": "T11-1001",
-    # H2O2
-    "T11-9007B102": "T11-9007B102", "T11-1004": "T11-9007B102", "T11-1004A": "T11-9007B102", "Hydrogen peroxide": "T11-9007B102", "ไฮโดรเจน": "T11-9007B102", "H2O2": "T11-9007B102"
-}
+# 🔥 จำนวนแถวต่อหน้าของการค้นหา
+PAGE_SIZE = 50
+# 🔥 จำนวนแถวต่อหน้าของตารางจัดการข้อมูล/ประวัติสารเคมี (อ่านจาก DB ทีละหน้า)
+GRID_PAGE_SIZE = 100
+# 🔥 st.dataframe รุ่นที่เลือกแถวได้ (on_select) ใช้เลือกแถวที่จะลบ รุ่นเก่าใช้ multiselect ของ ID ในหน้าที่แสดงแทน
+GRID_SELECT = 'on_select' in inspect.signature(st.dataframe).parameters
+# 🔥 ขนาดสูงสุดของ Cache ข้อมูลที่ใช้ร่วมกันทุก Session (MB)
+CACHE_MAX_MB = 256
+# 🔥 ชื่อผู้นำเข้าที่บันทึกในรอบอัปโหลด (upload_batches)
+UPLOAD_USER = 'Material Control'
+# 🔥 โหลดเฉพาะคอลัมน์ที่แต่ละหน้าใช้จริง
+MANAGE_COLS = ['id', 'date', 'item_code', 'item_name', 'action_type', 'quantity', 'unit', 'department', 'batch_id']
+CHEM_MANAGE_COLS = ['id', 'date', 'chem_code', 'action_type', 'qty_kg', 'qty_l', 'department', 'requester', 'batch_id']
+CHEM_DISP_COLS = ['date', 'chem_code', 'chem_desc', 'action_type', 'qty_kg', 'qty_l', 'department', 'requester']
+# 🔥 งานที่ช้ากว่าเกณฑ์ (ms) ถูกบันทึกลง logs/slow_ops.log (หมุนไฟล์อัตโนมัติ) ปรับได้ด้วย env INVENTORY_SLOW_MS
+SLOW_MS = int(os.environ.get('INVENTORY_SLOW_MS', 500))
+SLOW_LOG = os.path.join(BASE_DIR, 'logs', 'slow_ops.log')
+# 🔥 งานนำเข้าที่แสดงในหน้ารับเข้า/เบิกออก และความถี่ในการ Poll สถานะขณะที่ยังมีงานค้าง (วินาที)
+JOB_LIST = 5
+JOB_REFRESH_SECONDS = 2
+JOB_KINDS = {'material': 'วัสดุ (Material)', 'chemical': 'ถังบรรจุสารเคมี (Chemical Tank)'}
+JOB_STATUS = {'queued': '⏳ รอคิว', 'running': '🔄 กำลังบันทึก', 'done': '✅', 'failed': '❌', 'cancelled': '🚫'}
 
 def get_thai_now():
     tz_thai = timezone(timedelta(hours=7))
     return datetime.now(tz_thai)
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # ตารางวัสดุทั่วไป
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            item_code TEXT,
-            item_name TEXT,
-            action_type TEXT,
-            quantity REAL,
-            unit TEXT,
-            category TEXT,
-            expiry_date TEXT,
-            department TEXT,
-            requester TEXT,
-            remark TEXT,
-            upload_time TEXT 
-        )
-    ''')
-    # ตารางสารเคมี
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chemical_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            chem_code TEXT,
-            chem_desc TEXT,
-            action_type TEXT,
-            qty_kg REAL,
-            qty_l REAL,
-            density REAL,
-            department TEXT,
-            requester TEXT,
-            upload_time TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# --- ฟังก์ชันจัดการวัสดุทั่วไป (General) ---
-def save_to_db(df, action_type):
-    if df.empty: return
-    conn = sqlite3.connect(DB_NAME)
-    try:
-        df['action_type'] = action_type
-        batch_timestamp = get_thai_now().strftime('%Y-%m-%d %H:%M:%S')
-        df['upload_time'] = batch_timestamp
-        for col in ['date', 'expiry_date']:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-        if 'item_code' in df.columns:
-            df['item_code'] = df['item_code'].fillna('-')
-        df.to_sql('transactions', conn, if_exists='append', index=False)
-        st.success(f"✅ บันทึกวัสดุ (Material) เรียบร้อย! ({len(df)} รายการ)")
-        st.cache_data.clear()
-    except Exception as e: st.error(f"❌ Error Material: {e}")
-    finally: conn.close()
-
-# --- ฟังก์ชันจัดการถังบรรจุสารเคมี (Chemical Tank Batch) ---
-def save_chem_batch(df, action_type):
-    if df.empty: return
-    conn = sqlite3.connect(DB_NAME)
-    try:
-        batch_timestamp = get_thai_now().strftime('%Y-%m-%d %H:%M:%S')
-        records = []
-        unknown_codes = []
-
-        for _, row in df.iterrows():
-            raw_code = str(row['r_code']).strip()
-            
-            # 1. เช็ค Config
-            code = None
-            if raw_code in CHEMICAL_CONFIG:
-                code = raw_code
-            else:
-                # 2. เช็ค Mapping
-                for k, v in CHEM_MAPPING.items():
-                    if k.lower() in raw_code.lower():
-                        code = v
-                        break
-            
-            if not code:
-                unknown_codes.append(raw_code)
-                continue 
-
-            kg = float(row['qty_kg'])
-            date = pd.to_datetime(row['date']).strftime('%Y-%m-%d')
-            
-            # ดึงคำอธิบาย
-            chem_desc = str(row.get('chem_desc', ''))
-            if chem_desc.lower() == 'nan' or not chem_desc: 
-                chem_desc = CHEMICAL_CONFIG[code]['name']
-
-            requester = str(row.get('requester', ''))
-            if requester.lower() == 'nan': requester = ''
-            
-            department = str(row.get('department', ''))
-            if department.lower() == 'nan': department = ''
-            
-            density = CHEMICAL_CONFIG[code]['density']
-            qty_l = kg / density if density > 0 else 0
-            
-            records.append((date, code, chem_desc, action_type, kg, qty_l, density, department, requester, batch_timestamp))
-        
-        if records:
-            conn.executemany('''
-                INSERT INTO chemical_transactions (date, chem_code, chem_desc, action_type, qty_kg, qty_l, density, department, requester, upload_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', records)
-            conn.commit()
-            st.success(f"✅ บันทึกถังบรรจุสารเคมี (Chemical Tank) เรียบร้อย! ({len(records)} รายการ)")
-        
-        if unknown_codes:
-            st.warning(f"⚠️ พบรายการสารเคมีที่ไม่รู้จัก: {list(set(unknown_codes))}")
-            
-        st.cache_data.clear()
-    except Exception as e: st.error(f"❌ Error Chemical: {e}")
-    finally: conn.close()
-
-def load_data():
-    if not os.path.exists(DB_NAME): return pd.DataFrame()
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql_query("SELECT * FROM transactions ORDER BY date DESC, id DESC", conn)
-        conn.close()
-        return df
+# --- การเชื่อมต่อฐานข้อมูล + Cache (ใช้ร่วมกันทั้ง Process, Logic ทั้งหมดอยู่ใน inventory_core) ---
+@st.cache_resource
+def get_db():
+    return Database(DB_NAME)
+
+@st.cache_resource
+def get_frame_cache():
+    return FrameCache(CACHE_MAX_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_slow_log():
+    return slow_log(SLOW_LOG)
+
+@st.cache_resource
+def get_worker():
+    # 🔥 Worker นำเข้าเบื้องหลัง 1 ตัวต่อ Process (ต้องเรียกหลัง init_db) งานที่ค้างจาก App รอบก่อนถูกลบแล้วเข้าคิวใหม่เอง
+    return IngestWorker(get_db()).start()
+
+def cached(key, tables, loader):
+    # ข้อมูลที่ได้จาก Cache ใช้ร่วมกันทุก Session ห้ามแก้ไขในที่ (ให้ copy ก่อน)
+    with profile(key, 'cache') as info:
+        value = get_frame_cache().fetch(get_db(), key, tables, loader)
+        info['rows'] = len(value)
+    if isinstance(value, pd.DataFrame): page_frames.append(value)
+    return value
+
+def show_df(data, **kw):
+    # 🔥 st.dataframe + จับเวลาการแสดงผล (ตารางใหญ่ใช้เวลา Serialize ส่งไป Browser นานกว่าการโหลด)
+    with profile(f"st.dataframe ({len(data):,} แถว)", 'render'): return st.dataframe(data, **kw)
+
+# 🔥 DataFrame ที่หน้านี้ใช้ในรอบนี้ ทั้งจาก Cache (ยอดคงเหลือ/ประวัติ) และหน้าตาราง (สำหรับรายงานหน่วยความจำ)
+page_frames = []
+
+def load_balances():
+    try: return cached('item_balances', ('transactions',), lambda: read_balances(get_db()))
+    except: return pd.DataFrame()
+
+def load_chem_levels():
+    """ยอดปัจจุบันของทุกถังใน CHEMICAL_CONFIG = แถวล่าสุดของ Ledger"""
+    try: return cached('chem_levels', ('chemical_transactions',), lambda: read_chem_levels(get_db()))
+    except: return {}
+
+def load_balances_as_of(day):
+    # 🔥 ยอด ณ สิ้นวัน day = Checkpoint ต้นเดือนใน DB + รายการตั้งแต่ต้นเดือน (Cache แยกตามวันที่)
+    try: return cached(f'item_balances@{day}', ('transactions',), lambda: balances_as_of(get_db(), day))
     except: return pd.DataFrame()
 
-def load_chem_data():
-    if not os.path.exists(DB_NAME): return pd.DataFrame()
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql_query("SELECT * FROM chemical_transactions ORDER BY date DESC, id DESC", conn)
-        conn.close()
-        return df
+def load_chem_levels_as_of(day):
+    # 🔥 ยอดถัง ณ สิ้นวัน day = แถวล่าสุดของ Ledger ที่ไม่เกินวันนั้น
+    try: return cached(f'chem_levels@{day}', ('chemical_transactions',), lambda: chem_levels_as_of(get_db(), day))
+    except: return {}
+
+def load_lots(start, end):
+    # 🔥 ล็อตที่ยังเหลือของและหมดอายุในช่วง start..end (ค้นผ่าน Index บางส่วนของ item_lots ครั้งเดียว)
+    try: return cached(f'lots@{start}..{end}', ('transactions',), lambda: expiring_lots(get_db(), start, end))
+    except: return pd.DataFrame()
+
+def load_chem_level_history(start=None):
+    # 🔥 ยอดถังรายวันตั้งแต่ start (None = ทั้งหมด) สำหรับกราฟ (Cache แยกตามวันเริ่ม)
+    try: return cached(f'chem_history@{start}', ('chemical_transactions',), lambda: chem_level_history(get_db(), start))
     except: return pd.DataFrame()
 
-def calculate_inventory(df):
-    if df.empty: return pd.DataFrame()
-    df['item_code'] = df['item_code'].astype(str)
-    df['item_name'] = df['item_name'].astype(str)
-    bal = df.pivot_table(index=['item_code','item_name'], columns='action_type', values='quantity', aggfunc='sum', fill_value=0).reset_index()
-    latest = df.sort_values('date', ascending=False).drop_duplicates(['item_code','item_name'])
-    cats = df[(df['category'].notna()) & (~df['category'].isin(['','-','None']))]
-    best_cat = cats.sort_values('date',ascending=False).drop_duplicates(['item_code','item_name'])[['item_code','item_name','category']] if not cats.empty else pd.DataFrame(columns=['item_code','item_name','category'])
-    exps = df[(df['action_type']=='In') & df['expiry_date'].notna()]
-    min_exp = exps.groupby(['item_code','item_name'])['expiry_date'].min().reset_index() if not exps.empty else pd.DataFrame(columns=['item_code','item_name','expiry_date'])
-    bal = bal.merge(latest[['item_code','item_name','unit']], on=['item_code','item_name'], how='left').merge(best_cat, on=['item_code','item_name'], how='left').merge(min_exp, on=['item_code','item_name'], how='left')
-    bal['category'] = bal['category'].fillna('-')
-    bal['unit'] = bal['unit'].fillna('')
-    if 'In' not in bal: bal['In']=0
-    if 'Out' not in bal: bal['Out']=0
-    bal['Balance'] = bal['In'] - bal['Out']
-    return bal
-
-def calculate_chem_balance(df):
-    if df.empty: return {}
-    bal = df.pivot_table(index='chem_code', columns='action_type', values='qty_kg', aggfunc='sum', fill_value=0)
-    if 'In' not in bal: bal['In'] = 0
-    if 'Out' not in bal: bal['Out'] = 0
-    bal['Balance_KG'] = bal['In'] - bal['Out']
-    return bal['Balance_KG'].to_dict()
-
-def delete_batch(batch):
-    conn = sqlite3.connect(DB_NAME)
-    conn.execute("DELETE FROM transactions WHERE upload_time = ?", (batch,))
-    conn.execute("DELETE FROM chemical_transactions WHERE upload_time = ?", (batch,))
-    conn.commit()
-    conn.close()
-    st.success(f"ลบรอบ {batch} สำเร็จ"); st.cache_data.clear()
-
-def delete_data(ids, table='transactions'):
-    conn = sqlite3.connect(DB_NAME)
-    conn.execute(f"DELETE FROM {table} WHERE id IN {tuple(ids) if len(ids)>1 else f'({ids[0]})'}")
-    conn.commit()
-    conn.close()
+def load_report(table, start, end):
+    try: return load_range(get_db(), table, start, end)
+    except: return pd.DataFrame()
+
+# --- ข้อมูลรายหน้า (โหลดเฉพาะชุดที่หน้าที่เปิดอยู่ประกาศไว้ เมื่อใช้ครั้งแรก) ---
+# 🔥 ชื่อชุดข้อมูล -> Loader
+DATASETS = {
+    'balances': load_balances,
+    'chem_levels': load_chem_levels,
+    'balances_as_of': load_balances_as_of,
+    'chem_levels_as_of': load_chem_levels_as_of,
+    'lots': load_lots,
+    'chem_history': load_chem_level_history,
+}
+# 🔥 หน้า -> ชุดข้อมูลที่ใช้ (หน้าที่ไม่อยู่ในนี้ เช่น รับเข้า/เบิกออก/ค้นหา/รายงานประจำวัน/จัดการข้อมูล อ่านผ่าน Query ของตัวเองเท่านั้น)
+PAGE_DATA = {
+    "🧪 ระบบจัดการสารเคมี (Chemical Tanks)": ('chem_levels', 'chem_levels_as_of', 'chem_history'),
+    "📊 Dashboard & แจ้งเตือน": ('balances', 'lots'),
+    "📋 วัสดุทั้งหมด (Overview)": ('balances', 'balances_as_of'),
+    "📉 วัสดุหมดสต๊อก (Out of Stock)": ('balances',),
+}
+# 🔥 ชุดข้อมูลที่โหลดแล้วในรอบนี้ (ขอซ้ำในรอบเดียวกันไม่โหลดใหม่)
+page_data = {}
+
+def need(name, *args):
+    # 🔥 ชุดข้อมูลของหน้าปัจจุบัน โหลดเมื่อขอครั้งแรก; ขอชุดที่หน้าไม่ได้ประกาศใน PAGE_DATA = Error (กันหน้าแอบโหลดข้อมูลเกิน)
+    # args = พารามิเตอร์ของชุดข้อมูล (เช่น วันที่ของยอดย้อนหลัง)
+    if name not in PAGE_DATA.get(choice, ()): raise KeyError(f"หน้า '{choice}' ไม่ได้ประกาศชุดข้อมูล '{name}' ใน PAGE_DATA")
+    label = f"{name}({', '.join(map(str, args))})" if args else name
+    if label not in page_data:
+        with profile(f"page data: {label}", 'load'): page_data[label] = DATASETS[name](*args)
+    return page_data[label]
+
+def as_of_picker(key):
+    # 🔥 ดูยอดย้อนหลัง ณ สิ้นวันที่เลือก (ไม่ติ๊ก = ยอดปัจจุบัน) คืน 'YYYY-MM-DD' หรือ None
+    if not st.checkbox("📅 ดูยอด ณ วันที่ย้อนหลัง", key=f"asof_on_{key}"): return None
+    return st.date_input("ณ สิ้นวันที่:", get_thai_now().date(), key=f"asof_{key}").strftime('%Y-%m-%d')
+
+# --- นำเข้าไฟล์ Excel ---
+@st.cache_data(max_entries=8, show_spinner=False)
+def inspect_upload(digest, _data):
+    # 🔥 เปิดไฟล์ครั้งเดียวต่อไฟล์ (Key = hash ของเนื้อไฟล์) คืน {sheet: (ตัวอย่าง 3 แถว, จำนวนแถว)} ทุก Rerun ใช้ผลเดิม
+    return inspect_workbook(_data)
+
+def upload_guard(digest, sheet, action_type, key):
+    # 🔥 ไฟล์เดิม (hash ตรงกัน) เคยนำเข้าแล้ว -> ไม่ให้บันทึกจนกว่าจะติ๊กยืนยัน
+    prev = find_upload(get_db(), digest, sheet, action_type)
+    if prev is None: return True
+    st.warning(f"⚠️ ไฟล์นี้ (Sheet '{sheet}') เคยนำเข้าแล้วเมื่อ {prev[0]} ({prev[1]:,} แถว) ถ้าบันทึกซ้ำยอดจะถูกนับ 2 ครั้ง")
+    return st.checkbox("ยืนยันนำเข้าซ้ำ", key=f"dup_{key}")
+
+# --- คิวนำเข้า (บันทึกเบื้องหลังด้วย Worker หน้าเว็บไม่ต้องรอ) ---
+def queue_upload(kind, action_type, data, digest, sheet, total=None):
+    """เก็บไฟล์ลง spool แล้วส่งเข้าคิว ความคืบหน้า/ผลลัพธ์ดูได้จาก job_panel()"""
+    path = spool_file(get_db(), data, digest)
+    job_id = get_worker().submit(kind, action_type, path, sheet, total, upload_stamp(get_thai_now()), (digest, sheet), UPLOAD_USER)
+    st.success(f"📨 ส่ง {JOB_KINDS[kind]} เข้าคิวแล้ว (งาน #{job_id}) ทำงานอื่นต่อได้เลย")
+
+def show_job(job):
+    label = f"{JOB_STATUS[job.status]} งาน #{job.id} {JOB_KINDS[job.kind]} ({job.action_type})"
+    if job.status in ('queued', 'running'):
+        total = int(job.total_rows) if pd.notna(job.total_rows) else 0
+        c1, c2 = st.columns([5, 1])
+        c1.progress(min(job.done_rows / total, 1.0) if total else 0.0,
+                    text=f"{label}: {job.done_rows:,}" + (f" / {total:,} แถว" if total else " แถว"))
+        if c2.button("ยกเลิก", key=f"cancel_job_{job.id}"): cancel_job(get_db(), job.id)
+        return
+    if job.status == 'done': st.success(f"{label}: บันทึกเรียบร้อย {job.inserted:,} รายการ" + (f" (รอบ #{job.batch_id})" if job.inserted else ""))
+    elif job.status == 'failed': st.error(f"{label}: {job.error} (ลบรายการที่บันทึกไปแล้วของงานนี้ออกทั้งหมด)")
+    else: st.warning(f"{label}: ยกเลิกแล้ว (ลบรายการที่บันทึกไปแล้วของงานนี้ออกทั้งหมด)")
+    report = read_job_report(job.report)
+    if not report['unknown'].empty:
+        st.warning(f"⚠️ พบรายการสารเคมีที่ไม่รู้จัก: {report['unknown']['r_code'].tolist()}")
+        show_df(report['unknown'], hide_index=True)
+    if report['invalid_rows']:
+        # 🔥 row = แถวในไฟล์ Excel (วันที่/จำนวนผิด หรือเบิกเกินยอดคงเหลือ) เก็บไว้ไม่เกิน JOB_MAX_ERRORS แถว
+        kept = f" (แสดง {len(report['invalid']):,} แถวแรก)" if len(report['invalid']) < report['invalid_rows'] else ""
+        st.warning(f"⚠️ ข้ามแถวที่ข้อมูลไม่ถูกต้อง {report['invalid_rows']:,} แถว{kept}")
+        show_df(report['invalid'], hide_index=True)
+        export_button("📥 ดาวน์โหลดแถวที่ไม่ผ่าน", f"rejected_job{job.id}", lambda: [report['invalid']], f"rejected_job_{job.id}")
+
+def job_panel():
+    # 🔥 งานนำเข้าล่าสุดจากตาราง ingest_jobs: ขณะที่มีงานค้าง Poll เฉพาะส่วนนี้ทุก JOB_REFRESH_SECONDS วินาที (ไม่ Rerun ทั้งหน้า)
+    polling = hasattr(st, 'fragment') and active_jobs(get_db()) > 0
+    def show():
+        jobs = list_jobs(get_db(), JOB_LIST)
+        if jobs.empty: return
+        st.subheader("📨 งานนำเข้าล่าสุด")
+        for job in jobs.itertuples(): show_job(job)
+        # งานเสร็จหมดแล้ว -> Rerun ทั้งหน้าครั้งเดียวเพื่อหยุด Poll
+        if polling and not jobs['status'].isin(['queued', 'running']).any(): st.rerun()
+    if polling: st.fragment(run_every=JOB_REFRESH_SECONDS)(show)()
+    else:
+        show()
+        if not hasattr(st, 'fragment'): st.button("🔄 อัปเดตสถานะงาน")
+
+# --- ดาวน์โหลด ---
+def export_button(label, name, chunks, key, **kw):
+    # 🔥 สร้างไฟล์เมื่อกดเท่านั้น (ไม่สร้างทุก Rerun) เขียนทีละ Chunk ลงไฟล์ชั่วคราว chunks() = Iterable ของ DataFrame
+    c1, c2 = st.columns([1, 3])
+    fmt = c1.radio("รูปแบบไฟล์", ["CSV", "Excel"], horizontal=True, key=f"{key}_fmt", label_visibility="collapsed")
+    if c2.button(label, key=key, **kw):
+        ext, mime, write = ('csv', 'text/csv', write_csv) if fmt == "CSV" else ('xlsx', XLSX_MIME, write_xlsx)
+        with tempfile.TemporaryFile() as f:
+            with st.spinner("กำลังสร้างไฟล์..."): write(chunks(), f)
+            f.seek(0)
+            c2.download_button(f"💾 บันทึก {name}.{ext}", f, f"{name}.{ext}", mime, key=f"{key}_dl")
+
+# --- ลบข้อมูล ---
+def remove_batch(batch_id):
+    try: delete_batch(get_db(), batch_id)
+    except ValueError as e: st.error(f"❌ {e}"); return
+    st.success(f"ลบรอบ #{batch_id} สำเร็จ"); st.cache_data.clear()
+
+def remove_rows(ids, table='transactions'):
+    if not ids: return
+    delete_data(get_db(), ids, table)
     st.success("ลบรายการสำเร็จ"); st.cache_data.clear()
 
+def merge_selected(keep, others):
+    # 🔥 รวมวัสดุที่ชื่อสะกดต่างกันเป็นวัสดุเดียว (ชื่อเรียกทั้งหมดของรายการที่ถูกรวมชี้ไปรายการหลัก การนำเข้าครั้งต่อไปจับคู่ให้เอง)
+    try: n = merge_items(get_db(), keep, others)
+    except ValueError as e: st.error(f"❌ {e}"); return
+    st.success(f"รวม {len(others)} รายการเข้า #{keep} แล้ว ({n:,} แถว)"); st.cache_data.clear()
+
+def remove_matching(table, filters):
+    try: n = delete_matching(get_db(), table, filters)
+    except ValueError as e: st.error(f"❌ {e}"); return
+    st.success(f"ลบ {n:,} รายการสำเร็จ"); st.cache_data.clear()
+
+# --- ตารางแบ่งหน้าฝั่ง Server ---
+def data_grid(table, cols, key, selectable=False, **kw):
+    # 🔥 ตัวกรองส่งเป็น SQL แล้วอ่านทีละ GRID_PAGE_SIZE แถวแบบ Keyset (date, id) cursor ของหน้าที่ผ่านมาเก็บใน session_state
+    # เลือกแถวได้เฉพาะในหน้าที่แสดง (ไม่ส่ง ID ทั้งตารางไป Browser) คืน (ID ที่เลือก, ตัวกรอง, จำนวนแถวที่ตรงกับตัวกรอง)
+    c1, c2, c3 = st.columns([2, 1, 2])
+    txt = c1.text_input("🔍 ค้นหา:", key=f"{key}_txt").strip()
+    action = c2.selectbox("ประเภท:", ["ทั้งหมด", "In", "Out"], key=f"{key}_act")
+    dates = c3.date_input("ช่วงวันที่:", [], key=f"{key}_dates")
+    filters = {'txt': txt, 'action_type': None if action == "ทั้งหมด" else action}
+    if len(dates) == 2: filters.update(start=dates[0].strftime('%Y-%m-%d'), end=dates[1].strftime('%Y-%m-%d'))
+    # 🔥 ตัวกรองเปลี่ยน -> กลับไปหน้าแรก
+    state = st.session_state.setdefault(f"{key}_pages", {'filters': None, 'cursors': [None]})
+    if state['filters'] != filters: state.update(filters=filters, cursors=[None])
+    page, next_cursor = read_page(get_db(), table, cols, filters, state['cursors'][-1], GRID_PAGE_SIZE)
+    page_frames.append(page)
+    total = count_matching(get_db(), table, filters)
+    # 🔥 ปุ่มเปลี่ยนหน้าแก้ cursor ใน Callback (ทำก่อน Rerun ถัดไปอ่านข้อมูล)
+    n1, n2, n3 = st.columns([1, 1, 4])
+    n1.button("◀️ ก่อนหน้า", key=f"{key}_prev", disabled=len(state['cursors']) == 1, on_click=state['cursors'].pop)
+    n2.button("ถัดไป ▶️", key=f"{key}_next", disabled=next_cursor is None, on_click=state['cursors'].append, args=(next_cursor,))
+    n3.caption(f"หน้า {len(state['cursors']):,} / {max(-(-total // GRID_PAGE_SIZE), 1):,} | ตรงกับตัวกรอง {total:,} แถว")
+    if not selectable:
+        show_df(page.drop(columns='id'), use_container_width=True, hide_index=True, **kw); return [], filters, total
+    if GRID_SELECT:
+        event = show_df(page, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row", key=f"{key}_grid", **kw)
+        return page['id'].iloc[event.selection.rows].tolist(), filters, total
+    show_df(page, use_container_width=True, hide_index=True, **kw)
+    return st.multiselect("เลือก ID (เฉพาะหน้านี้):", page['id'].tolist(), key=f"{key}_ids"), filters, total
+
 # ==========================================
 # 2. ส่วน UI หลัก
 # ==========================================
-init_db()
+init_db(get_db())
+get_worker()
+# 🔥 จับเวลาทุกขั้นตอนของ Rerun นี้ (ดูใน Panel ท้าย Sidebar / งานที่ช้าเกินเกณฑ์ลง Log)
+prof = Profiler('main', SLOW_MS, get_slow_log()).activate()
+# 🔥 st.rerun()/st.stop() ไม่ใช่ Exception ธรรมดา (ไม่เข้า except) แต่ยังผ่าน finally: จบการจับเวลาได้ทุกรอบ
+choice, error = None, None
+try:
+    st.sidebar.title("🔐 เข้าสู่ระบบ")
+    role = st.sidebar.radio("เลือกแผนกที่ใช้งาน:", ["👤 Other Department", "🔑 Material Control Department"])
+    is_admin = False
+    if role == "🔑 Material Control Department":
+        st.sidebar.markdown("---")
+        password = st.sidebar.text_input("รหัสผ่านแผนก:", type="password")
+        if password == "1111100000":
+            is_admin = True
+            st.sidebar.success("ยืนยันตัวตนสำเร็จ ✅")
+        elif password: st.sidebar.error("รหัสผิด ❌")
+
+    if is_admin:
+        menu_options = [
+            "📊 Dashboard & แจ้งเตือน", 
+            "🧪 ระบบจัดการสารเคมี (Chemical Tanks)", 
+            "📋 วัสดุทั้งหมด (Overview)", 
+            "📉 วัสดุหมดสต๊อก (Out of Stock)", 
+            "🔍 ค้นหา (Search)",   
+            "📅 รายงานประจำวัน (Daily)", 
+            "📥 รับเข้า (In)", 
+            "📤 เบิกออก (Out)", 
+            "🔧 จัดการข้อมูล"
+        ]
+    else:
+        menu_options = [
+            "📋 วัสดุทั้งหมด (Overview)", 
+            "📉 วัสดุหมดสต๊อก (Out of Stock)", 
+            "🔍 ค้นหา (Search)"
+        ]
 
-st.sidebar.title("🔐 เข้าสู่ระบบ")
-role = st.sidebar.radio("เลือกแผนกที่ใช้งาน:", ["👤 Other Department", "🔑 Material Control Department"])
-is_admin = False
-if role == "🔑 Material Control Department":
     st.sidebar.markdown("---")
-    password = st.sidebar.text_input("รหัสผ่านแผนก:", type="password")
-    if password == "1111100000":
-        is_admin = True
-        st.sidebar.success("ยืนยันตัวตนสำเร็จ ✅")
-    elif password: st.sidebar.error("รหัสผิด ❌")
-
-if is_admin:
-    menu_options = [
-        "📊 Dashboard & แจ้งเตือน", 
-        "🧪 ระบบจัดการสารเคมี (Chemical Tanks)", 
-        "📋 วัสดุทั้งหมด (Overview)", 
-        "📉 วัสดุหมดสต๊อก (Out of Stock)", 
-        "🔍 ค้นหา (Search)",   
-        "📅 รายงานประจำวัน (Daily)", 
-        "📥 รับเข้า (In)", 
-        "📤 เบิกออก (Out)", 
-        "🔧 จัดการข้อมูล"
-    ]
-else:
-    menu_options = [
-        "📋 วัสดุทั้งหมด (Overview)", 
-        "📉 วัสดุหมดสต๊อก (Out of Stock)", 
-        "🔍 ค้นหา (Search)"
-    ]
-
-st.sidebar.markdown("---")
-choice = st.sidebar.radio("เมนู:", menu_options)
-st.sidebar.markdown("---")
-if st.sidebar.button("🔄 รีเฟรชข้อมูล"): st.rerun()
-
-df = load_data()
-balance_df = calculate_inventory(df) if not df.empty else pd.DataFrame()
-chem_df = load_chem_data()
-chem_bal = calculate_chem_balance(chem_df)
-
-# ==========================================
-# 3. ส่วนเนื้อหา (Content)
-# ==========================================
+    choice = st.sidebar.radio("เมนู:", menu_options)
+    st.sidebar.markdown("---")
+    if st.sidebar.button("🔄 รีเฟรชข้อมูล"): st.rerun()
+
+    # ==========================================
+    # 3. ส่วนเนื้อหา (Content)
+    # ==========================================
+
+    # --- 🧪 ถังบรรจุสารเคมี (Chemical Tank) - เฉพาะ Admin ---
+    if choice == "🧪 ระบบจัดการสารเคมี (Chemical Tanks)" and is_admin:
+        st.header("🧪 ระบบจัดการสารเคมี (Chemical Tank Management)")
+
+        as_of = as_of_picker('chem')
+        st.subheader(f"📊 สถานะถังเก็บ ณ สิ้นวันที่ {as_of}" if as_of else "📊 สถานะถังเก็บปัจจุบัน")
+        chem_bal = need('chem_levels_as_of', as_of) if as_of else need('chem_levels')
+        cols = st.columns(4)
+        for i, (code, conf) in enumerate(CHEMICAL_CONFIG.items()):
+            current_kg = chem_bal.get(code, 0)
+            current_l = current_kg / conf['density']
+            percent = (current_kg / conf['limit']) * 100
+            with cols[i]:
+                st.markdown(f"#### {code}")
+                st.caption(conf['name'])
+                safe_pct = max(0.0, min(percent/100, 1.0))
+                if current_kg > conf['limit']: st.progress(safe_pct, text="⚠️ OVER")
+                elif current_kg > conf['limit']*0.9: st.progress(safe_pct, text="🟠 Warning")
+                else: st.progress(safe_pct, text="🟢 Normal")
+                st.metric("คงเหลือ", f"{current_kg:,.0f} KG", f"{current_l:,.0f} L")
+                st.caption(f"Limit: {conf['limit']:,} KG")
+                st.divider()
+
+        # 🔥 กราฟระดับถังย้อนหลัง (อ่านจาก Ledger โดยตรง ไม่ต้องคำนวณประวัติใหม่)
+        st.subheader("📈 ระดับถังย้อนหลัง (KG)")
+        days = st.radio("ช่วงเวลา:", [30, 90, 365, 0], format_func=lambda d: f"{d} วัน" if d else "ทั้งหมด", horizontal=True)
+        hist = need('chem_history', (get_thai_now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else None)
+        if not hist.empty:
+            st.line_chart(hist.pivot(index='date', columns='chem_code', values='bal_kg').ffill())
+        else: st.info("ยังไม่มีประวัติรายการ")
 
-# --- 🧪 ถังบรรจุสารเคมี (Chemical Tank) - เฉพาะ Admin ---
-if choice == "🧪 ระบบจัดการสารเคมี (Chemical Tanks)" and is_admin:
-    st.header("🧪 ระบบจัดการสารเคมี (Chemical Tank Management)")
-    
-    st.subheader("📊 สถานะถังเก็บปัจจุบัน")
-    cols = st.columns(4)
-    for i, (code, conf) in enumerate(CHEMICAL_CONFIG.items()):
-        current_kg = chem_bal.get(code, 0)
-        current_l = current_kg / conf['density']
-        percent = (current_kg / conf['limit']) * 100
-        with cols[i]:
-            st.markdown(f"#### {code}")
-            st.caption(conf['name'])
-            safe_pct = max(0.0, min(percent/100, 1.0))
-            if current_kg > conf['limit']: st.progress(safe_pct, text="⚠️ OVER")
-            elif current_kg > conf['limit']*0.9: st.progress(safe_pct, text="🟠 Warning")
-            else: st.progress(safe_pct, text="🟢 Normal")
-            st.metric("คงเหลือ", f"{current_kg:,.0f} KG", f"{current_l:,.0f} L")
-            st.caption(f"Limit: {conf['limit']:,} KG")
-            st.divider()
-
-    st.markdown("---")
-    st.subheader("📜 ประวัติการรับ/จ่ายถังบรรจุสารเคมี")
-    if not chem_df.empty:
-        csv = chem_df.to_csv(index=False).encode('utf-8-sig')
-        st.download_button("📥 ดาวน์โหลดประวัติ (CSV)", csv, "chem_history.csv", "text/csv")
-        
-        # 🔥 เลือกเฉพาะคอลัมน์ที่ต้องการ (ตัด ID ออก)
-        disp_cols = ['date', 'chem_code', 'chem_desc', 'action_type', 'qty_kg', 'qty_l', 'department', 'requester']
-        
-        st.dataframe(
-            chem_df[disp_cols], 
-            use_container_width=True, 
-            hide_index=True,
-            column_config={
-                "chem_code": "รหัสวัสดุ", 
-                "qty_kg": st.column_config.NumberColumn("จำนวน (KG)", format="%.2f"),
-                "qty_l": st.column_config.NumberColumn("จำนวน (L)", format="%.2f"),
-                "department": "แผนก",
-                "requester": "ผู้เบิก",
-                "date": st.column_config.DateColumn("วันที่"),
-                "chem_desc": "คำอธิบาย"
-            }
-        )
-    else: st.info("ยังไม่มีประวัติรายการ")
-
-# --- 📊 Dashboard ---
-elif choice == "📊 Dashboard & แจ้งเตือน" and is_admin:
-    st.header("📊 Dashboard ภาพรวมสต็อก (Material)")
-    if not balance_df.empty:
-        today = get_thai_now().strftime('%Y-%m-%d')
-        next_30 = (get_thai_now() + timedelta(days=30)).strftime('%Y-%m-%d')
-        has_exp = balance_df[balance_df['expiry_date'].notna() & (balance_df['Balance']>0)]
-        expired = has_exp[has_exp['expiry_date'] < today]
-        near = has_exp[(has_exp['expiry_date'] >= today) & (has_exp['expiry_date'] <= next_30)]
-        c1, c2 = st.columns(2)
-        with c1:
-            if not expired.empty: st.error(f"⛔ หมดอายุแล้ว ({len(expired)} รายการ)"); st.dataframe(expired[['expiry_date','item_name','Balance']], hide_index=True)
-            else: st.success("✅ ไม่มีของหมดอายุ")
-        with c2:
-            if not near.empty: st.warning(f"⚠️ ใกล้หมดอายุ ({len(near)} รายการ)"); st.dataframe(near[['expiry_date','item_name','Balance']], hide_index=True)
-            else: st.success("✅ ไม่มีของใกล้หมดอายุ")
         st.markdown("---")
-        c1, c2, c3 = st.columns(3)
-        c1.metric("📦 รายการวัสดุ", len(balance_df))
-        c2.metric("⚠️ สินค้าหมด", len(balance_df[balance_df['Balance']<=0]))
-        c3.metric("📅 เวลาปัจจุบัน", get_thai_now().strftime("%H:%M:%S"))
-    else: st.info("ยังไม่มีข้อมูล")
-
-# --- 📋 วัสดุทั้งหมด ---
-elif choice == "📋 วัสดุทั้งหมด (Overview)":
-    st.header("📋 รายการวัสดุคงเหลือทั้งหมด")
-    if not balance_df.empty:
-        c1, c2 = st.columns([2,1])
-        with c1: txt = st.text_input("🔍 ค้นหา:", placeholder="ชื่อ หรือ รหัส...")
-        with c2: 
-            cats = ["ทั้งหมด"] + sorted([c for c in balance_df['category'].unique() if c!='-'])
-            sel = st.selectbox("หมวดหมู่:", cats)
-        show = balance_df.copy()
-        if sel != "ทั้งหมด": show = show[show['category']==sel]
-        if txt: show = show[show.astype(str).apply(lambda x: x.str.contains(txt, case=False, na=False)).any(axis=1)]
-        if is_admin:
-            csv = show.to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 ดาวน์โหลด (CSV)", csv, "stock_overview.csv", "text/csv", type="primary")
-        else: st.caption("ℹ️ เฉพาะ Admin เท่านั้นที่ดาวน์โหลดได้")
-        st.dataframe(show[['item_code','item_name','category','In','Out','Balance','unit','expiry_date']], use_container_width=True, hide_index=True)
-    else: st.info("ไม่มีข้อมูล")
-
-# --- 📉 วัสดุหมดสต๊อก ---
-elif choice == "📉 วัสดุหมดสต๊อก (Out of Stock)":
-    st.header("📉 รายงานวัสดุที่ถูกเบิกจ่ายหมดแล้ว ")
-    if not balance_df.empty:
-        out = balance_df[balance_df['Balance'] <= 0]
-        if not out.empty:
+        st.subheader("📜 ประวัติการรับ/จ่ายถังบรรจุสารเคมี")
+        export_button("📥 ดาวน์โหลดประวัติ", "chem_history", lambda: iter_range(get_db(), 'chemical_transactions'), "dl_chem")
+        # 🔥 อ่านทีละหน้าจาก DB เฉพาะคอลัมน์ที่แสดง
+        data_grid('chemical_transactions', CHEM_DISP_COLS, 'chem_hist', column_config={
+            "chem_code": "รหัสวัสดุ",
+            "qty_kg": st.column_config.NumberColumn("จำนวน (KG)", format="%.2f"),
+            "qty_l": st.column_config.NumberColumn("จำนวน (L)", format="%.2f"),
+            "department": "แผนก",
+            "requester": "ผู้เบิก",
+            "date": st.column_config.DateColumn("วันที่"),
+            "chem_desc": "คำอธิบาย"
+        })
+
+    # --- 📊 Dashboard ---
+    elif choice == "📊 Dashboard & แจ้งเตือน" and is_admin:
+        st.header("📊 Dashboard ภาพรวมสต็อก (Material)")
+        balance_df = need('balances')
+        if not balance_df.empty:
+            # 🔥 แจ้งเตือนรายล็อต (ตัดจ่ายแบบ FIFO): ล็อตที่เบิกหมดแล้วไม่ถูกแจ้ง, Balance = ของที่ยังเหลือในล็อตนั้น
+            today = get_thai_now().strftime('%Y-%m-%d')
+            yesterday = (get_thai_now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            next_30 = (get_thai_now() + timedelta(days=30)).strftime('%Y-%m-%d')
+            expired = need('lots', None, yesterday)
+            near = need('lots', today, next_30)
+            c1, c2 = st.columns(2)
+            with c1:
+                if not expired.empty: st.error(f"⛔ หมดอายุแล้ว ({len(expired)} ล็อต)"); show_df(expired[['expiry_date','item_name','Balance','unit']], hide_index=True)
+                else: st.success("✅ ไม่มีของหมดอายุ")
+            with c2:
+                if not near.empty: st.warning(f"⚠️ ใกล้หมดอายุ ({len(near)} ล็อต)"); show_df(near[['expiry_date','item_name','Balance','unit']], hide_index=True)
+                else: st.success("✅ ไม่มีของใกล้หมดอายุ")
+            st.markdown("---")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("📦 รายการวัสดุ", len(balance_df))
+            c2.metric("⚠️ สินค้าหมด", len(balance_df[balance_df['Balance']<=0]))
+            c3.metric("📅 เวลาปัจจุบัน", get_thai_now().strftime("%H:%M:%S"))
+        else: st.info("ยังไม่มีข้อมูล")
+
+    # --- 📋 วัสดุทั้งหมด ---
+    elif choice == "📋 วัสดุทั้งหมด (Overview)":
+        st.header("📋 รายการวัสดุคงเหลือทั้งหมด")
+        as_of = as_of_picker('overview')
+        if as_of: st.caption(f"📅 ยอด ณ สิ้นวันที่ {as_of} (ประเภท/หน่วย/วันหมดอายุเป็นค่าปัจจุบัน)")
+        balance_df = need('balances_as_of', as_of) if as_of else need('balances')
+        if not balance_df.empty:
+            c1, c2 = st.columns([2,1])
+            with c1: txt = st.text_input("🔍 ค้นหา:", placeholder="ชื่อ หรือ รหัส...")
+            with c2: 
+                cats = ["ทั้งหมด"] + sorted([c for c in balance_df['category'].unique() if c!='-'])
+                sel = st.selectbox("หมวดหมู่:", cats)
+            show = balance_df.copy()
+            if sel != "ทั้งหมด": show = show[show['category']==sel]
+            if txt: show = show[show.astype(str).apply(lambda x: x.str.contains(txt, case=False, na=False)).any(axis=1)]
             if is_admin:
-                csv = out.to_csv(index=False).encode('utf-8-sig')
-                st.download_button("📥 ดาวน์โหลด (CSV)", csv, "out_of_stock.csv", "text/csv", type="primary")
-            st.dataframe(out[['item_code','item_name','category','Balance','unit']], use_container_width=True, hide_index=True)
-        else: st.success("✅ เยี่ยมมาก! ไม่มีรายการวัสดุหมดสต๊อก")
-    else: st.info("ไม่มีข้อมูล")
-
-# --- 🔍 ค้นหา ---
-elif choice == "🔍 ค้นหา (Search)":
-    st.header("🔍 ค้นหาประวัติรายตัว")
-    if not df.empty:
-        txt = st.text_input("พิมพ์รหัส/ชื่อ:", key="search")
-        if txt:
-            res = df[df.astype(str).apply(lambda x: x.str.contains(txt, case=False, na=False)).any(axis=1)]
-            if not res.empty:
+                export_button("📥 ดาวน์โหลด", f"stock_overview_{as_of}" if as_of else "stock_overview", lambda: frame_chunks(show), "dl_overview", type="primary")
+            else: st.caption("ℹ️ เฉพาะ Admin เท่านั้นที่ดาวน์โหลดได้")
+            show_df(show[['item_code','item_name','category','In','Out','Balance','unit','expiry_date']], use_container_width=True, hide_index=True)
+        else: st.info("ไม่มีข้อมูล")
+
+    # --- 📉 วัสดุหมดสต๊อก ---
+    elif choice == "📉 วัสดุหมดสต๊อก (Out of Stock)":
+        st.header("📉 รายงานวัสดุที่ถูกเบิกจ่ายหมดแล้ว ")
+        balance_df = need('balances')
+        if not balance_df.empty:
+            out = balance_df[balance_df['Balance'] <= 0]
+            if not out.empty:
                 if is_admin:
-                    in_s = res[res['action_type']=='In']['quantity'].sum()
-                    out_s = res[res['action_type']=='Out']['quantity'].sum()
+                    export_button("📥 ดาวน์โหลด", "out_of_stock", lambda: frame_chunks(out), "dl_out", type="primary")
+                show_df(out[['item_code','item_name','category','Balance','unit']], use_container_width=True, hide_index=True)
+            else: st.success("✅ เยี่ยมมาก! ไม่มีรายการวัสดุหมดสต๊อก")
+        else: st.info("ไม่มีข้อมูล")
+
+    # --- 🔍 ค้นหา ---
+    elif choice == "🔍 ค้นหา (Search)":
+        st.header("🔍 ค้นหาประวัติรายตัว")
+        c1, c2 = st.columns([3, 1])
+        with c1: txt = st.text_input("พิมพ์รหัส/ชื่อ:", key="search").strip()
+        with c2: page = st.number_input("หน้า:", min_value=1, value=1, step=1)
+        if txt:
+            if is_admin:
+                res, total, in_s, out_s = search_transactions(get_db(), txt, page, PAGE_SIZE)
+                if total:
                     st.markdown(f"**สรุป:** รับ {in_s:,.2f} | จ่าย {out_s:,.2f} | คงเหลือ {in_s-out_s:,.2f}")
-                    st.dataframe(res, use_container_width=True, hide_index=True)
-                else:
-                    summary = calculate_inventory(res)
+                    st.caption(f"พบ {total:,} รายการ (หน้า {page}/{-(-total // PAGE_SIZE)})")
+                    show_df(res, use_container_width=True, hide_index=True)
+                else: st.warning("ไม่พบ")
+                # 🔥 รายการที่ Archive ไปแล้วไม่อยู่ใน SQLite (ในตารางด้านบนเห็นเป็นแถว "ยอดยกมา") ค้นในไฟล์เมื่อขอเท่านั้น
+                if st.checkbox("ค้นหาในข้อมูลเก่าที่เก็บถาวร (Archive) ด้วย"):
+                    old = search_archive(get_db(), txt, PAGE_SIZE)
+                    st.caption(f"พบใน Archive {len(old):,} รายการ (แสดงไม่เกิน {PAGE_SIZE} รายการล่าสุด)")
+                    if not old.empty: show_df(old, use_container_width=True, hide_index=True)
+            else:
+                summary, total = search_balances(get_db(), txt, page, PAGE_SIZE)
+                if total:
+                    st.caption(f"พบ {total:,} รายการ (หน้า {page}/{-(-total // PAGE_SIZE)})")
                     for i, r in summary.iterrows():
                         st.markdown(f"**{r['item_name']}** (Code: {r['item_code']})")
                         st.write(f"คงเหลือ: {r['Balance']:,.2f} {r['unit']}")
                         st.divider()
-            else: st.warning("ไม่พบ")
-    else: st.info("ไม่มีข้อมูล")
-
-# --- 📅 รายงานประจำวัน ---
-elif choice == "📅 รายงานประจำวัน (Daily)" and is_admin:
-    st.header("📅 รายงานประจำวัน (แยกประเภท)")
-    date = st.date_input("เลือกวันที่:", get_thai_now()).strftime('%Y-%m-%d')
-    
-    # 🔥 แยก Tabs ตามที่ขอ
-    tab1, tab2 = st.tabs(["📦 วัสดุ (Material)", "🧪 ถังบรรจุสารเคมี (Chemical Tank)"])
-    
-    # Tab 1: Material
-    with tab1:
-        if not df.empty:
-            daily_mat = df[df['date'] == date]
+                else: st.warning("ไม่พบ")
+
+    # --- 📅 รายงานประจำวัน ---
+    elif choice == "📅 รายงานประจำวัน (Daily)" and is_admin:
+        st.header("📅 รายงานประจำวัน (แยกประเภท)")
+        c_mode, c_date = st.columns([1, 2])
+        mode = c_mode.radio("ช่วงเวลา:", ["รายวัน", "รายสัปดาห์", "รายเดือน", "กำหนดเอง"])
+        if mode == "กำหนดเอง":
+            picked = c_date.date_input("เลือกช่วงวันที่:", (get_thai_now() - timedelta(days=6), get_thai_now()))
+        else: picked = c_date.date_input("เลือกวันที่:", get_thai_now())
+        start, end = get_date_range(mode, picked, get_thai_now().date())
+        st.caption(f"แสดงข้อมูลวันที่: {start}" if start == end else f"แสดงข้อมูลวันที่: {start} ถึง {end}")
+
+        # 🔥 แยก Tabs ตามที่ขอ
+        tab1, tab2 = st.tabs(["📦 วัสดุ (Material)", "🧪 ถังบรรจุสารเคมี (Chemical Tank)"])
+
+        # Tab 1: Material
+        with tab1:
+            daily_mat = load_report('transactions', start, end)
             if not daily_mat.empty:
                 # 🔥 เลือกคอลัมน์ (ตัด ID ออก)
                 cols_mat = ['date', 'item_code', 'item_name', 'action_type', 'quantity', 'unit', 'department', 'requester', 'remark']
-                st.dataframe(daily_mat[cols_mat], use_container_width=True, hide_index=True,
+                show_df(daily_mat[cols_mat], use_container_width=True, hide_index=True,
                              column_config={"date": st.column_config.DateColumn("วันที่")})
-            else: st.info("ไม่มีรายการวัสดุวันนี้")
-        else: st.info("ไม่มีข้อมูลในระบบ")
+            else: st.info("ไม่มีรายการวัสดุในช่วงเวลานี้")
 
-    # Tab 2: Chemical Tank
-    with tab2:
-        if not chem_df.empty:
-            daily_chem = chem_df[chem_df['date'] == date]
+        # Tab 2: Chemical Tank
+        with tab2:
+            daily_chem = load_report('chemical_transactions', start, end)
             if not daily_chem.empty:
                 # 🔥 เลือกคอลัมน์ (ตัด ID และ Remark ออก)
                 cols_chem = ['date', 'chem_code', 'chem_desc', 'action_type', 'qty_kg', 'qty_l', 'department', 'requester']
-                st.dataframe(
+                show_df(
                     daily_chem[cols_chem],
                     use_container_width=True, hide_index=True,
                     column_config={
@@ -427,101 +493,135 @@ elif choice == "📅 รายงานประจำวัน (Daily)" and is_
                         "date": st.column_config.DateColumn("วันที่")
                     }
                 )
-            else: st.info("ไม่มีรายการถังบรรจุสารเคมีวันนี้")
-        else: st.info("ไม่มีข้อมูลในระบบ")
-
-# --- 📥 รับเข้า (In) ---
-elif choice == "📥 รับเข้า (In)" and is_admin:
-    st.header("📥 รับเข้า (Multi-Sheet)")
-    st.info("💡 ไฟล์ Excel ต้องมี Sheet ชื่อ 'Material' หรือ 'Chemical Tank'")
-    f = st.file_uploader("Upload ไฟล์ (In)", type=['xlsx'], key='in')
-    if f:
-        xls = pd.ExcelFile(f)
-        sheet_names = xls.sheet_names
-        st.write(f"📂 พบ Sheet: {sheet_names}")
-        
-        # 1. Material
-        if 'Material' in sheet_names:
-            st.subheader("📦 พบข้อมูล Material")
-            d_mat = pd.read_excel(f, sheet_name='Material')
-            cmap = {'วันที่รับเข้า':'date', 'รหัสวัสดุ':'item_code', 'คำอธิบาย':'item_name', 
-                    'จำนวน':'quantity', 'หน่วย':'unit', 'วันที่หมดอายุ':'expiry_date', 
-                    'ประเภทวัสดุ':'category', 'หมายเหตุ':'remark'}
-            d_mat = d_mat.rename(columns=cmap)
-            st.dataframe(d_mat.head(3))
-            if st.button("✅ บันทึก Material", key="btn_mat_in"):
-                req = ['date','item_code','item_name','quantity','unit','expiry_date','category','remark']
-                for c in req: 
-                    if c not in d_mat.columns: d_mat[c] = None
-                save_to_db(d_mat[req], 'In')
-        
-        # 2. Chemical Tank
-        if 'Chemical Tank' in sheet_names:
-            st.subheader("🧪 พบข้อมูล Chemical Tank")
-            d_chem = pd.read_excel(f, sheet_name='Chemical Tank')
-            # Mapping รับเข้า + คำอธิบาย
-            cmap_chem = {'วันที่รับเข้า':'date', 'รหัสวัสดุ':'r_code', 'คำอธิบาย':'chem_desc', 'จำนวน':'qty_kg'}
-            d_chem = d_chem.rename(columns=cmap_chem)
-            st.dataframe(d_chem.head(3))
-            if st.button("✅ บันทึก Chemical", key="btn_chem_in"):
-                save_chem_batch(d_chem, 'In')
-
-# --- 📤 เบิกออก (Out) ---
-elif choice == "📤 เบิกออก (Out)" and is_admin:
-    st.header("📤 เบิกออก (Multi-Sheet)")
-    st.info("💡 ไฟล์ Excel ต้องมี Sheet ชื่อ 'Material' หรือ 'Chemical Tank'")
-    f = st.file_uploader("Upload ไฟล์ (Out)", type=['xlsx'], key='out')
-    if f:
-        xls = pd.ExcelFile(f)
-        sheet_names = xls.sheet_names
-        
-        # 1. Material
-        if 'Material' in sheet_names:
-            st.subheader("📦 พบข้อมูล Material (เบิกออก)")
-            d_mat = pd.read_excel(f, sheet_name='Material')
-            cmap = {'วันที่เบิกจ่าย':'date', 'รหัสวัสดุ':'item_code', 'คำอธิบาย':'item_name', 
-                    'จำนวนที่เบิก':'quantity', 'หน่วย':'unit', 'หน่วยงานที่เบิก':'department', 
-                    'ผู้ที่ทำการเบิก':'requester', 'ประเภทวัสดุ':'category', 'หมายเหตุ':'remark'}
-            d_mat = d_mat.rename(columns=cmap)
-            st.dataframe(d_mat.head(3))
-            if st.button("✅ บันทึก Material (Out)", key="btn_mat_out"):
-                req = ['date','item_code','item_name','quantity','unit','department','requester','category','remark']
-                for c in req: 
-                    if c not in d_mat.columns: d_mat[c] = None
-                save_to_db(d_mat[req], 'Out')
-        
-        # 2. Chemical Tank
-        if 'Chemical Tank' in sheet_names:
-            st.subheader("🧪 พบข้อมูล Chemical Tank (เบิกออก)")
-            d_chem = pd.read_excel(f, sheet_name='Chemical Tank')
-            # Mapping เบิกออก + คำอธิบาย
-            cmap_chem = {
-                'วันที่เบิกจ่าย':'date', 'รหัสวัสดุ':'r_code', 'คำอธิบาย':'chem_desc', 'จำนวนที่เบิก':'qty_kg', 
-                'หน่วยงานที่เบิก':'department', 'ผู้ที่ทำการเบิก':'requester'
-            }
-            d_chem = d_chem.rename(columns=cmap_chem)
-            st.dataframe(d_chem.head(3))
-            if st.button("✅ บันทึก Chemical (Out)", key="btn_chem_out"):
-                save_chem_batch(d_chem, 'Out')
-
-# --- 🔧 จัดการข้อมูล ---
-elif choice == "🔧 จัดการข้อมูล" and is_admin:
-    st.header("🔧 จัดการข้อมูล")
-    if not df.empty or not chem_df.empty:
-        t1, t2 = st.tabs(["ลบรอบอัปโหลด", "ลบรายรายการ"])
+            else: st.info("ไม่มีรายการถังบรรจุสารเคมีในช่วงเวลานี้")
+
+    # --- 📥 รับเข้า (In) ---
+    elif choice == "📥 รับเข้า (In)" and is_admin:
+        st.header("📥 รับเข้า (Multi-Sheet)")
+        st.info("💡 ไฟล์ Excel ต้องมี Sheet ชื่อ 'Material' หรือ 'Chemical Tank'")
+        f = st.file_uploader("Upload ไฟล์ (In)", type=['xlsx'], key='in')
+        if f:
+            data = f.getvalue(); digest = file_digest(data)
+            sheets = inspect_upload(digest, data)
+            sheet_names = list(sheets)
+            st.write(f"📂 พบ Sheet: {sheet_names}")
+
+            # 1. Material
+            if 'Material' in sheet_names:
+                st.subheader("📦 พบข้อมูล Material")
+                cmap = MATERIAL_COLUMNS['In'][0]
+                preview, rows = sheets['Material']
+                show_df(preview.rename(columns=cmap))
+                if upload_guard(digest, 'Material', 'In', 'mat_in') and st.button("✅ บันทึก Material", key="btn_mat_in"):
+                    queue_upload('material', 'In', data, digest, 'Material', rows)
+
+            # 2. Chemical Tank
+            if 'Chemical Tank' in sheet_names:
+                st.subheader("🧪 พบข้อมูล Chemical Tank")
+                # Mapping รับเข้า + คำอธิบาย (ชุดเดียวกับ CLI)
+                cmap_chem = CHEM_COLUMNS['In']
+                preview, rows = sheets['Chemical Tank']
+                show_df(preview.rename(columns=cmap_chem))
+                if upload_guard(digest, 'Chemical Tank', 'In', 'chem_in') and st.button("✅ บันทึก Chemical", key="btn_chem_in"):
+                    queue_upload('chemical', 'In', data, digest, 'Chemical Tank', rows)
+        job_panel()
+
+    # --- 📤 เบิกออก (Out) ---
+    elif choice == "📤 เบิกออก (Out)" and is_admin:
+        st.header("📤 เบิกออก (Multi-Sheet)")
+        st.info("💡 ไฟล์ Excel ต้องมี Sheet ชื่อ 'Material' หรือ 'Chemical Tank'")
+        f = st.file_uploader("Upload ไฟล์ (Out)", type=['xlsx'], key='out')
+        if f:
+            data = f.getvalue(); digest = file_digest(data)
+            sheets = inspect_upload(digest, data)
+            sheet_names = list(sheets)
+
+            # 1. Material
+            if 'Material' in sheet_names:
+                st.subheader("📦 พบข้อมูล Material (เบิกออก)")
+                cmap = MATERIAL_COLUMNS['Out'][0]
+                preview, rows = sheets['Material']
+                show_df(preview.rename(columns=cmap))
+                if upload_guard(digest, 'Material', 'Out', 'mat_out') and st.button("✅ บันทึก Material (Out)", key="btn_mat_out"):
+                    queue_upload('material', 'Out', data, digest, 'Material', rows)
+
+            # 2. Chemical Tank
+            if 'Chemical Tank' in sheet_names:
+                st.subheader("🧪 พบข้อมูล Chemical Tank (เบิกออก)")
+                # Mapping เบิกออก + คำอธิบาย (ชุดเดียวกับ CLI)
+                cmap_chem = CHEM_COLUMNS['Out']
+                preview, rows = sheets['Chemical Tank']
+                show_df(preview.rename(columns=cmap_chem))
+                if upload_guard(digest, 'Chemical Tank', 'Out', 'chem_out') and st.button("✅ บันทึก Chemical (Out)", key="btn_chem_out"):
+                    queue_upload('chemical', 'Out', data, digest, 'Chemical Tank', rows)
+        job_panel()
+
+    # --- 🔧 จัดการข้อมูล ---
+    elif choice == "🔧 จัดการข้อมูล" and is_admin:
+        st.header("🔧 จัดการข้อมูล")
+        t1, t2, t3, t4, t5 = st.tabs(["ลบรอบอัปโหลด", "ลบรายรายการ", "ตรวจสอบยอดคงเหลือ", "เก็บถาวร (Archive)", "รวมรายการวัสดุ"])
         with t1:
-            times1 = df['upload_time'].unique().tolist() if 'upload_time' in df else []
-            times2 = chem_df['upload_time'].unique().tolist() if 'upload_time' in chem_df else []
-            all_times = sorted(list(set(times1 + times2)), reverse=True)
-            sel = st.selectbox("เลือกรอบเวลา:", all_times)
-            if st.button("🗑️ ลบข้อมูลรอบนี้"): delete_batch(sel); st.rerun()
+            # 🔥 รอบอัปโหลดจากตาราง upload_batches (1 รอบต่อไฟล์/Sheet, แถวยอดยกมาของ Archive ไม่ใช่รอบอัปโหลด)
+            batches = list_batches(get_db()).set_index('id')
+            if not batches.empty:
+                names = {'transactions': 'Material', 'chemical_transactions': 'Chemical'}
+                sel = st.selectbox("เลือกรอบอัปโหลด:", batches.index.tolist(), format_func=lambda b: " | ".join([
+                    f"#{b}", str(batches.at[b, 'upload_time']), f"{names.get(batches.at[b, 'tbl'], '')} {batches.at[b, 'action_type']}",
+                    f"{batches.at[b, 'rows']:,} แถว", str(batches.at[b, 'sheet'] or '-'), str(batches.at[b, 'uploaded_by'] or '-')]))
+                if st.button("🗑️ ลบข้อมูลรอบนี้"): remove_batch(sel); st.rerun()
+            else: st.info("ยังไม่มีรอบอัปโหลด")
         with t2:
             table_sel = st.radio("เลือกตาราง:", ["Material", "Chemical"])
-            if table_sel == "Material":
-                st.dataframe(df)
-                ids = st.multiselect("Select ID:", df['id'])
-                if st.button("ลบ Material"): delete_data(ids, 'transactions'); st.rerun()
-            else:
-                st.dataframe(chem_df)
-                ids = st.multiselect("Select ID:", chem_df['id'])
-                if st.button("ลบ Chemical"): delete_data(ids, 'chemical_transactions'); st.rerun()
\ No newline at end of file
+            table, cols = ('transactions', MANAGE_COLS) if table_sel == "Material" else ('chemical_transactions', CHEM_MANAGE_COLS)
+            ids, filters, total = data_grid(table, cols, f"grid_{table}", selectable=True)
+            if st.button(f"🗑️ ลบแถวที่เลือก ({len(ids)})", key=f"del_{table}", disabled=not ids): remove_rows(ids, table); st.rerun()
+            # 🔥 ลบทั้งหมดที่ตรงกับตัวกรองด้วยคำสั่งเดียวฝั่ง DB (ต้องมีตัวกรองและติ๊กยืนยันก่อน)
+            if total and any(filters.values()) and st.checkbox(f"ยืนยันลบทั้ง {total:,} แถวที่ตรงกับตัวกรอง", key=f"del_all_ok_{table}"):
+                if st.button("🗑️ ลบทั้งหมดที่ตรงกับตัวกรอง", key=f"del_all_{table}"): remove_matching(table, filters); st.rerun()
+        with t3:
+            st.caption("สร้างตาราง item_balances ใหม่จากประวัติทั้งหมด และตรวจสอบว่ายอดที่เก็บไว้ตรงกับประวัติหรือไม่")
+            if st.button("🔁 Rebuild ยอดคงเหลือ"):
+                drift = rebuild_item_balances(get_db())
+                if drift.empty: st.success("✅ ยอดคงเหลือตรงกับประวัติทั้งหมด")
+                else: st.warning(f"⚠️ พบยอดไม่ตรง {len(drift)} แถว (แก้ไขแล้ว)"); show_df(drift, hide_index=True)
+        with t4:
+            st.caption("ย้ายรายการเก่าไปเก็บเป็นไฟล์ Parquet รายเดือน แล้วแทนด้วยแถว 'ยอดยกมา' ต่อวัสดุ/ถัง ยอดคงเหลือไม่เปลี่ยน รายงานย้อนหลังยังอ่านได้ตามปกติ")
+            summary = archive_summary(get_db())
+            if not summary.empty: show_df(summary, hide_index=True)
+            months = st.number_input("เก็บไว้ในฐานข้อมูลกี่เดือนล่าสุด:", min_value=1, value=ARCHIVE_KEEP_MONTHS, step=1)
+            cutoff = cutoff_for(int(months), get_thai_now().date())
+            preview = archive_preview(get_db(), cutoff)
+            st.write(f"รายการก่อน {cutoff}: " + " | ".join(f"{t} {n:,} แถว" for t, n in preview.items()))
+            if any(preview.values()) and st.button("📦 ย้ายไป Archive"):
+                with st.spinner("กำลังเขียนไฟล์ Archive..."): moved = archive_before(get_db(), cutoff, get_thai_now())
+                st.success(f"✅ ย้าย {sum(moved.values()):,} แถวไป Archive แล้ว"); st.cache_data.clear(); st.rerun()
+        with t5:
+            st.caption("วัสดุเดียวกันที่ชื่อสะกดต่างกัน (รหัสเดียวกันถูกรวมให้อัตโนมัติตอนนำเข้า) เลือกรายการหลัก แล้วเลือกรายการที่จะรวมเข้าไป")
+            items = read_items(get_db()).set_index('item_id')
+            if not items.empty:
+                label = lambda i: f"#{i} | {items.at[i, 'item_code']} | {items.at[i, 'item_name']} | คงเหลือ {items.at[i, 'balance']:,.2f} | {items.at[i, 'aliases']} ชื่อเรียก"
+                keep = st.selectbox("รายการหลัก:", items.index.tolist(), format_func=label, key="merge_keep")
+                others = st.multiselect("รวมรายการเหล่านี้เข้ารายการหลัก:", [i for i in items.index if i != keep], format_func=label, key="merge_others")
+                if st.button("🔗 รวมรายการ", disabled=not others): merge_selected(keep, others); st.rerun()
+            else: st.info("ยังไม่มีวัสดุ")
+except Exception as e:
+    error = e
+    raise
+finally:
+    # 🔥 Rerun ที่ออกกลางทาง (rerun/stop/error) ยังลง Log ถ้าช้า, Rerun ที่ error ลง Log เสมอ แล้วคืน Connection อ่านเข้า Pool
+    total = prof.finish(choice, error)
+    get_db().release_reader()
+
+# 🔥 สถิติ Cache + หน่วยความจำ + เวลาแต่ละขั้นตอนของรอบนี้ (แสดงท้ายสุดเพื่อให้นับครบทุก Loader ของหน้า)
+if is_admin:
+    stats = get_frame_cache().stats()
+    st.sidebar.caption(f"🗄️ Cache: hit {stats['hits']:,} | miss {stats['misses']:,} | {stats['entries']} ชุด ({stats['mb']:.1f} MB)")
+    if page_data: st.sidebar.caption("📦 ชุดข้อมูลที่หน้านี้โหลด: " + ", ".join(page_data))
+    if page_frames:
+        now, raw = memory_report(page_frames)
+        st.sidebar.caption(f"🧮 ข้อมูลหน้านี้ {now / 1048576:.1f} MB (ก่อนแปลงชนิด {raw / 1048576:.1f} MB)")
+    now, raw = memory_report(get_frame_cache().frames())
+    st.sidebar.caption(f"🧮 ข้อมูลใน Cache {now / 1048576:.1f} MB (ก่อนแปลงชนิด {raw / 1048576:.1f} MB)")
+    with st.sidebar.expander(f"⏱️ Rerun ล่าสุด {total * 1000:,.0f} ms"):
+        st.dataframe(prof.table(), hide_index=True, column_config={"ms": st.column_config.NumberColumn(format="%.1f")})
+        st.caption(f"งานที่ใช้เวลาเกิน {SLOW_MS:,} ms ถูกบันทึกที่ {SLOW_LOG}")
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from inventory_core import Database, init_db
+from inventory_core.ingest import MATERIAL_COLUMNS, insert_materials
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'inventory.db'))
+    init_db(db)
+    return db
+
+
+def materials(action_type, rows, start=2):
+    """DataFrame แบบที่ read_file_chunks คืน จาก [(วันที่, รหัส, ชื่อ, จำนวน[, วันหมดอายุ]), ...] (index = เลขแถวในไฟล์)"""
+    columns = MATERIAL_COLUMNS[action_type][1]
+    df = pd.DataFrame([tuple(r) + (None,) * (5 - len(r)) for r in rows], index=range(start, start + len(rows)),
+                      columns=['date', 'item_code', 'item_name', 'quantity', 'expiry_date'])
+    return df.assign(unit='ชิ้น').reindex(columns=columns)
+
+
+def add(db, action_type, rows):
+    """บันทึกรายการผ่าน insert_materials (ต้องผ่านการตรวจทุกแถว) คืน batch_id ของรอบ"""
+    report = insert_materials(db, materials(action_type, rows), action_type)
+    assert report['invalid'].empty, report['invalid']
+    return db.reader().execute("SELECT MAX(id) FROM upload_batches").fetchone()[0]
+
+
+def recalculated(db, day=None):
+    """ยอดคงเหลือต่อรหัสวัสดุจากการรวม transactions ทุกแถวใหม่ (ถึงสิ้นวัน day) {รหัส: (รับ, จ่าย)} สำหรับเทียบกับผลของ Checkpoint"""
+    rows = db.reader().execute('''
+        SELECT i.item_code, TOTAL(CASE WHEN t.action_type = 'In' THEN t.quantity END), TOTAL(CASE WHEN t.action_type = 'Out' THEN t.quantity END)
+        FROM transactions t JOIN items i ON i.id = t.item_id WHERE t.date <= ? GROUP BY i.item_code
+    ''', (day or '9999-12-31',))
+    return {code: (qty_in, qty_out) for code, qty_in, qty_out in rows}
+
+
+def as_of(df):
+    """ผลของ balances_as_of / read_balances -> {รหัส: (รับ, จ่าย)}"""
+    return {code: (qty_in, qty_out) for code, qty_in, qty_out in df[['item_code', 'In', 'Out']].itertuples(index=False, name=None)}
+
+
+def stock(db, code):
+    """ยอดคงเหลือใน item_balances ของรหัสวัสดุ (None = ไม่มีแถว)"""
+    row = db.reader().execute("SELECT b.balance FROM item_balances b JOIN items i ON i.id = b.item_id WHERE i.item_code = ?",
+                              (code,)).fetchone()
+    return row and row[0]
@@ -0,0 +1,61 @@
+"""ทดสอบการย้ายเดือนเก่าไป Archive พร้อมแถวยอดยกมา (inventory_core.archive)"""
+import pandas as pd
+
+from inventory_core import archive_before, balances_as_of, expiring_lots, read_balances, read_chem_levels
+from inventory_core.archive import ARCHIVE_BATCH
+from inventory_core.ingest import insert_chemicals
+
+from .conftest import add, as_of
+
+DAYS = ['2024-01-20', '2024-02-10', '2024-02-29', '2024-03-01', '2024-03-15', '2024-04-30']
+
+
+def seed(db):
+    add(db, 'In', [
+        ('2024-01-03', 'A-1', 'ยา', 10, '2024-12-31'),
+        ('2024-01-10', 'A-1', 'ยา', 6, '2025-06-30'),
+        ('2024-01-12', 'B-2', 'ถุงมือ', 5),
+        ('2024-02-05', 'C-3', 'สำลี', 4),
+        ('2024-03-04', 'A-1', 'ยา', 3, '2025-12-31'),
+    ])
+    add(db, 'Out', [
+        ('2024-01-15', 'A-1', 'ยา', 12),
+        ('2024-02-20', 'B-2', 'ถุงมือ', 5),  # ใช้หมด: ไม่มีแถวยอดยกมาที่เป็น 0
+        ('2024-04-01', 'A-1', 'ยา', 1),
+    ])
+    insert_chemicals(db, pd.DataFrame([['2024-01-05', 'T11-1001', '', 500], ['2024-03-05', 'T11-1001', '', 100]],
+                                      columns=['date', 'r_code', 'chem_desc', 'qty_kg']), 'In')
+    insert_chemicals(db, pd.DataFrame([['2024-02-05', 'T11-1001', '', 200]], columns=['date', 'r_code', 'chem_desc', 'qty_kg']), 'Out')
+
+
+def snapshot(db):
+    return {'balances': as_of(read_balances(db)), 'lots': expiring_lots(db).drop(columns='receipt_id').to_dict('records'),
+            'as_of': {day: as_of(balances_as_of(db, day)) for day in DAYS}, 'chem': read_chem_levels(db)}
+
+
+def carry_rows(db, table):
+    return db.reader().execute(f"SELECT COUNT(*), TOTAL(quantity = 0) FROM {table} WHERE upload_time LIKE '{ARCHIVE_BATCH} %'"
+                               if table == 'transactions' else
+                               f"SELECT COUNT(*), TOTAL(qty_kg = 0) FROM {table} WHERE upload_time LIKE '{ARCHIVE_BATCH} %'").fetchone()
+
+
+def test_balances_unchanged_by_archive(db):
+    seed(db)
+    before = snapshot(db)
+    assert archive_before(db, '2024-03-01') == {'transactions': 6, 'chemical_transactions': 2}
+    assert db.reader().execute("SELECT MIN(date) FROM transactions WHERE upload_time NOT LIKE 'ARCHIVE %'").fetchone()[0] == '2024-03-04'
+    count, zeros = carry_rows(db, 'transactions')
+    assert count > 0 and zeros == 0
+    assert carry_rows(db, 'chemical_transactions') == (2, 0)
+    assert snapshot(db) == before
+
+
+def test_second_archive_folds_previous_carry_rows(db):
+    seed(db)
+    before = snapshot(db)
+    archive_before(db, '2024-02-01')
+    archive_before(db, '2024-04-01')
+    assert snapshot(db) == before
+    assert carry_rows(db, 'transactions')[1] == 0
+    periods = db.reader().execute("SELECT tbl, month FROM archive_periods WHERE tbl = 'transactions' ORDER BY month").fetchall()
+    assert [m for _, m in periods] == ['2024-01', '2024-02', '2024-03']
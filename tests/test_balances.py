@@ -0,0 +1,58 @@
+"""ทดสอบ Checkpoint รายเดือนและยอด ณ วันที่ (inventory_core.balances / queries.balances_as_of)"""
+from inventory_core import Database, balances_as_of, build_checkpoints, delete_data, invalidate_checkpoints
+
+from .conftest import add, as_of, recalculated
+
+DAYS = ['2024-01-01', '2024-01-15', '2024-01-31', '2024-02-01', '2024-02-29', '2024-03-10', '2024-04-30', '2024-06-01']
+
+
+def seed(db):
+    add(db, 'In', [('2024-01-03', 'A-1', 'ถุงมือ', 100), ('2024-01-20', 'B-2', 'หน้ากาก', 40), ('2024-02-01', 'A-1', 'ถุงมือ', 30)])
+    add(db, 'Out', [('2024-01-31', 'A-1', 'ถุงมือ', 25), ('2024-02-15', 'B-2', 'หน้ากาก', 10), ('2024-04-02', 'A-1', 'ถุงมือ', 50)])
+
+
+def months(db):
+    return [m for (m,) in db.reader().execute("SELECT month FROM checkpoint_months WHERE month < '2024-07-01' ORDER BY month")]
+
+
+def test_import_builds_chained_checkpoints(db):
+    seed(db)
+    assert months(db) == ['2024-02-01', '2024-03-01', '2024-04-01', '2024-05-01', '2024-06-01']
+    for month in months(db):
+        stored = {code: (qty_in, qty_out) for code, qty_in, qty_out in db.reader().execute('''
+            SELECT i.item_code, c.qty_in, c.qty_out FROM balance_checkpoints c JOIN items i ON i.id = c.item_id WHERE c.month = ?
+        ''', (month,))}
+        day_before = recalculated(db, f"{month[:8]}00")  # '...-00' < วันแรกของเดือน = ทุกรายการก่อนเดือนนั้น
+        assert stored == day_before
+
+
+def test_balance_as_of_matches_full_recalculation(db):
+    seed(db)
+    for day in DAYS:
+        assert as_of(balances_as_of(db, day)) == recalculated(db, day), day
+
+
+def test_backdated_insert_and_delete_rebuild_later_months(db):
+    seed(db)
+    add(db, 'In', [('2024-01-10', 'B-2', 'หน้ากาก', 7)])
+    for day in DAYS:
+        assert as_of(balances_as_of(db, day)) == recalculated(db, day), day
+    first = db.reader().execute("SELECT MIN(id) FROM transactions").fetchone()[0]
+    delete_data(db, [first])
+    assert months(db)[0] == '2024-02-01'
+    for day in DAYS:
+        assert as_of(balances_as_of(db, day)) == recalculated(db, day), day
+
+
+def test_missing_checkpoints_fall_back_to_nearest_earlier_month(db, tmp_path):
+    seed(db)
+    with db.write() as conn:
+        invalidate_checkpoints(conn, '2024-02-10')
+    assert months(db) == ['2024-02-01']
+    reader = Database(db.path, read_only=True)
+    for day in DAYS:
+        assert as_of(balances_as_of(reader, day)) == recalculated(db, day), day
+    assert months(db) == ['2024-02-01']  # ฝั่งอ่านไม่สร้าง Checkpoint เอง
+    with db.write() as conn:
+        assert build_checkpoints(conn, today='2024-06-15') == 4
+    assert months(db) == ['2024-02-01', '2024-03-01', '2024-04-01', '2024-05-01', '2024-06-01']
@@ -0,0 +1,30 @@
+"""ทดสอบการนำเข้าสารเคมี (inventory_core.chemicals / ingest.insert_chemicals)"""
+import pandas as pd
+
+from inventory_core import ingest
+from inventory_core.ingest import insert_chemicals
+
+
+def chemicals(rows):
+    return pd.DataFrame(rows, columns=['date', 'r_code', 'chem_desc', 'qty_kg'], index=range(2, 2 + len(rows)))
+
+
+def stored_dates(db):
+    return [d for (d,) in db.reader().execute("SELECT date FROM chemical_transactions ORDER BY id")]
+
+
+def test_chemical_upload_parses_dates_like_materials(db):
+    report = insert_chemicals(db, chemicals([
+        ['2569-01-05', 'T11-1001', '', 100],
+        ['01/05/2024', 'T11-1001', '', 100],
+        ['5 ม.ค.', 'T11-1001', '', 100],
+    ]), 'In')
+    assert report['inserted'] == 2
+    assert stored_dates(db) == ['2026-01-05', '2024-01-05']
+    assert report['invalid'].to_dict('records') == [{'row': 4, 'reason': 'วันที่ไม่ถูกต้อง'}]
+
+
+def test_chemical_upload_follows_day_first(db, monkeypatch):
+    monkeypatch.setattr(ingest, 'DAY_FIRST', True)
+    insert_chemicals(db, chemicals([['01/05/2024', 'T11-1001', '', 100]]), 'In')
+    assert stored_dates(db) == ['2024-05-01']
@@ -0,0 +1,19 @@
+"""ทดสอบ Pool ของ Connection อ่าน (inventory_core.db)"""
+import threading
+
+from inventory_core import Database
+
+
+def test_release_reader_returns_connection_for_next_rerun(tmp_path):
+    db = Database(str(tmp_path / 'inventory.db'))
+    first = db.reader()
+    assert db.reader() is first  # ทั้ง Rerun ใช้ Connection เดิม
+    db.release_reader()
+    db.release_reader()  # เรียกซ้ำได้
+    assert db.idle == [first]
+    seen = []
+    worker = threading.Thread(target=lambda: (seen.append(db.reader()), db.release_reader()))
+    worker.start()
+    worker.join()
+    assert seen == [first]
+    assert db.idle == [first]
@@ -0,0 +1,25 @@
+"""ทดสอบการแปลงชนิดคอลัมน์ (inventory_core.frames) และรายงานหน่วยความจำของ Cache"""
+import pandas as pd
+
+from inventory_core import FrameCache, compact_frame, memory_report
+
+
+def test_non_iso_dates_are_parsed_not_blanked():
+    df = compact_frame(pd.DataFrame({'date': ['2024-01-05', '01/05/2024', '2567-02-01 00:00:00', None, '']}))
+    assert df['date'].dt.strftime('%Y-%m-%d').tolist()[:3] == ['2024-01-05', '2024-01-05', '2024-02-01']
+    assert df['date'].isna().tolist()[3:] == [True, True]
+
+
+def test_unparseable_dates_keep_original_text():
+    df = compact_frame(pd.DataFrame({'expiry_date': ['2024-01-05', 'ไม่มีวันหมดอายุ']}))
+    assert df['expiry_date'].tolist() == ['2024-01-05', 'ไม่มีวันหมดอายุ']
+
+
+def test_memory_report_covers_cached_frames_once():
+    cache = FrameCache(1 << 30)
+    frame = compact_frame(pd.DataFrame({'unit': ['กล่อง'] * 1000, 'quantity': [1.0] * 1000}))
+    cache.get('balances', 1, lambda: frame)
+    cache.get('levels', 1, lambda: {'T1': 1.0})
+    now, raw = memory_report(cache.frames() + [frame])
+    assert cache.frames() == [frame]
+    assert 0 < now < raw == frame.attrs['raw_bytes']
@@ -0,0 +1,96 @@
+"""ทดสอบการอ่านไฟล์และตรวจแถวก่อนนำเข้า (inventory_core.ingest)"""
+import openpyxl
+import pandas as pd
+
+from inventory_core.ingest import MATERIAL_COLUMNS, insert_materials, parse_dates, read_file_chunks, validate_materials
+
+from .conftest import materials, stock
+
+HEADER = ['วันที่รับเข้า', 'รหัสวัสดุ', 'คำอธิบาย', 'จำนวน', 'หน่วย']
+
+
+def write_sheet(path, rows):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    for r in rows:
+        ws.append(r)
+    wb.save(path)
+
+
+def read_in(path, size=1000):
+    cmap, columns = MATERIAL_COLUMNS['In']
+    return list(read_file_chunks(path, cmap, columns, size))
+
+
+def test_blank_row_keeps_excel_row_numbers(tmp_path):
+    path = tmp_path / 'in.xlsx'
+    write_sheet(path, [
+        ['2024-01-05', 'A-1', 'ถุงมือ', 10, 'กล่อง'],
+        [None, None, None, None, None],
+        ['2024-01-06', 'A-2', 'หน้ากาก', 'abc', 'กล่อง'],
+    ])
+    chunk, = read_in(path)
+    assert list(chunk.index) == [2, 4]
+    clean, bad = validate_materials(chunk, 'In', '2024-01-07 00:00:00')
+    assert list(clean.index) == [2]
+    assert bad.to_dict('records') == [{'row': 4, 'reason': 'จำนวนไม่ใช่ตัวเลข'}]
+
+
+def test_row_numbers_continue_across_chunks(tmp_path):
+    path = tmp_path / 'in.xlsx'
+    write_sheet(path, [
+        ['2024-01-05', 'A-1', 'ถุงมือ', 1, 'กล่อง'],
+        [None, None, None, None, None],
+        ['2024-01-05', 'A-1', 'ถุงมือ', 2, 'กล่อง'],
+        ['bad date', 'A-1', 'ถุงมือ', 3, 'กล่อง'],
+    ])
+    chunks = read_in(path, size=2)
+    assert [list(c.index) for c in chunks] == [[2, 4], [5]]
+    assert validate_materials(chunks[1], 'In', '2024-01-07 00:00:00')[1]['row'].tolist() == [5]
+
+
+def test_csv_rows_count_header_as_row_one(tmp_path):
+    path = tmp_path / 'in.csv'
+    pd.DataFrame([['2024-01-05', 'A-1', 'ถุงมือ', 'x', 'กล่อง']], columns=HEADER).to_csv(path, index=False)
+    chunk, = read_in(path)
+    assert validate_materials(chunk, 'In', '2024-01-07 00:00:00')[1]['row'].tolist() == [2]
+
+
+def test_slash_dates_are_month_first_by_default():
+    col = pd.Series(['01/05/2024', '13/05/2024', '2024-01-05'])
+    assert parse_dates(col).tolist() == ['2024-01-05', None, '2024-01-05']
+
+
+def test_slash_dates_day_first_option():
+    col = pd.Series(['01/05/2024', '13/05/2024', '2024-01-05'])
+    assert parse_dates(col, day_first=True).tolist() == ['2024-05-01', '2024-05-13', '2024-01-05']
+
+
+def test_buddhist_era_years():
+    col = pd.Series(['2569-01-05', '01/05/2569', '2567-02-29 00:00:00', None, 'abc'])
+    assert parse_dates(col).tolist() == ['2026-01-05', '2026-01-05', '2024-02-29', None, None]
+
+
+def test_rejected_withdrawal_does_not_block_later_rows(db):
+    insert_materials(db, materials('In', [('2024-01-01', 'A-1', 'ถุงมือ', 10)]), 'In')
+    report = insert_materials(db, materials('Out', [('2024-01-02', 'A-1', 'ถุงมือ', q) for q in (6, 6, 3)]), 'Out')
+    assert report['inserted'] == 2
+    assert report['invalid']['row'].tolist() == [3]
+    assert stock(db, 'A-1') == 1
+
+
+def test_withdrawals_across_chunks_see_earlier_chunks(db):
+    insert_materials(db, materials('In', [('2024-01-01', 'A-1', 'ถุงมือ', 10)]), 'In')
+    chunks = [materials('Out', [('2024-01-02', 'A-1', 'ถุงมือ', 6)]),
+              materials('Out', [('2024-01-02', 'A-1', 'ถุงมือ', q) for q in (6, 3)], start=3)]
+    report = insert_materials(db, chunks, 'Out')
+    assert report['inserted'] == 2
+    assert report['invalid']['row'].tolist() == [3]
+    assert stock(db, 'A-1') == 1
+
+
+def test_unknown_item_cannot_be_withdrawn(db):
+    report = insert_materials(db, materials('Out', [('2024-01-02', 'X-9', 'ไม่มี', 1)]), 'Out')
+    assert report['inserted'] == 0
+    assert report['invalid']['reason'].tolist() == ['เบิกเกินยอดคงเหลือ (คงเหลือ 0.00)']
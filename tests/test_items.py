@@ -0,0 +1,64 @@
+"""ทดสอบทะเบียนวัสดุ ชื่อเรียก และการรวมวัสดุ (inventory_core.items)"""
+import pandas as pd
+
+from inventory_core import archive_before, balances_as_of, merge_items, read_balances, resolve_items
+
+from .conftest import add, as_of, recalculated
+
+DAYS = ['2024-01-31', '2024-02-15', '2024-03-01', '2024-03-31', '2024-05-01']
+
+
+def item_id(db, code):
+    return db.reader().execute("SELECT id FROM items WHERE item_code = ?", (code,)).fetchone()[0]
+
+
+def merged(totals):
+    """รวมยอดของ A-01 (รหัสพิมพ์ผิด) เข้ากับ A-1 แบบที่ควรได้หลัง merge_items"""
+    totals = dict(totals)
+    a, b = totals.pop('A-1', (0, 0)), totals.pop('A-01', (0, 0))
+    return {**totals, 'A-1': (a[0] + b[0], a[1] + b[1])}
+
+
+def seed(db):
+    add(db, 'In', [('2024-01-05', 'A-1', 'ถุงมือ', 10), ('2024-01-08', 'A-01', 'ถุงมือยาง', 6),
+                   ('2024-02-10', 'B-2', 'สำลี', 5), ('2024-03-02', 'A-01', 'ถุงมือยาง', 4)])
+    add(db, 'Out', [('2024-02-03', 'A-01', 'ถุงมือยาง', 5), ('2024-02-20', 'A-1', 'ถุงมือ', 3), ('2024-04-01', 'A-1', 'ถุงมือ', 2)])
+
+
+def test_resolve_items_by_code_then_name(db):
+    df = pd.DataFrame({'item_code': ['A-1', ' a-1 ', 'A-1', '-', None, '-'],
+                       'item_name': ['ถุงมือ', 'ถุงมือ', 'ถุงมือ  ยาง', 'สำลี', ' สำลี ', 'ผ้าก๊อซ']})
+    with db.write() as conn:
+        ids = resolve_items(conn, df).tolist()
+        again = resolve_items(conn, df).tolist()
+    assert ids[0] == ids[1] == ids[2]  # รหัสเดียวกัน ชื่อสะกดต่างกัน
+    assert ids[3] == ids[4] != ids[5]  # ไม่มีรหัส: แยกตามชื่อ
+    assert len(set(ids)) == 3 and again == ids
+    aliases = db.reader().execute("SELECT COUNT(*) FROM item_aliases").fetchone()[0]
+    assert aliases == 4  # (A-1, ถุงมือ), (A-1, ถุงมือ ยาง), ('', สำลี), ('', ผ้าก๊อซ)
+
+
+def test_merge_with_existing_checkpoints(db):
+    seed(db)
+    keep, other = item_id(db, 'A-1'), item_id(db, 'A-01')
+    checkpoints = db.reader().execute(
+        "SELECT month, TOTAL(qty_in), TOTAL(qty_out) FROM balance_checkpoints WHERE item_id IN (?, ?) GROUP BY month ORDER BY month",
+        (keep, other)).fetchall()
+    assert checkpoints
+    expected = {day: merged(recalculated(db, day)) for day in DAYS}
+    assert merge_items(db, keep, [other]) == 3
+    assert db.reader().execute("SELECT COUNT(*) FROM balance_checkpoints WHERE item_id = ?", (other,)).fetchone()[0] == 0
+    assert db.reader().execute("SELECT month, qty_in, qty_out FROM balance_checkpoints WHERE item_id = ? ORDER BY month",
+                               (keep,)).fetchall() == checkpoints
+    assert as_of(read_balances(db)) == recalculated(db) == merged(expected['2024-05-01'])
+    for day in DAYS:
+        assert as_of(balances_as_of(db, day)) == recalculated(db, day) == expected[day], day
+
+
+def test_merge_after_archive_keeps_history(db):
+    seed(db)
+    expected = {day: merged(as_of(balances_as_of(db, day))) for day in DAYS}
+    archive_before(db, '2024-03-01')
+    merge_items(db, item_id(db, 'A-1'), [item_id(db, 'A-01')])
+    for day in DAYS:
+        assert as_of(balances_as_of(db, day)) == expected[day], day
@@ -0,0 +1,110 @@
+"""ทดสอบคิวงานนำเข้า (inventory_core.jobs): กู้งานค้าง, ยกเลิก และล้างรอบเมื่อล้มเหลว"""
+import threading
+import time
+
+import pandas as pd
+
+from inventory_core import jobs
+from inventory_core.ingest import insert_materials
+from inventory_core.jobs import cancel_job, claim_next, close_job, recover_jobs, run_job, submit_job
+
+from .conftest import materials, stock
+
+HEADER = ['วันที่รับเข้า', 'รหัสวัสดุ', 'คำอธิบาย', 'จำนวน', 'หน่วย']
+
+
+def csv_job(db, tmp_path, quantities):
+    path = tmp_path / 'in.csv'
+    pd.DataFrame([['2024-01-05', 'A-1', 'ถุงมือ', q, 'กล่อง'] for q in quantities], columns=HEADER).to_csv(path, index=False)
+    return submit_job(db, 'material', 'In', str(path), total=len(quantities))
+
+
+def job_row(db, job_id):
+    return db.reader().execute("SELECT status, attempts, done_rows, cancel FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def batch_rows(db, batch_id):
+    return db.reader().execute("SELECT COUNT(*) FROM transactions WHERE batch_id = ?", (batch_id,)).fetchone()[0]
+
+
+def age(db, job_id, seconds):
+    with db.write() as conn:
+        conn.execute("UPDATE ingest_jobs SET heartbeat = heartbeat - ? WHERE id = ?", (seconds, job_id))
+
+
+def test_recover_requeues_stale_job_and_clears_partial_rows(db, tmp_path):
+    job_id = csv_job(db, tmp_path, [5, 7])
+    job = claim_next(db)
+    insert_materials(db, materials('In', [('2024-01-05', 'A-1', 'ถุงมือ', 5)]), 'In', job[6], batch_id=job[5])
+    assert recover_jobs(db) == 0  # heartbeat ยังใหม่: ไม่แตะงาน
+    age(db, job_id, jobs.JOB_STALE_SECONDS + 1)
+    assert recover_jobs(db) == 1
+    assert job_row(db, job_id)[:3] == ('queued', 1, 0)
+    assert batch_rows(db, job[5]) == 0
+    assert stock(db, 'A-1') in (None, 0)
+    assert run_job(db, claim_next(db), size=1) == 'done'
+    assert stock(db, 'A-1') == 12
+
+
+def test_recover_fails_job_after_max_attempts(db, tmp_path):
+    job_id = csv_job(db, tmp_path, [5])
+    job = claim_next(db)
+    with db.write() as conn:
+        conn.execute("UPDATE ingest_jobs SET attempts = ? WHERE id = ?", (jobs.JOB_MAX_ATTEMPTS, job_id))
+    age(db, job_id, jobs.JOB_STALE_SECONDS + 1)
+    assert recover_jobs(db) == 1
+    assert job_row(db, job_id)[0] == 'failed'
+    assert db.reader().execute("SELECT 1 FROM upload_batches WHERE id = ?", (job[5],)).fetchone() is None
+
+
+def test_heartbeat_runs_apart_from_insert_loop(db, tmp_path, monkeypatch):
+    job_id = csv_job(db, tmp_path, [5])
+    job = claim_next(db)
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_SECONDS', 0.05)
+    seen = []
+
+    def slow_insert(db, *args, **kwargs):
+        before = db.reader().execute("SELECT heartbeat FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        time.sleep(0.3)  # Chunk ที่ใช้เวลานาน ไม่มีการเรียก on_progress
+        seen.append(db.reader().execute("SELECT heartbeat FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()[0] > before)
+        return {'inserted': 0, 'invalid': pd.DataFrame(columns=['row', 'reason'])}
+
+    monkeypatch.setattr(jobs, 'insert_materials', slow_insert)
+    assert run_job(db, job) == 'done'
+    assert seen == [True]
+    for t in threading.enumerate():
+        if t.name == f"ingest-heartbeat-{job_id}":
+            t.join(1)
+            assert not t.is_alive()
+
+
+def test_cancel_queued_job_drops_batch(db, tmp_path):
+    job_id = csv_job(db, tmp_path, [5])
+    batch_id = db.reader().execute("SELECT batch_id FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert cancel_job(db, job_id) == 'queued'
+    assert job_row(db, job_id)[0] == 'cancelled'
+    assert db.reader().execute("SELECT 1 FROM upload_batches WHERE id = ?", (batch_id,)).fetchone() is None
+    assert claim_next(db) is None
+
+
+def test_cancel_running_job_stops_after_chunk_and_clears_rows(db, tmp_path):
+    job_id = csv_job(db, tmp_path, [5, 7, 9])
+    job = claim_next(db)
+    assert cancel_job(db, job_id) == 'running'
+    assert job_row(db, job_id)[3] == 1
+    assert run_job(db, job, size=1) == 'cancelled'
+    assert batch_rows(db, job[5]) == 0
+    assert stock(db, 'A-1') in (None, 0)
+
+
+def test_failed_job_rolls_back_batch(db, tmp_path):
+    job_id = csv_job(db, tmp_path, [5])
+    job = claim_next(db)
+    insert_materials(db, materials('In', [('2024-01-05', 'A-1', 'ถุงมือ', 5)]), 'In', job[6], batch_id=job[5])
+    assert stock(db, 'A-1') == 5
+    with db.write() as conn:
+        close_job(conn, job_id, 'failed', inserted=1, error='boom')
+    assert job_row(db, job_id)[0] == 'failed'
+    assert batch_rows(db, job[5]) == 0
+    assert stock(db, 'A-1') in (None, 0)
+    assert db.reader().execute("SELECT 1 FROM upload_batches WHERE id = ?", (job[5],)).fetchone() is None
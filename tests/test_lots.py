@@ -0,0 +1,50 @@
+"""ทดสอบล็อตวันหมดอายุแบบ FIFO (inventory_core.lots)"""
+from inventory_core import archive_before, delete_batch, expiring_lots, read_balances
+
+from .conftest import add, as_of
+
+
+def lots(db, start=None, end=None):
+    return [(e, b) for e, b in expiring_lots(db, start, end)[['expiry_date', 'Balance']].itertuples(index=False, name=None)]
+
+
+def receive(db):
+    add(db, 'In', [
+        ('2024-01-01', 'A-1', 'ยา', 10, '2024-03-31'),
+        ('2024-01-05', 'A-1', 'ยา', 5, '2024-02-28'),
+        ('2024-01-07', 'A-1', 'ยา', 8),  # ไม่มีวันหมดอายุ: ถูกตัดตามลำดับแต่ไม่เป็นล็อต
+        ('2024-01-09', 'A-1', 'ยา', 4, '2024-06-30'),
+    ])
+
+
+def test_outs_consume_receipts_in_date_order(db):
+    receive(db)
+    assert lots(db) == [('2024-02-28', 5), ('2024-03-31', 10), ('2024-06-30', 4)]
+    add(db, 'Out', [('2024-01-10', 'A-1', 'ยา', 12)])
+    assert lots(db) == [('2024-02-28', 3), ('2024-06-30', 4)]
+    out = add(db, 'Out', [('2024-01-11', 'A-1', 'ยา', 10)])
+    assert lots(db) == [('2024-06-30', 4)]  # 22 = 10 + 5 + 7 ของล็อตที่ไม่มีวันหมดอายุ
+    delete_batch(db, out)
+    assert lots(db) == [('2024-02-28', 3), ('2024-06-30', 4)]
+
+
+def test_expiring_lots_filters_by_expiry_range(db):
+    receive(db)
+    assert lots(db, '2024-03-01', '2024-03-31') == [('2024-03-31', 10)]
+    assert lots(db, None, '2024-02-28') == [('2024-02-28', 5)]
+
+
+def test_backdated_receipt_is_consumed_first(db):
+    receive(db)
+    add(db, 'Out', [('2024-01-10', 'A-1', 'ยา', 12)])
+    add(db, 'In', [('2023-12-01', 'A-1', 'ยา', 6, '2024-01-31')])
+    assert lots(db) == [('2024-02-28', 5), ('2024-03-31', 4), ('2024-06-30', 4)]
+
+
+def test_archive_carries_each_lot_once(db):
+    receive(db)
+    add(db, 'Out', [('2024-01-10', 'A-1', 'ยา', 12)])
+    before = lots(db), as_of(read_balances(db))
+    archive_before(db, '2024-02-01')
+    assert (lots(db), as_of(read_balances(db))) == before
+    assert as_of(read_balances(db)) == {'A-1': (27, 12)}
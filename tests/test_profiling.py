@@ -0,0 +1,47 @@
+"""ทดสอบการจบ Profiler และ Log ของ Rerun (inventory_core.profiling)"""
+import logging
+
+from inventory_core.profiling import Profiler, current
+
+
+class Lines(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+def logger():
+    log = logging.getLogger('tests.slow')
+    log.handlers[:] = [Lines()]
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    return log
+
+
+def test_fast_rerun_is_not_logged():
+    log = logger()
+    prof = Profiler('main', 10_000, log).activate()
+    prof.finish('page')
+    assert current() is None
+    assert log.handlers[0].lines == []
+
+
+def test_failed_rerun_is_always_logged():
+    log = logger()
+    prof = Profiler('main', 10_000, log).activate()
+    try:
+        try:
+            raise KeyError('item_id')
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            prof.finish('page', error)
+    except KeyError:
+        pass
+    assert current() is None
+    app, kind, label, _, detail = log.handlers[0].lines[0].split('\t')
+    assert (app, kind, label, detail) == ('main', 'error', 'page', "KeyError: 'item_id'")
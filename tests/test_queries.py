@@ -0,0 +1,49 @@
+"""ทดสอบการแบ่งหน้าแบบ Keyset (inventory_core.queries.read_page)"""
+import pandas as pd
+
+from inventory_core import read_page
+
+from .conftest import add
+
+
+def seed(db):
+    # 3 วัน วันละหลายแถว (ขอบหน้าตกกลางวันเดียวกัน) + แถวที่ไม่มีวันที่ 3 แถวต่อท้าย
+    add(db, 'In', [(day, f'A-{n}', 'ยา', n + 1) for day in ('2024-01-01', '2024-01-02', '2024-01-03') for n in range(4)])
+    with db.write() as conn:
+        conn.executemany("INSERT INTO transactions (date, item_code, item_name, action_type, quantity) VALUES (NULL, ?, 'ยา', 'In', 1)",
+                         [('X-1',), ('X-2',), ('X-3',)])
+    return [tuple(r) for r in db.reader().execute("SELECT date, id FROM transactions ORDER BY date IS NULL, date DESC, id DESC")]
+
+
+def walk(db, page_size, filters=None):
+    pages, cursor = [], None
+    while True:
+        page, cursor = read_page(db, 'transactions', ['date', 'item_code'], filters, cursor, page_size)
+        # compact_frame แปลงวันที่เป็น datetime64 (NaT = ไม่มีวันที่) เทียบกลับเป็นข้อความแบบในฐานข้อมูล
+        pages.append([(None if pd.isna(d) else f'{d:%Y-%m-%d}', int(i)) for d, i in page[['date', 'id']].itertuples(index=False)])
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once_in_order(db):
+    expected = seed(db)
+    for size in (1, 2, 5, 7, 14, 15, 50):
+        pages = walk(db, size)
+        assert [r for p in pages for r in p] == expected, size
+        assert all(len(p) == size for p in pages[:-1])
+        assert 0 < len(pages[-1]) <= size
+
+
+def test_page_boundary_inside_null_tail(db):
+    expected = seed(db)
+    first, cursor = read_page(db, 'transactions', None, None, None, 13)
+    assert cursor[0] is None and cursor[1] == expected[12][1]
+    rest, cursor = read_page(db, 'transactions', None, None, cursor, 13)
+    assert rest['id'].tolist() == [i for _, i in expected[13:]] and cursor is None
+
+
+def test_filters_apply_across_pages(db):
+    seed(db)
+    pages = walk(db, 2, {'start': '2024-01-02', 'end': '2024-01-02'})
+    assert [len(p) for p in pages] == [2, 2]
+    assert {d for p in pages for d, _ in p} == {'2024-01-02'}
@@ -1,13 +1,15 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+import tempfile
 import time
+from inventory_core import (INVENTORY_COLUMNS, XLSX_MIME, BalanceSnapshot, Database, FrameCache, calculate_inventory,
+                            change_marker, frame_chunks, read_table, search_balances, write_csv, write_xlsx)
 
 # --- ตั้งค่าหน้าเว็บ ---
 st.set_page_config(page_title="ตรวจสอบวัสดุ (Viewer)", layout="wide")
 
 # ==========================================
-# 1. ฟังก์ชันโหลดและคำนวณ (เหมือนไฟล์ Admin)
+# 1. ฟังก์ชันโหลดและคำนวณ (ใช้ inventory_core ชุดเดียวกับไฟล์ Admin)
 # ==========================================
 import os
 
@@ -16,159 +18,171 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # สั่งให้สร้าง DB ในโฟลเดอร์เดียวกันนี้แหละ
 DB_NAME = os.path.join(BASE_DIR, 'inventory_final.db')
 
-def load_data():
-    """โหลดข้อมูลแบบ Real-time (ไม่ใช้ Cache)"""
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql_query("SELECT * FROM transactions", conn)
-        conn.close()
-        return df
-    except Exception as e:
-        return pd.DataFrame()
+# จำนวนรายการต่อหน้าของการค้นหา
+PAGE_SIZE = 20
+# ขนาดสูงสุดของ Cache ข้อมูลที่ใช้ร่วมกันทุก Session (MB)
+CACHE_MAX_MB = 128
+# ความถี่ในการเช็คการเปลี่ยนแปลงเมื่อเปิดอัปเดตอัตโนมัติ (วินาที)
+AUTO_REFRESH_SECONDS = 10
 
-def calculate_inventory(df):
-    """คำนวณยอดคงเหลือ + ดึง Category/Expiry ให้ครบถ้วน"""
-    if df.empty:
-        return pd.DataFrame()
-    
-    # แปลง Type เพื่อป้องกัน Error เวลา Merge
-    df['item_code'] = df['item_code'].astype(str)
-    df['item_name'] = df['item_name'].astype(str)
-
-    # 1. Group ยอด (In - Out)
-    balance_df = df.pivot_table(
-        index=['item_code', 'item_name'], 
-        columns='action_type', 
-        values='quantity', 
-        aggfunc='sum', 
-        fill_value=0
-    ).reset_index()
-    
-    # 2. หา Unit ล่าสุด
-    latest_unit = df.sort_values('date', ascending=False).drop_duplicates(subset=['item_code', 'item_name'])
-    
-    # 3. หา Category ที่ถูกต้อง (กรองเอาเฉพาะที่มีค่า)
-    valid_cats = df[(df['category'].notna()) & (df['category'] != '') & (df['category'] != '-') & (df['category'] != 'None')]
-    if not valid_cats.empty:
-        best_category = valid_cats.sort_values('date', ascending=False).drop_duplicates(subset=['item_code', 'item_name'])[['item_code', 'item_name', 'category']]
-    else:
-        best_category = pd.DataFrame(columns=['item_code', 'item_name', 'category'])
+@st.cache_resource
+def get_db():
+    """เปิดแบบอ่านอย่างเดียว (query_only) -- หน้าจอนี้ไม่เขียนฐานข้อมูลและไม่สร้างตาราง (ไฟล์ Admin เป็นผู้สร้าง)"""
+    return Database(DB_NAME, read_only=True)
 
-    # 4. หาวันหมดอายุ (เร็วที่สุด)
-    valid_expiry = df[(df['action_type'] == 'In') & (df['expiry_date'].notna()) & (df['expiry_date'] != '')]
-    if not valid_expiry.empty:
-        earliest_expiry = valid_expiry.groupby(['item_code', 'item_name'])['expiry_date'].min().reset_index()
-    else:
-        earliest_expiry = pd.DataFrame(columns=['item_code', 'item_name', 'expiry_date'])
+@st.cache_resource
+def get_frame_cache():
+    return FrameCache(CACHE_MAX_MB * 1024 * 1024)
 
-    # 5. Merge รวมร่าง
-    balance_df = pd.merge(balance_df, latest_unit[['item_code', 'item_name', 'unit']], on=['item_code', 'item_name'], how='left')
-    balance_df = pd.merge(balance_df, best_category, on=['item_code', 'item_name'], how='left')
-    balance_df = pd.merge(balance_df, earliest_expiry, on=['item_code', 'item_name'], how='left')
+def load_data():
+    """โหลดเฉพาะคอลัมน์ที่ใช้คำนวณยอด (Cache กลางจะโหลดใหม่เฉพาะเมื่อข้อมูลในฐานข้อมูลเปลี่ยน)"""
+    try:
+        return get_frame_cache().fetch(get_db(), 'transactions', ('transactions',), lambda: read_table(get_db(), 'transactions', INVENTORY_COLUMNS))
+    except Exception:
+        return pd.DataFrame()
 
-    # จัดการค่าว่าง
-    balance_df['category'] = balance_df['category'].fillna('-')
-    balance_df['unit'] = balance_df['unit'].fillna('')
+@st.cache_resource
+def get_snapshot():
+    return BalanceSnapshot(get_db())
 
-    if 'In' not in balance_df.columns: balance_df['In'] = 0.0
-    if 'Out' not in balance_df.columns: balance_df['Out'] = 0.0
-    balance_df['Balance'] = balance_df['In'] - balance_df['Out']
-    
-    return balance_df
+def load_balances():
+    """ยอดคงเหลือจาก Snapshot กลาง (คืน None ถ้า Admin ยังไม่ได้สร้างตาราง item_balances / table_versions)"""
+    try:
+        return get_snapshot().refresh()
+    except Exception:
+        return None
+
+def export_button(label, name, chunks, key):
+    """ปุ่มดาวน์โหลดที่สร้างไฟล์เมื่อกดเท่านั้น (เขียนทีละ Chunk ลงไฟล์ชั่วคราว ไม่สร้างใหม่ทุกครั้งที่ Rerun)"""
+    c1, c2 = st.columns([1, 3])
+    fmt = c1.radio("รูปแบบไฟล์", ["CSV", "Excel"], horizontal=True, key=f"{key}_fmt", label_visibility="collapsed")
+    if c2.button(label, key=key):
+        ext, mime, write = ('csv', 'text/csv', write_csv) if fmt == "CSV" else ('xlsx', XLSX_MIME, write_xlsx)
+        with tempfile.TemporaryFile() as f:
+            write(chunks(), f)
+            f.seek(0)
+            c2.download_button(f"💾 บันทึก {name}.{ext}", f, f"{name}.{ext}", mime, key=f"{key}_dl")
+
+def current_marker():
+    try:
+        return change_marker(get_db().reader())
+    except Exception:
+        return None
 
 # ==========================================
 # 2. ส่วนหน้าจอเว็บไซต์ (User UI)
 # ==========================================
-st.title("📦 ระบบตรวจสอบวัสดุคงคลัง (สำหรับหน่วยงาน)")
-st.caption("ข้อมูลล่าสุด (Real-time View)")
-
-# Sidebar
-st.sidebar.header("เมนูใช้งาน")
-menu = ["🔍 ค้นหาวัสดุ (Search)", "📋 รายการวัสดุคงเหลือทั้งหมด"]
-choice = st.sidebar.radio("เลือกเมนู:", menu)
-
-st.sidebar.markdown("---")
-if st.sidebar.button("🔄 กดเพื่ออัปเดตข้อมูลล่าสุด"):
-    st.rerun()
-st.sidebar.caption(f"ข้อมูล ณ เวลา: {time.strftime('%H:%M:%S')}")
-
-# โหลดข้อมูล
-df = load_data()
-if not df.empty:
-    view_df = calculate_inventory(df)
-else:
-    view_df = pd.DataFrame()
-
-# --- หน้า 1: ค้นหา ---
-if choice == "🔍 ค้นหาวัสดุ (Search)":
-    st.subheader("🔍 ค้นหาและตรวจสอบยอด")
-    
-    if not view_df.empty:
-        txt = st.text_input("พิมพ์รหัส หรือ ชื่อวัสดุ:", placeholder="ค้นหา...")
-        
-        if txt:
-            # ค้นหาแบบยืดหยุ่น (Case Insensitive)
-            mask = view_df.astype(str).apply(lambda x: x.str.contains(txt, case=False, na=False)).any(axis=1)
-            res = view_df[mask]
-            
-            if not res.empty:
-                st.info(f"พบ {len(res)} รายการ")
-                for i, r in res.iterrows():
-                    with st.container():
-                        c1, c2, c3, c4 = st.columns([2.5, 1, 1, 1.2])
-                        with c1:
-                            st.markdown(f"**{r['item_name']}**")
-                            # แสดง Category และ Exp
-                            exp_txt = f" | Exp: {r['expiry_date']}" if pd.notna(r['expiry_date']) else ""
-                            st.caption(f"Code: {r['item_code']} | Type: {r['category']}{exp_txt}")
-                        with c2:
-                            st.metric("รับเข้า", f"{r['In']:,.2f}")
-                        with c3:
-                            st.metric("เบิกออก", f"{r['Out']:,.2f}")
-                        with c4:
-                            st.metric("คงเหลือ", f"{r['Balance']:,.2f} {r['unit']}", 
-                                      delta_color="off" if r['Balance']>0 else "inverse")
-                        st.divider()
-            else: st.warning("ไม่พบข้อมูล")
-    else: st.warning("ไม่พบฐานข้อมูล หรือฐานข้อมูลว่างเปล่า")
-
-# --- หน้า 2: ดูทั้งหมด ---
-elif choice == "📋 รายการวัสดุคงเหลือทั้งหมด":
-    st.subheader("📋 สรุปยอดวัสดุทั้งหมดในคลัง")
-    if not view_df.empty:
-        # ตัวกรอง
-        cats = sorted([c for c in view_df['category'].unique() if c != '-'])
-        all_cats = ["ทั้งหมด"] + cats
-        sel = st.selectbox("กรองตามหมวดหมู่:", all_cats)
-        
-        show = view_df.copy()
-        if sel != "ทั้งหมด": show = show[show['category'] == sel]
-        
-        # ปุ่ม Download CSV
-        csv = show.to_csv(index=False).encode('utf-8-sig')
-        st.download_button("📥 ดาวน์โหลดตารางนี้ (Excel/CSV)", csv, "stock_view.csv", "text/csv")
-        
-        # แสดงตาราง
-        st.dataframe(
-            show[['item_code','item_name','category','In','Out','Balance','unit','expiry_date']], 
-            use_container_width=True, 
-            hide_index=True,
-            column_config={
-                "item_code": "รหัส", "item_name": "ชื่อรายการ", "category": "หมวดหมู่",
-                "In": st.column_config.NumberColumn("รับเข้า", format="%.2f"),
-                "Out": st.column_config.NumberColumn("จ่ายออก", format="%.2f"),
-                "Balance": st.column_config.NumberColumn("คงเหลือ", format="%.2f"),
-                "unit": "หน่วย",
-                "expiry_date": st.column_config.DateColumn("วันหมดอายุ", format="DD/MM/YYYY")
-            }
-        )
-    else: st.info("ไม่มีข้อมูล")
-
-# ซ่อนเมนูขีดสามขีดของ Streamlit เพื่อความสวยงาม
-st.markdown("""
+# st.rerun()/st.stop() ก็ผ่าน finally: คืน Connection อ่านเข้า Pool ตอนจบทุก Rerun
+try:
+    st.title("📦 ระบบตรวจสอบวัสดุคงคลัง (สำหรับหน่วยงาน)")
+    st.caption("ข้อมูลล่าสุด (Real-time View)")
+
+    # Sidebar
+    st.sidebar.header("เมนูใช้งาน")
+    menu = ["🔍 ค้นหาวัสดุ (Search)", "📋 รายการวัสดุคงเหลือทั้งหมด"]
+    choice = st.sidebar.radio("เลือกเมนู:", menu)
+
+    st.sidebar.markdown("---")
+    if st.sidebar.button("🔄 กดเพื่ออัปเดตข้อมูลล่าสุด"):
+        st.rerun()
+    st.sidebar.caption(f"ข้อมูล ณ เวลา: {time.strftime('%H:%M:%S')}")
+
+    # อัปเดตอัตโนมัติ: เช็คเฉพาะตัวบอกการเปลี่ยนแปลง (แถวเดียว) แล้ว rerun เมื่อข้อมูลเปลี่ยนจริงเท่านั้น
+    st.session_state['shown_marker'] = current_marker()
+    if hasattr(st, 'fragment') and st.sidebar.toggle("⏱️ อัปเดตอัตโนมัติเมื่อข้อมูลเปลี่ยน"):
+        @st.fragment(run_every=AUTO_REFRESH_SECONDS)
+        def watch_changes():
+            if current_marker() != st.session_state.get('shown_marker'):
+                st.rerun()
+        with st.sidebar:
+            watch_changes()
+
+    # โหลดข้อมูล (ใช้ยอดคงเหลือที่ Admin อัปเดตไว้ ถ้ายังไม่มีตารางให้คำนวณจากประวัติเหมือนเดิม)
+    view_df = load_balances()
+    if view_df is None:
+        df = load_data()
+        view_df = calculate_inventory(df) if not df.empty else pd.DataFrame()
+    else:
+        snap = get_snapshot()
+        st.sidebar.caption(f"🗄️ โหลดทั้งหมด {snap.full_loads:,} ครั้ง | เฉพาะส่วนเพิ่ม {snap.delta_loads:,} ครั้ง")
+
+    # --- หน้า 1: ค้นหา ---
+    if choice == "🔍 ค้นหาวัสดุ (Search)":
+        st.subheader("🔍 ค้นหาและตรวจสอบยอด")
+
+        if not view_df.empty:
+            c_txt, c_page = st.columns([3, 1])
+            txt = c_txt.text_input("พิมพ์รหัส หรือ ชื่อวัสดุ:", placeholder="ค้นหา...").strip()
+            page = c_page.number_input("หน้า:", min_value=1, value=1, step=1)
+
+            if txt:
+                # ค้นหาผ่าน Full-text index (ไม่ต้องแปลงทุกคอลัมน์เป็นข้อความแล้วไล่หา)
+                try:
+                    res, total = search_balances(get_db(), txt, page, PAGE_SIZE)
+                except Exception:
+                    mask = view_df.astype(str).apply(lambda x: x.str.contains(txt, case=False, na=False)).any(axis=1)
+                    res = view_df[mask]
+                    total = len(res)
+
+                if not res.empty:
+                    st.info(f"พบ {total} รายการ (หน้า {page}/{-(-total // PAGE_SIZE)})")
+                    for i, r in res.iterrows():
+                        with st.container():
+                            c1, c2, c3, c4 = st.columns([2.5, 1, 1, 1.2])
+                            with c1:
+                                st.markdown(f"**{r['item_name']}**")
+                                # แสดง Category และ Exp
+                                exp_txt = f" | Exp: {r['expiry_date']}" if pd.notna(r['expiry_date']) else ""
+                                st.caption(f"Code: {r['item_code']} | Type: {r['category']}{exp_txt}")
+                            with c2:
+                                st.metric("รับเข้า", f"{r['In']:,.2f}")
+                            with c3:
+                                st.metric("เบิกออก", f"{r['Out']:,.2f}")
+                            with c4:
+                                st.metric("คงเหลือ", f"{r['Balance']:,.2f} {r['unit']}", 
+                                          delta_color="off" if r['Balance']>0 else "inverse")
+                            st.divider()
+                else: st.warning("ไม่พบข้อมูล")
+        else: st.warning("ไม่พบฐานข้อมูล หรือฐานข้อมูลว่างเปล่า")
+
+    # --- หน้า 2: ดูทั้งหมด ---
+    elif choice == "📋 รายการวัสดุคงเหลือทั้งหมด":
+        st.subheader("📋 สรุปยอดวัสดุทั้งหมดในคลัง")
+        if not view_df.empty:
+            # ตัวกรอง
+            cats = sorted([c for c in view_df['category'].unique() if c != '-'])
+            all_cats = ["ทั้งหมด"] + cats
+            sel = st.selectbox("กรองตามหมวดหมู่:", all_cats)
+
+            show = view_df.copy()
+            if sel != "ทั้งหมด": show = show[show['category'] == sel]
+
+            # ปุ่ม Download (สร้างไฟล์เมื่อกดเท่านั้น)
+            export_button("📥 ดาวน์โหลดตารางนี้", "stock_view", lambda: frame_chunks(show), "dl_view")
+
+            # แสดงตาราง
+            st.dataframe(
+                show[['item_code','item_name','category','In','Out','Balance','unit','expiry_date']], 
+                use_container_width=True, 
+                hide_index=True,
+                column_config={
+                    "item_code": "รหัส", "item_name": "ชื่อรายการ", "category": "หมวดหมู่",
+                    "In": st.column_config.NumberColumn("รับเข้า", format="%.2f"),
+                    "Out": st.column_config.NumberColumn("จ่ายออก", format="%.2f"),
+                    "Balance": st.column_config.NumberColumn("คงเหลือ", format="%.2f"),
+                    "unit": "หน่วย",
+                    "expiry_date": st.column_config.DateColumn("วันหมดอายุ", format="DD/MM/YYYY")
+                }
+            )
+        else: st.info("ไม่มีข้อมูล")
+
+    # ซ่อนเมนูขีดสามขีดของ Streamlit เพื่อความสวยงาม
+    st.markdown("""
 <style>
 #MainMenu {visibility: hidden;}
 footer {visibility: hidden;}
 header {visibility: hidden;}
 </style>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+finally:
+    get_db().release_reader()
\ No newline at end of file